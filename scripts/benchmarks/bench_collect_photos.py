@@ -0,0 +1,104 @@
+"""
+Photo discovery benchmark: glob-per-pattern (previous collect_photos) vs the
+single-pass scandir walker, cold and with a warm directory manifest.
+
+    python scripts/benchmarks/bench_collect_photos.py --dirs 200 --files 300
+    python scripts/benchmarks/bench_collect_photos.py --root //nas/share/photos
+
+Runs with plain Python, no Metashape needed.
+"""
+from __future__ import annotations
+import argparse
+import glob
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import List
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(THIS_DIR))
+
+from ms_pipeline.photos import discover_photos
+
+PATTERNS = ["*.JPG", "*.jpg", "*.tif", "*.tiff"]
+
+def legacy_collect_photos(photo_dirs: List[str], globs_: List[str], recursive: bool) -> List[str]:
+    # Previous implementation, kept verbatim for comparison
+    paths: List[str] = []
+    for d in photo_dirs:
+        if not d:
+            continue
+        d = os.path.abspath(d)
+        if not os.path.isdir(d):
+            continue
+        for pattern in globs_:
+            g = os.path.join(d, pattern)
+            paths.extend(glob.glob(g, recursive=recursive))
+    seen = set()
+    out = []
+    for p in paths:
+        ap = os.path.abspath(p)
+        if ap not in seen and os.path.isfile(ap):
+            seen.add(ap)
+            out.append(ap)
+    return out
+
+def make_tree(root: str, n_dirs: int, n_files: int) -> None:
+    exts = [".JPG", ".jpg", ".tif", ".xml"]
+    for d in range(n_dirs):
+        sub = os.path.join(root, f"flight_{d // 20:03d}", f"block_{d:04d}")
+        os.makedirs(sub, exist_ok=True)
+        for i in range(n_files):
+            with open(os.path.join(sub, f"IMG_{i:05d}{exts[i % len(exts)]}"), "wb") as f:
+                f.write(b"\0" * 64)
+
+def timed(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def main(argv: List[str]) -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--root", default="", help="existing photo tree (default: build a synthetic one)")
+    ap.add_argument("--dirs", type=int, default=100)
+    ap.add_argument("--files", type=int, default=200, help="files per directory")
+    ap.add_argument("--workers", type=int, default=8)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args(argv)
+
+    tmp = tempfile.mkdtemp(prefix="bench_photos_")
+    try:
+        root = args.root
+        if not root:
+            root = os.path.join(tmp, "photos")
+            make_tree(root, args.dirs, args.files)
+        manifest = os.path.join(tmp, "photos.json")
+
+        # Legacy globs only see the top level; give it the "**/" patterns it would need
+        legacy_patterns = [os.path.join("**", p) for p in PATTERNS]
+        n_legacy = len(legacy_collect_photos([root], legacy_patterns, True))
+        n_new = len(discover_photos([root], PATTERNS, True))
+
+        rows = [
+            ("glob per pattern", timed(lambda: legacy_collect_photos([root], legacy_patterns, True), args.repeat)),
+            ("scandir, cold", timed(lambda: discover_photos([root], PATTERNS, True, workers=args.workers), args.repeat)),
+        ]
+        discover_photos([root], PATTERNS, True, manifest_path=manifest, workers=args.workers)
+        rows.append(("scandir, warm manifest", timed(
+            lambda: discover_photos([root], PATTERNS, True, manifest_path=manifest, workers=args.workers), args.repeat)))
+
+        print(f"root: {root}")
+        print(f"photos: legacy={n_legacy} scandir={n_new}")
+        base = rows[0][1]
+        for label, sec in rows:
+            print(f"{label:<24} {sec * 1000:10.1f} ms  x{base / sec:5.1f}")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,69 @@
+"""
+Logger throughput: the previous open/append/close-per-message Logger vs the
+queued background-writer Logger (human + JSON records).
+
+    python scripts/benchmarks/bench_logger.py --messages 50000
+    python scripts/benchmarks/bench_logger.py --dir //nas/share/logs
+
+Console echo is disabled for both so the numbers are file I/O only.
+"""
+from __future__ import annotations
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+from typing import List
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(THIS_DIR))
+
+from ms_pipeline.log import Logger
+
+class LegacyLogger:
+    # Previous implementation minus the print()
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+
+    def info(self, msg: str) -> None:
+        ts = time.strftime("%Y-%m-%d %H:%M:%S")
+        line = f"[{ts}] INFO: {msg}"
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+def main(argv: List[str]) -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--messages", type=int, default=20000)
+    ap.add_argument("--dir", default="", help="directory to log into (default: temp dir)")
+    args = ap.parse_args(argv)
+
+    tmp = tempfile.mkdtemp(prefix="bench_log_", dir=args.dir or None)
+    try:
+        n = args.messages
+
+        legacy = LegacyLogger(os.path.join(tmp, "legacy", "run.log"))
+        t0 = time.perf_counter()
+        for i in range(n):
+            legacy.info(f"progress tick {i}")
+        t_legacy = time.perf_counter() - t0
+
+        log = Logger(os.path.join(tmp, "queued", "run.log"), echo=False)
+        log.bind(stage="bench")
+        t0 = time.perf_counter()
+        for i in range(n):
+            log.info(f"progress tick {i}", tick=i)
+        t_call = time.perf_counter() - t0
+        log.close()
+        t_total = time.perf_counter() - t0
+
+        print(f"messages: {n}  dir: {tmp}")
+        print(f"{'legacy (open/close per line)':<34} {n / t_legacy:12.0f} msg/s")
+        print(f"{'queued, caller side':<34} {n / t_call:12.0f} msg/s")
+        print(f"{'queued, incl. drain to disk':<34} {n / t_total:12.0f} msg/s")
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
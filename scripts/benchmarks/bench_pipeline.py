@@ -0,0 +1,248 @@
+"""
+Python-layer benchmarks on the fake Metashape module (scripts/fake_metashape):
+photo discovery, QC metrics, logging, export fan-out and a full workflow run
+with zero simulated processing time, so only orchestration overhead is timed.
+
+    python scripts/benchmarks/bench_pipeline.py
+    python scripts/benchmarks/bench_pipeline.py --sizes 1000,10000 --only qc,logging
+    python scripts/benchmarks/bench_pipeline.py --update-baseline
+
+Results (best of --repeat, seconds) are written to --out and compared with
+the --baseline file: a benchmark slower than the baseline by more than
+--tolerance (and by more than --min-delta seconds) is a regression, and the
+script exits with status 1. --update-baseline stores this run as the new
+baseline. Baselines are machine specific: record them on the machine that
+runs the comparison.
+"""
+from __future__ import annotations
+import argparse
+import contextlib
+import copy
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.dirname(THIS_DIR)
+REPO_ROOT = os.path.dirname(SCRIPTS_DIR)
+FAKE_DIR = os.path.join(SCRIPTS_DIR, "fake_metashape")
+sys.path.insert(0, SCRIPTS_DIR)
+sys.path.insert(0, FAKE_DIR)
+
+# Zero latency unless the caller set one: worker processes read the same settings
+os.environ.setdefault("METASHAPE_FAKE_CONFIG", json.dumps({"tie_points_per_camera": 50}))
+
+import Metashape  # noqa: E402  (the fake)
+import run_workflow  # noqa: E402
+from ms_pipeline.exports import export_products  # noqa: E402
+from ms_pipeline.log import Logger  # noqa: E402
+from ms_pipeline.photos import discover_photos  # noqa: E402
+from ms_pipeline.qc import qc_report  # noqa: E402
+
+BENCHMARKS = ("discovery", "qc", "logging", "exports", "workflow")
+PATTERNS = ["*.JPG", "*.jpg", "*.tif", "*.tiff"]
+PHOTOS_PER_DIR = 500
+CONFIG_TEMPLATE = os.path.join(REPO_ROOT, "workflows", "aerial_rtk_no_gcps", "config.json")
+
+def make_photos(root: str, n: int) -> List[str]:
+    paths = []
+    for i in range(n):
+        d = os.path.join(root, f"flight_{i // (PHOTOS_PER_DIR * 20):03d}", f"block_{i // PHOTOS_PER_DIR:04d}")
+        if not i % PHOTOS_PER_DIR:
+            os.makedirs(d, exist_ok=True)
+        p = os.path.join(d, f"IMG_{i:06d}.JPG")
+        with open(p, "wb") as f:
+            f.write(b"\xff\xd8")
+        paths.append(p)
+    return paths
+
+def aligned_chunk(paths: List[str]) -> Any:
+    doc = Metashape.Document()
+    chunk = doc.addChunk()
+    chunk.addPhotos(paths)
+    chunk.alignCameras()
+    chunk.buildDepthMaps()
+    chunk.buildPointCloud()
+    chunk.buildDem()
+    chunk.buildOrthomosaic()
+    return chunk
+
+def export_config(out_dir: str, workers: int) -> Dict[str, Any]:
+    tiles = {"nx": 4, "ny": 4}
+    return {
+        "output_dir": out_dir,
+        "workers": workers,
+        "retries": 0,
+        "report": {"enabled": True, "path": os.path.join(out_dir, "report.pdf")},
+        "rasters": [
+            {"path": os.path.join(out_dir, "dem.tif"), "source_data": "ElevationData", "tiles": tiles},
+            {"path": os.path.join(out_dir, "ortho.tif"), "source_data": "OrthomosaicData", "tiles": tiles},
+        ],
+        "point_clouds": [{"path": os.path.join(out_dir, "cloud.laz"), "format": "PointCloudFormatLAZ"}],
+    }
+
+def workflow_config(tmp: str, photo_root: str) -> str:
+    with open(CONFIG_TEMPLATE, "r", encoding="utf-8") as f:
+        cfg = json.load(f)
+    cfg["project"]["project_path"] = os.path.join(tmp, "project.psx")
+    cfg["input"]["photo_dirs"] = [photo_root]
+    # The photos are empty files: skip the EXIF checks
+    cfg["input"]["metadata"]["enabled"] = False
+    cfg["export"] = export_config(os.path.join(tmp, "exports"), 0)
+    path = os.path.join(tmp, "config.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(cfg, f, indent=2)
+    return path
+
+def timed(fn: Callable[[], Any], repeat: int, setup: Callable[[], Any] = lambda: None) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        setup()
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+def run_size(n: int, only: List[str], repeat: int, workers: int) -> Dict[str, float]:
+    out: Dict[str, float] = {}
+    tmp = tempfile.mkdtemp(prefix=f"bench_pipeline_{n}_")
+    try:
+        root = os.path.join(tmp, "photos")
+        paths = make_photos(root, n)
+        if "discovery" in only:
+            manifest = os.path.join(tmp, "photos.json")
+            drop = lambda: os.path.isfile(manifest) and os.remove(manifest)  # noqa: E731
+            out["discovery_cold"] = timed(lambda: discover_photos([root], PATTERNS, True, manifest), repeat, drop)
+            out["discovery_warm"] = timed(lambda: discover_photos([root], PATTERNS, True, manifest), repeat)
+
+        if "qc" in only or "exports" in only:
+            chunk = aligned_chunk(paths)
+        if "qc" in only:
+            qc_cfg = {"max_cameras": 5000, "gates": {"max_reprojection_error_p95": 1.0}}
+            out["qc_report"] = timed(lambda: qc_report(Metashape, chunk, qc_cfg, "bench"), repeat)
+
+        if "logging" in only:
+            def log_messages() -> None:
+                log = Logger(os.path.join(tmp, "logs", "bench.log"), echo=False)
+                for i in range(n):
+                    log.info(f"message {i}", camera=i)
+                log.close()
+            out["logging"] = timed(log_messages, repeat)
+
+        if "exports" in only:
+            out_dir = os.path.join(tmp, "exports")
+            clean = lambda: shutil.rmtree(out_dir, ignore_errors=True)  # noqa: E731
+            quiet = lambda msg: None  # noqa: E731
+            log = type("Quiet", (), {"info": staticmethod(quiet), "warn": staticmethod(quiet)})()
+            out["exports_inprocess"] = timed(
+                lambda: export_products(Metashape, chunk, export_config(out_dir, 0), log), repeat, clean)
+            if workers:
+                project = os.path.join(tmp, "exports.psx")
+                chunk._doc.save(project)
+                workers_cfg = {"metashape_exe": os.path.join(FAKE_DIR, "launcher.py"), "offscreen": False}
+                out["exports_workers"] = timed(
+                    lambda: export_products(Metashape, chunk, export_config(out_dir, workers), log,
+                                            project=project, workers_cfg=workers_cfg), repeat, clean)
+
+        if "workflow" in only:
+            config = workflow_config(tmp, root)
+            name = f"bench_pipeline_{n}"
+
+            def reset() -> None:
+                shutil.rmtree(os.path.join(REPO_ROOT, "logs", name), ignore_errors=True)
+                for p in os.listdir(tmp):
+                    if p.startswith("project") or p == "exports":
+                        q = os.path.join(tmp, p)
+                        shutil.rmtree(q) if os.path.isdir(q) else os.remove(q)
+            # The run logs to the console as well; that is not what is being measured
+            try:
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    out["workflow"] = timed(lambda: run_workflow.run(config, name), repeat, reset)
+            finally:
+                reset()
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+    return out
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+            tolerance: float, min_delta: float) -> List[str]:
+    regressions = []
+    print(f"\n{'benchmark':<20} {'size':>8} {'seconds':>10} {'baseline':>10} {'change':>8}")
+    for bench, by_size in results.items():
+        for size, sec in by_size.items():
+            base = baseline.get(bench, {}).get(size)
+            if base is None:
+                print(f"{bench:<20} {size:>8} {sec:10.3f} {'-':>10} {'':>8}")
+                continue
+            change = sec / base - 1.0 if base > 0 else 0.0
+            bad = change > tolerance and sec - base > min_delta
+            print(f"{bench:<20} {size:>8} {sec:10.3f} {base:10.3f} {change:+7.0%}" + ("  REGRESSION" if bad else ""))
+            if bad:
+                regressions.append(f"{bench}/{size}")
+    return regressions
+
+def main(argv: List[str]) -> None:
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sizes", default="1000,10000,100000", help="camera counts")
+    ap.add_argument("--only", default=",".join(BENCHMARKS), help="benchmarks to run: " + ",".join(BENCHMARKS))
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--workers", type=int, default=4, help="worker processes for the export fan-out (0 = skip)")
+    ap.add_argument("--out", default=os.path.join(REPO_ROOT, "logs", "benchmarks", "bench_pipeline.json"))
+    ap.add_argument("--baseline", default=os.path.join(REPO_ROOT, "logs", "benchmarks", "baseline.json"))
+    ap.add_argument("--update-baseline", action="store_true")
+    ap.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown (0.25 = 25%%)")
+    ap.add_argument("--min-delta", type=float, default=0.05, help="ignore slowdowns below this many seconds")
+    args = ap.parse_args(argv)
+
+    only = [b.strip() for b in args.only.split(",") if b.strip()]
+    unknown = sorted(set(only) - set(BENCHMARKS))
+    if unknown:
+        ap.error(f"unknown benchmark(s): {', '.join(unknown)}")
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+
+    results: Dict[str, Dict[str, float]] = {}
+    for n in sizes:
+        t0 = time.perf_counter()
+        for bench, sec in run_size(n, only, args.repeat, args.workers).items():
+            results.setdefault(bench, {})[str(n)] = round(sec, 4)
+        print(f"{n} cameras: {time.perf_counter() - t0:.1f} s")
+
+    report = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": platform.node(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "fake_settings": Metashape.settings,
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    baseline: Dict[str, Any] = {}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    regressions = compare(results, baseline.get("results", {}), args.tolerance, args.min_delta)
+    print(f"\nresults: {args.out}")
+
+    if args.update_baseline:
+        # Keep baseline entries this run did not measure
+        merged = copy.deepcopy(baseline.get("results", {}))
+        for bench, by_size in results.items():
+            merged.setdefault(bench, {}).update(by_size)
+        os.makedirs(os.path.dirname(os.path.abspath(args.baseline)), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(dict(report, results=merged), f, indent=2)
+        print(f"baseline updated: {args.baseline}")
+    elif regressions:
+        print(f"regressions: {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,672 @@
+"""
+Offline stand-in for the Metashape Python module, for running and
+benchmarking the pipeline without a licence or GPU. Only the API surface the
+scripts use is implemented; processing calls sleep for a configurable time,
+report progress and fill in synthetic results (camera poses, tie points with
+gradual selection values, point counts, raster extents, export files with
+valid headers).
+
+Put this directory first on sys.path (scripts/fake_metashape/launcher.py does
+that for worker subprocesses). Settings come from configure() or, so worker
+processes see the same ones, the METASHAPE_FAKE_CONFIG environment variable
+(a JSON object or the path of a JSON file):
+
+    seed                   random seed for poses and tie point values (default 0)
+    latency                call name -> seconds per call
+    latency_per_camera     call name -> seconds per enabled camera
+    speed                  divides every latency (default 1)
+    aligned_fraction       cameras that align (default 1.0)
+    tie_points_per_camera  tie points added per aligned camera (default 100)
+    points_per_camera      point cloud points per aligned camera (default 20000)
+    camera_spacing_m       camera grid spacing (default 20)
+    grid_columns           cameras per grid row (default 100)
+    gps_noise_m            camera/marker position error after alignment (default 0.02)
+    export_bytes           payload size of exported files (default 4096)
+    fail                   call names that raise RuntimeError
+"""
+from __future__ import annotations
+import copy
+import csv
+import json
+import math
+import os
+import pickle
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+version = "2.1.0-fake"
+
+DEFAULTS: Dict[str, Any] = {
+    "seed": 0,
+    "latency": {},
+    "latency_per_camera": {},
+    "speed": 1.0,
+    "aligned_fraction": 1.0,
+    "tie_points_per_camera": 100,
+    "points_per_camera": 20000,
+    "camera_spacing_m": 20.0,
+    "grid_columns": 100,
+    "gps_noise_m": 0.02,
+    "export_bytes": 4096,
+    "fail": [],
+}
+
+settings: Dict[str, Any] = {}
+
+def configure(**values: Any) -> Dict[str, Any]:
+    """
+    Update the fake's settings (see the module docstring); returns them.
+    """
+    unknown = sorted(set(values) - set(DEFAULTS))
+    if unknown:
+        raise ValueError(f"Unknown fake Metashape settings: {', '.join(unknown)}")
+    settings.update(values)
+    return settings
+
+def _env_settings() -> Dict[str, Any]:
+    raw = os.environ.get("METASHAPE_FAKE_CONFIG", "").strip()
+    if not raw:
+        return {}
+    if not raw.startswith("{"):
+        with open(raw, "r", encoding="utf-8") as f:
+            raw = f.read()
+    return json.loads(raw)
+
+settings.update(copy.deepcopy(DEFAULTS))
+configure(**_env_settings())
+
+def _work(name: str, cameras: int, progress: Optional[Callable[[float], Any]]) -> None:
+    """
+    Simulated processing time of one call, reported through progress().
+    """
+    if name in settings["fail"]:
+        raise RuntimeError(f"{name}: simulated failure")
+    seconds = float(settings["latency"].get(name, 0.0))
+    seconds += float(settings["latency_per_camera"].get(name, 0.0)) * cameras
+    seconds /= float(settings["speed"]) or 1.0
+    steps = 4 if seconds > 0 else 1
+    for i in range(steps + 1):
+        if progress is not None:
+            progress(100.0 * i / steps)
+        if i < steps and seconds > 0:
+            time.sleep(seconds / steps)
+
+# ---------------------------------------------------------------------------
+# Enums: every constant is a distinct object, so maybe_enum() and config
+# strings behave as with the real module (unknown names are AttributeError)
+
+class _Enum:
+    def __init__(self, name: str):
+        self.name = name
+
+    def __repr__(self) -> str:
+        return f"Metashape.{self.name}"
+
+    def __reduce__(self) -> Any:
+        return (_enum, (self.name,))
+
+def _enum(name: str) -> _Enum:
+    return globals()[name]
+
+ENUMS = (
+    # data sources
+    "TiePointsData", "DepthMapsData", "PointCloudData", "ModelData", "TiledModelData",
+    "ElevationData", "OrthomosaicData", "ImagesData",
+    # depth map filtering, interpolation, surfaces, face counts
+    "NoFiltering", "MildFiltering", "ModerateFiltering", "AggressiveFiltering",
+    "DisabledInterpolation", "EnabledInterpolation", "Extrapolated",
+    "Arbitrary", "HeightField", "LowFaceCount", "MediumFaceCount", "HighFaceCount", "CustomFaceCount",
+    # texturing and blending
+    "GenericMapping", "OrthophotoMapping", "AdaptiveOrthophotoMapping", "SphericalMapping", "CameraMapping",
+    "DiffuseMap", "NormalMap", "OcclusionMap", "DisplacementMap",
+    "MosaicBlending", "AverageBlending", "MinBlending", "MaxBlending", "DisabledBlending", "NaturalBlending",
+    # reference
+    "ReferenceItemsAll", "ReferenceItemsCameras", "ReferenceItemsMarkers", "ReferenceItemsScalebars",
+    "ReferenceFormatCSV", "ReferenceFormatXML", "ReferenceFormatTEL", "ReferenceFormatAPM", "ReferenceFormatNone",
+    # export formats
+    "RasterFormatTiles", "RasterFormatGeoTIFF", "RasterFormatKMZ", "RasterFormatMBTiles", "RasterFormatNone",
+    "PointCloudFormatLAS", "PointCloudFormatLAZ", "PointCloudFormatPLY", "PointCloudFormatE57",
+    "PointCloudFormatCesium", "PointCloudFormatNone",
+    "ModelFormatOBJ", "ModelFormatPLY", "ModelFormatFBX", "ModelFormatGLTF", "ModelFormatNone",
+    "ImageFormatJPEG", "ImageFormatPNG", "ImageFormatTIFF", "ImageFormatNone",
+    "ImageCompressionLZW", "ImageCompressionJPEG", "ImageCompressionNone",
+)
+for _name in ENUMS:
+    globals()[_name] = _Enum(_name)
+
+# ---------------------------------------------------------------------------
+# Geometry
+
+class Vector(list):
+    def __init__(self, values: Sequence[float]):
+        super().__init__(float(v) for v in values)
+
+    x = property(lambda self: self[0])
+    y = property(lambda self: self[1])
+    z = property(lambda self: self[2])
+
+    def __add__(self, other: Sequence[float]) -> "Vector":  # type: ignore[override]
+        return Vector([a + b for a, b in zip(self, other)])
+
+    def __sub__(self, other: Sequence[float]) -> "Vector":
+        return Vector([a - b for a, b in zip(self, other)])
+
+    def __mul__(self, k: float) -> "Vector":  # type: ignore[override]
+        return Vector([a * k for a in self])
+
+    @property
+    def norm(self) -> float:
+        return math.sqrt(sum(a * a for a in self))
+
+class Matrix:
+    def __init__(self, rows: Sequence[Sequence[float]]):
+        self.rows = [[float(v) for v in r] for r in rows]
+
+    @classmethod
+    def Diag(cls, values: Sequence[float]) -> "Matrix":
+        return cls([[values[i] if i == j else 0.0 for j in range(len(values))] for i in range(len(values))])
+
+    def __getitem__(self, ij: Any) -> float:
+        return self.rows[ij[0]][ij[1]]
+
+    def mulp(self, p: Sequence[float]) -> Vector:
+        r = self.rows
+        return Vector([sum(r[i][j] * p[j] for j in range(3)) + (r[i][3] if len(r[i]) > 3 else 0.0) for i in range(3)])
+
+    def mulv(self, v: Sequence[float]) -> Vector:
+        return Vector([sum(self.rows[i][j] * v[j] for j in range(3)) for i in range(3)])
+
+def _identity() -> Matrix:
+    return Matrix.Diag([1.0, 1.0, 1.0, 1.0])
+
+class CoordinateSystem:
+    """
+    Every coordinate system is the same local metric frame.
+    """
+
+    def __init__(self, wkt: str = "LOCAL_CS[\"Local Coordinates (m)\"]"):
+        self.wkt = wkt
+        self.name = wkt
+
+    def localframe(self, point: Sequence[float]) -> Matrix:
+        return _identity()
+
+    def unproject(self, point: Sequence[float]) -> Vector:
+        return Vector(point)
+
+    def project(self, point: Sequence[float]) -> Vector:
+        return Vector(point)
+
+class BBox:
+    def __init__(self, min: Any = None, max: Any = None):
+        self.min = min
+        self.max = max
+
+class Region:
+    def __init__(self) -> None:
+        self.center = Vector([0.0, 0.0, 0.0])
+        self.size = Vector([1.0, 1.0, 1.0])
+        self.rot = Matrix.Diag([1.0, 1.0, 1.0])
+
+class ChunkTransform:
+    def __init__(self) -> None:
+        self.matrix = _identity()
+
+# ---------------------------------------------------------------------------
+# Chunk contents
+
+class Sensor:
+    def __init__(self, label: str = "fake", width: int = 6000, height: int = 4000):
+        self.label = label
+        self.width = width
+        self.height = height
+
+class Photo:
+    def __init__(self, path: str):
+        self.path = path
+
+class Reference:
+    def __init__(self) -> None:
+        self.location: Optional[Vector] = None
+        self.location_enabled = True
+        self.enabled = True
+
+class Mask:
+    def __init__(self) -> None:
+        self.path = ""
+
+    def load(self, path: str) -> None:
+        if not os.path.isfile(path):
+            raise RuntimeError(f"Can't load mask: {path}")
+        self.path = path
+
+class Camera:
+    def __init__(self, key: int, path: str, sensor: Sensor, position: Vector):
+        self.key = key
+        self.label = os.path.splitext(os.path.basename(path))[0]
+        self.photo = Photo(path)
+        self.sensor = sensor
+        self.enabled = True
+        self.transform: Optional[Matrix] = None
+        self.center: Optional[Vector] = None
+        self.mask: Optional[Mask] = None
+        self.reference = Reference()
+        self.reference.location = position
+
+class Marker:
+    def __init__(self, key: int, label: str):
+        self.key = key
+        self.label = label
+        self.reference = Reference()
+        self.position: Optional[Vector] = None
+
+class _Points:
+    # Sized sequence like Metashape's point lists; never materialises points
+    def __init__(self, owner: Any):
+        self._owner = owner
+
+    def __len__(self) -> int:
+        return int(self._owner.point_count)
+
+class TiePoints:
+    class Filter:
+        ReprojectionError = _Enum("ReprojectionError")
+        ReconstructionUncertainty = _Enum("ReconstructionUncertainty")
+        ImageCount = _Enum("ImageCount")
+        ProjectionAccuracy = _Enum("ProjectionAccuracy")
+
+        def __init__(self) -> None:
+            self.values: List[float] = []
+            self._tie_points: Optional[TiePoints] = None
+            self._array = np.zeros(0)
+
+        def init(self, chunk: "Chunk", criterion: Any) -> None:
+            tp = chunk.tie_points
+            if tp is None:
+                raise RuntimeError("Empty tie point cloud")
+            self._tie_points = tp
+            self._array = tp.values(criterion.name)
+            self.values = self._array.tolist()
+
+        def removePoints(self, threshold: float) -> None:
+            if self._tie_points is not None:
+                self._tie_points.point_count -= int(np.count_nonzero(self._array > threshold))
+
+    def __init__(self, point_count: int, seed: int):
+        self.point_count = int(point_count)
+        self.seed = int(seed)
+        self.points = _Points(self)
+
+    def values(self, criterion: str) -> np.ndarray:
+        """
+        Per point values of a gradual selection criterion. Drawn fresh for the
+        current point count: removing points does not remember which ones.
+        """
+        rng = np.random.default_rng([self.seed, self.point_count, len(criterion)])
+        n = self.point_count
+        if criterion == "ReprojectionError":
+            return rng.gamma(2.0, 0.15, n)
+        if criterion == "ReconstructionUncertainty":
+            return rng.lognormal(2.0, 0.6, n)
+        if criterion == "ProjectionAccuracy":
+            return rng.gamma(2.0, 1.5, n)
+        return 2.0 + rng.poisson(3.0, n).astype(np.float64)
+
+class PointCloud:
+    def __init__(self, point_count: int):
+        self.point_count = int(point_count)
+
+class Product:
+    # DEM/orthomosaic/model/tiled model: an extent and a resolution
+    def __init__(self, extent: Sequence[float], resolution: float = 0.05):
+        self.left, self.bottom, self.right, self.top = (float(v) for v in extent)
+        self.resolution = resolution
+
+# Leading bytes of exported files, by extension (as exports.MAGIC checks)
+_HEADERS = {
+    ".tif": b"II*\x00", ".tiff": b"II*\x00", ".pdf": b"%PDF-1.4\n", ".ply": b"ply\n",
+    ".jpg": b"\xff\xd8", ".jpeg": b"\xff\xd8", ".png": b"\x89PNG\r\n\x1a\n", ".zip": b"PK\x03\x04",
+}
+
+def _las_header(points: int) -> bytes:
+    head = bytearray(227)
+    head[0:4] = b"LASF"
+    head[107:111] = min(points, 2 ** 32 - 1).to_bytes(4, "little")
+    return bytes(head)
+
+class Chunk:
+    _next_key = 0
+
+    def __init__(self, label: str = "Chunk"):
+        self.key = Chunk._new_key()
+        self.label = label
+        self.enabled = True
+        self.cameras: List[Camera] = []
+        self.markers: List[Marker] = []
+        self.sensors: List[Sensor] = []
+        self.region = Region()
+        self.transform = ChunkTransform()
+        self.crs: Optional[CoordinateSystem] = CoordinateSystem()
+        self.tie_points: Optional[TiePoints] = None
+        self.point_cloud: Optional[PointCloud] = None
+        self.depth_maps: Any = None
+        self.model: Optional[Product] = None
+        self.tiled_model: Optional[Product] = None
+        self.elevation: Optional[Product] = None
+        self.orthomosaic: Optional[Product] = None
+        self._doc: Optional[Document] = None
+
+    @classmethod
+    def _new_key(cls) -> int:
+        cls._next_key += 1
+        return cls._next_key
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = dict(self.__dict__)
+        state["_doc"] = None
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        # Keys are per process, as in Metashape: re-key on load
+        self.key = Chunk._new_key()
+
+    def _enabled(self) -> List[Camera]:
+        return [c for c in self.cameras if c.enabled]
+
+    def _aligned(self) -> List[Camera]:
+        return [c for c in self.cameras if c.enabled and c.transform is not None]
+
+    def _rng(self, *extra: int) -> np.random.Generator:
+        return np.random.default_rng([int(settings["seed"]), len(self.cameras), *extra])
+
+    def _extent(self) -> List[float]:
+        xy = [(c.center[0], c.center[1]) for c in self._aligned() if c.center is not None]
+        if not xy:
+            return [0.0, 0.0, 0.0, 0.0]
+        a = np.asarray(xy)
+        pad = float(settings["camera_spacing_m"])
+        return [a[:, 0].min() - pad, a[:, 1].min() - pad, a[:, 0].max() + pad, a[:, 1].max() + pad]
+
+    # -- photos and reference --------------------------------------------
+
+    def addPhotos(self, filenames: Sequence[str] = (), progress: Optional[Callable[[float], Any]] = None,
+                  **kwargs: Any) -> None:
+        if isinstance(filenames, str):
+            filenames = [filenames]
+        _work("addPhotos", len(filenames), progress)
+        if not self.sensors:
+            self.sensors.append(Sensor())
+        cols = max(1, int(settings["grid_columns"]))
+        step = float(settings["camera_spacing_m"])
+        for p in filenames:
+            i = len(self.cameras)
+            pos = Vector([(i % cols) * step, (i // cols) * step, 100.0])
+            self.cameras.append(Camera(i, p, self.sensors[0], pos))
+
+    def importReference(self, path: str = "", format: Any = None, columns: str = "nxyz", delimiter: str = ",",
+                        skip_rows: int = 0, create_markers: bool = False, items: Any = None,
+                        progress: Optional[Callable[[float], Any]] = None, **kwargs: Any) -> None:
+        _work("importReference", 0, progress)
+        cols = [c for c in columns if c not in "[]|"]
+        by_label: Dict[str, Any] = {c.label: c for c in self.cameras}
+        by_label.update({m.label: m for m in self.markers})
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            rows = list(csv.reader(f, delimiter=delimiter or ","))[int(skip_rows):]
+        for row in rows:
+            if not row or row[0].startswith("#"):
+                continue
+            rec = dict(zip(cols, row))
+            label = rec.get("n", "")
+            try:
+                loc = Vector([float(rec["x"]), float(rec["y"]), float(rec.get("z", 0.0))])
+            except (KeyError, ValueError):
+                continue
+            item = by_label.get(label) or by_label.get(os.path.splitext(label)[0])
+            if item is None and create_markers:
+                item = Marker(len(self.markers), label)
+                self.markers.append(item)
+                by_label[label] = item
+            if item is not None:
+                item.reference.location = loc
+
+    def remove(self, items: Any) -> None:
+        items = items if isinstance(items, (list, tuple)) else [items]
+        ids = {id(x) for x in items}
+        self.cameras = [c for c in self.cameras if id(c) not in ids]
+        self.markers = [m for m in self.markers if id(m) not in ids]
+
+    # -- alignment ---------------------------------------------------------
+
+    def matchPhotos(self, progress: Optional[Callable[[float], Any]] = None, **kwargs: Any) -> None:
+        _work("matchPhotos", len(self._enabled()), progress)
+
+    def alignCameras(self, cameras: Optional[Sequence[Any]] = None, reset_alignment: bool = False,
+                     progress: Optional[Callable[[float], Any]] = None, **kwargs: Any) -> None:
+        todo = self._enabled()
+        _work("alignCameras", len(todo), progress)
+        rng = self._rng(1)
+        noise = float(settings["gps_noise_m"])
+        frac = float(settings["aligned_fraction"])
+        added = 0
+        for c in todo:
+            if c.transform is not None and not reset_alignment:
+                continue
+            c.transform = c.center = None
+            if rng.random() >= frac:
+                continue
+            c.transform = _identity()
+            c.center = c.reference.location + Vector(rng.normal(0.0, noise, 3))
+            added += 1
+        for m in self.markers:
+            if m.reference.location is not None:
+                m.position = m.reference.location + Vector(rng.normal(0.0, noise, 3))
+        n_tp = int(settings["tie_points_per_camera"]) * added
+        if self.tie_points is None or reset_alignment:
+            self.tie_points = TiePoints(n_tp, int(settings["seed"]))
+        else:
+            self.tie_points.point_count += n_tp
+        x0, y0, x1, y1 = self._extent()
+        self.region.center = Vector([(x0 + x1) / 2, (y0 + y1) / 2, 0.0])
+        self.region.size = Vector([x1 - x0, y1 - y0, 200.0])
+
+    def optimizeCameras(self, progress: Optional[Callable[[float], Any]] = None, **kwargs: Any) -> None:
+        _work("optimizeCameras", len(self._aligned()), progress)
+
+    def updateTransform(self) -> None:
+        pass
+
+    # -- dense products ----------------------------------------------------
+
+    def _region_fraction(self) -> float:
+        # Share of the aligned cameras inside the region (blocks restrict it)
+        aligned = [c for c in self._aligned() if c.center is not None]
+        if not aligned:
+            return 0.0
+        cx, cy = self.region.center[0], self.region.center[1]
+        hx, hy = self.region.size[0] / 2, self.region.size[1] / 2
+        inside = sum(1 for c in aligned if abs(c.center[0] - cx) <= hx and abs(c.center[1] - cy) <= hy)
+        return inside / float(len(aligned))
+
+    def buildDepthMaps(self, progress: Optional[Callable[[float], Any]] = None, **kwargs: Any) -> None:
+        _work("buildDepthMaps", len(self._aligned()), progress)
+        self.depth_maps = True
+
+    def buildPointCloud(self, progress: Optional[Callable[[float], Any]] = None, **kwargs: Any) -> None:
+        n = len(self._aligned())
+        _work("buildPointCloud", n, progress)
+        self.point_cloud = PointCloud(int(n * self._region_fraction() * int(settings["points_per_camera"])))
+
+    def buildDem(self, progress: Optional[Callable[[float], Any]] = None, **kwargs: Any) -> None:
+        _work("buildDem", len(self._aligned()), progress)
+        self.elevation = Product(self._extent())
+
+    def buildOrthomosaic(self, progress: Optional[Callable[[float], Any]] = None, **kwargs: Any) -> None:
+        _work("buildOrthomosaic", len(self._aligned()), progress)
+        self.orthomosaic = Product(self._extent())
+
+    def buildModel(self, progress: Optional[Callable[[float], Any]] = None, **kwargs: Any) -> None:
+        _work("buildModel", len(self._aligned()), progress)
+        self.model = Product(self._extent())
+
+    def buildUV(self, progress: Optional[Callable[[float], Any]] = None, **kwargs: Any) -> None:
+        _work("buildUV", len(self._aligned()), progress)
+
+    def buildTexture(self, progress: Optional[Callable[[float], Any]] = None, **kwargs: Any) -> None:
+        _work("buildTexture", len(self._aligned()), progress)
+
+    def buildTiledModel(self, progress: Optional[Callable[[float], Any]] = None, **kwargs: Any) -> None:
+        _work("buildTiledModel", len(self._aligned()), progress)
+        self.tiled_model = Product(self._extent())
+
+    # -- exports -----------------------------------------------------------
+
+    def _export(self, name: str, path: str, progress: Optional[Callable[[float], Any]], header: bytes = b"") -> None:
+        _work(name, 0, progress)
+        ext = os.path.splitext(path)[1].lower()
+        with open(path, "wb") as f:
+            f.write(header or _HEADERS.get(ext, b""))
+            f.write(b"\0" * int(settings["export_bytes"]))
+
+    def exportRaster(self, path: str = "", progress: Optional[Callable[[float], Any]] = None,
+                     save_world: bool = False, source_data: Any = None, **kwargs: Any) -> None:
+        if source_data is _enum("ElevationData"):
+            if self.elevation is None:
+                raise RuntimeError("Null elevation")
+        elif self.orthomosaic is None:
+            raise RuntimeError("Null orthomosaic")
+        self._export("exportRaster", path, progress)
+        if save_world and os.path.splitext(path)[1].lower() in (".tif", ".tiff"):
+            with open(os.path.splitext(path)[0] + ".tfw", "w", encoding="utf-8") as f:
+                f.write("0.05\n0\n0\n-0.05\n0\n0\n")
+
+    def exportPointCloud(self, path: str = "", progress: Optional[Callable[[float], Any]] = None,
+                         **kwargs: Any) -> None:
+        if self.point_cloud is None:
+            raise RuntimeError("Null point cloud")
+        ext = os.path.splitext(path)[1].lower()
+        head = _las_header(self.point_cloud.point_count) if ext in (".las", ".laz") else b""
+        self._export("exportPointCloud", path, progress, head)
+
+    def exportModel(self, path: str = "", progress: Optional[Callable[[float], Any]] = None, **kwargs: Any) -> None:
+        if self.model is None:
+            raise RuntimeError("Null model")
+        self._export("exportModel", path, progress)
+
+    def exportReport(self, path: str = "", progress: Optional[Callable[[float], Any]] = None, **kwargs: Any) -> None:
+        self._export("exportReport", path, progress)
+
+    # -- copies --------------------------------------------------------------
+
+    def copy(self, progress: Optional[Callable[[float], Any]] = None, **kwargs: Any) -> "Chunk":
+        doc = self._doc
+        dup = copy.deepcopy(self)
+        dup.label = self.label + " (copy)"
+        if doc is not None:
+            doc._add(dup)
+        return dup
+
+# ---------------------------------------------------------------------------
+# Document: projects are pickled chunk lists
+
+class Document:
+    def __init__(self) -> None:
+        self.chunks: List[Chunk] = []
+        self.path = ""
+        self.read_only = False
+
+    @property
+    def chunk(self) -> Optional[Chunk]:
+        return self.chunks[0] if self.chunks else None
+
+    def _add(self, chunk: Chunk) -> Chunk:
+        chunk._doc = self
+        self.chunks.append(chunk)
+        return chunk
+
+    def clear(self) -> None:
+        self.chunks = []
+        self.path = ""
+
+    def addChunk(self) -> Chunk:
+        return self._add(Chunk())
+
+    def remove(self, items: Any) -> None:
+        for c in items if isinstance(items, (list, tuple)) else [items]:
+            self.chunks.remove(c)
+
+    def open(self, path: str, read_only: bool = False, ignore_lock: bool = False, **kwargs: Any) -> None:
+        _work("open", 0, None)
+        with open(path, "rb") as f:
+            chunks = pickle.load(f)
+        self.chunks = []
+        for c in chunks:
+            self._add(c)
+        self.path = path
+        self.read_only = read_only
+
+    def append(self, document: Any, chunks: Optional[Sequence[Any]] = None, **kwargs: Any) -> None:
+        with open(document, "rb") as f:
+            for c in pickle.load(f):
+                self._add(c)
+
+    def save(self, path: str = "", chunks: Optional[Sequence[Chunk]] = None, **kwargs: Any) -> None:
+        path = path or self.path
+        if not path:
+            raise RuntimeError("Document path is not set")
+        if self.read_only and path == self.path:
+            raise RuntimeError("Document is opened in read-only mode")
+        _work("save", 0, None)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(list(self.chunks if chunks is None else chunks), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        if chunks is None:
+            self.path = path
+
+    def alignChunks(self, chunks: Sequence[int] = (), reference: int = 0, method: int = 0,
+                    progress: Optional[Callable[[float], Any]] = None, **kwargs: Any) -> None:
+        parts = [c for c in self.chunks if c.key in set(chunks) and c.key != reference]
+        _work("alignChunks", sum(len(c._aligned()) for c in parts), progress)
+
+    def mergeChunks(self, chunks: Sequence[int] = (), progress: Optional[Callable[[float], Any]] = None,
+                    **kwargs: Any) -> None:
+        parts = [c for c in self.chunks if c.key in set(chunks)]
+        _work("mergeChunks", sum(len(c.cameras) for c in parts), progress)
+        merged = Chunk("Merged Chunk")
+        # One camera per photo; blocks disable the cameras outside them, keep the enabled copy
+        by_path: Dict[str, int] = {}
+        for c in parts:
+            for cam in c.cameras:
+                i = by_path.get(cam.photo.path)
+                if i is not None and (merged.cameras[i].enabled or not cam.enabled):
+                    continue
+                cam = copy.copy(cam)
+                if i is None:
+                    by_path[cam.photo.path] = i = len(merged.cameras)
+                    merged.cameras.append(cam)
+                cam.key = i
+                merged.cameras[i] = cam
+            merged.markers.extend(m for m in c.markers if m.label not in {x.label for x in merged.markers})
+        merged.sensors = [Sensor()]
+        tp = sum(c.tie_points.point_count for c in parts if c.tie_points is not None)
+        merged.tie_points = TiePoints(tp, int(settings["seed"])) if tp else None
+        pc = sum(c.point_cloud.point_count for c in parts if c.point_cloud is not None)
+        merged.point_cloud = PointCloud(pc) if any(c.point_cloud is not None for c in parts) else None
+        merged.region = copy.deepcopy(parts[0].region) if parts else Region()
+        for attr in ("elevation", "orthomosaic", "model"):
+            if any(getattr(c, attr) is not None for c in parts):
+                setattr(merged, attr, Product(merged._extent()))
+        self._add(merged)
+
+class Application:
+    def __init__(self) -> None:
+        self.document = Document()
+        self.version = version
+
+    def update(self) -> None:
+        pass
+
+app = Application()
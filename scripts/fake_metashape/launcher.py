@@ -0,0 +1,32 @@
+"""
+Stand-in for the Metashape binary that runs scripts against the fake
+Metashape module in this directory:
+
+    python scripts/fake_metashape/launcher.py [-platform offscreen] -r <script> [args]
+
+Point workers.metashape_exe at this file to run worker jobs (blocks, exports)
+offline; worker_command() starts .py executables with the current Python.
+Simulated latencies come from METASHAPE_FAKE_CONFIG (see Metashape.py).
+"""
+from __future__ import annotations
+import os
+import runpy
+import sys
+from typing import List
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def main(argv: List[str]) -> None:
+    args = list(argv)
+    if args[:1] == ["-platform"]:
+        args = args[2:]
+    if len(args) < 2 or args[0] != "-r":
+        sys.exit("usage: launcher.py [-platform offscreen] -r <script> [args]")
+    script = os.path.abspath(args[1])
+    sys.path.insert(0, THIS_DIR)
+    sys.path.insert(1, os.path.dirname(script))
+    sys.argv = [script] + args[2:]
+    runpy.run_path(script, run_name="__main__")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
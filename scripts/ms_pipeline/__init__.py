@@ -1 +1 @@
-__all__ = ["config", "enums", "log", "steps", "qc"]
\ No newline at end of file
+__all__ = ["config", "enums", "log", "steps", "qc", "checkpoint", "photos", "pool", "preflight", "metrics", "progress", "tiling", "blocks", "workers", "incremental", "planner", "dag", "batch", "exports", "masks", "metadata", "reference", "artifacts", "multichunk", "staging"]
\ No newline at end of file
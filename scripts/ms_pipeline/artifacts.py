@@ -0,0 +1,232 @@
+from __future__ import annotations
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Optional, Sequence
+
+INDEX_VERSION = 1
+
+# Artifacts whose producing nodes are cached by default
+DEFAULT_ARTIFACTS = ("alignment", "depth_maps", "point_cloud", "dem")
+
+# A lock file older than this was left by a crashed run
+LOCK_STALE_S = 600.0
+
+ENTRY_PROJECT = "chunk.psx"
+
+def tree_size(path: str) -> int:
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+@contextmanager
+def index_lock(path: str, timeout: float = 120.0) -> Iterator[None]:
+    """
+    Exclusive lock file for index updates shared between runs. A lock older
+    than LOCK_STALE_S is taken over.
+    """
+    deadline = time.time() + timeout
+    while True:
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(path) > LOCK_STALE_S:
+                    os.remove(path)
+                    continue
+            except OSError:
+                continue
+            if time.time() > deadline:
+                raise RuntimeError(f"Index is locked: {path}")
+            time.sleep(0.2)
+    try:
+        os.write(fd, str(os.getpid()).encode("ascii"))
+        os.close(fd)
+        yield
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+class ArtifactCache:
+    """
+    Content-addressed store of saved chunks on local scratch. Each entry is a
+    one-chunk project holding the state after a graph node, stored under the
+    node key (photo fingerprint plus the parameters of the node and everything
+    upstream, see dag.node_keys). A run whose node key matches an entry appends
+    that chunk instead of recomputing it and everything before it.
+
+    index.json records size and last use per entry; when the cache grows past
+    max_bytes the least recently used entries are deleted. Runs sharing the
+    cache serialise index updates through a lock file.
+    """
+
+    def __init__(self, root: str, max_bytes: int = 0):
+        self.root = os.path.abspath(root)
+        self.max_bytes = int(max_bytes)
+        self.index_path = os.path.join(self.root, "index.json")
+        os.makedirs(self.root, exist_ok=True)
+
+    def entry_dir(self, key: str) -> str:
+        return os.path.join(self.root, key[:32])
+
+    def project_path(self, key: str) -> str:
+        return os.path.join(self.entry_dir(key), ENTRY_PROJECT)
+
+    def _locked(self, timeout: float = 120.0) -> ContextManager[None]:
+        return index_lock(os.path.join(self.root, "index.lock"), timeout)
+
+    def _load(self) -> Dict[str, Any]:
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get("version") != INDEX_VERSION:
+            return {}
+        return data.get("entries", {})
+
+    def _save(self, entries: Dict[str, Any]) -> None:
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": INDEX_VERSION, "entries": entries}, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.index_path)
+
+    def _discard(self, entries: Dict[str, Any], keys: Sequence[str]) -> List[str]:
+        """
+        Drop entries from the index and move their folders aside (cheap under
+        the lock); returns the folders for _purge to delete afterwards.
+        """
+        trash = []
+        for key in keys:
+            entries.pop(key, None)
+            d = self.entry_dir(key)
+            if os.path.isdir(d):
+                t = os.path.join(self.root, f".trash-{key[:32]}-{os.getpid()}")
+                try:
+                    os.replace(d, t)
+                    trash.append(t)
+                except OSError:
+                    pass
+        return trash
+
+    @staticmethod
+    def _purge(folders: Sequence[str]) -> None:
+        for d in folders:
+            shutil.rmtree(d, ignore_errors=True)
+
+    def _evict(self, entries: Dict[str, Any], keep: Sequence[str] = ()) -> List[str]:
+        """
+        Least recently used keys to drop so the cache fits max_bytes (0 = no limit).
+        """
+        if self.max_bytes <= 0:
+            return []
+        total = sum(int(e.get("size", 0)) for e in entries.values())
+        out = []
+        for key in sorted(entries, key=lambda k: entries[k].get("last_used", 0)):
+            if total <= self.max_bytes:
+                break
+            if key in keep:
+                continue
+            total -= int(entries[key].get("size", 0))
+            out.append(key)
+        return out
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Entry for a node key (with "path", the project to append) or None.
+        Marks the entry as used.
+        """
+        with self._locked():
+            entries = self._load()
+            rec = entries.get(key)
+            if rec is None:
+                return None
+            if not os.path.isfile(self.project_path(key)):
+                trash = self._discard(entries, [key])
+                self._save(entries)
+                rec = None
+            else:
+                rec["last_used"] = time.time()
+                rec["hits"] = int(rec.get("hits", 0)) + 1
+                self._save(entries)
+        if rec is None:
+            self._purge(trash)
+            return None
+        return dict(rec, path=self.project_path(key))
+
+    def drop(self, key: str) -> None:
+        with self._locked():
+            entries = self._load()
+            trash = self._discard(entries, [key])
+            self._save(entries)
+        self._purge(trash)
+
+    def put(self, Metashape: Any, key: str, project: str, label: str,
+            prepare: Optional[Callable[[Any], Any]] = None, **info: Any) -> Optional[Dict[str, Any]]:
+        """
+        Store chunk `label` of the saved project under key, then evict least
+        recently used entries over the size limit. The project is opened
+        read-only in a separate document, as worker processes do; prepare(chunk)
+        may change the copy before it is saved (e.g. photo paths). Returns the
+        entry, or None when it alone is larger than the cache.
+        """
+        rec = self._load().get(key)
+        if rec is not None and os.path.isfile(self.project_path(key)):
+            return dict(rec, path=self.project_path(key))
+        tmp = os.path.join(self.root, f".tmp-{key[:32]}-{os.getpid()}")
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        try:
+            doc = Metashape.Document()
+            doc.open(project, read_only=True, ignore_lock=True)
+            src = [c for c in doc.chunks if c.label == label]
+            if not src:
+                raise RuntimeError(f"Chunk '{label}' not found in {project}")
+            if prepare is not None:
+                prepare(src[0])
+            doc.save(os.path.join(tmp, ENTRY_PROJECT), chunks=[src[0]])
+            doc.clear()
+        except Exception:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        size = tree_size(tmp)
+        if 0 < self.max_bytes < size:
+            shutil.rmtree(tmp, ignore_errors=True)
+            return None
+        now = time.time()
+        rec = dict(info, label=label, size=size, created=now, last_used=now, hits=0)
+        with self._locked():
+            entries = self._load()
+            trash = [tmp]
+            # Another run may have stored the same key meanwhile: keep theirs
+            if key not in entries:
+                # A folder without an index entry is left over from a crash
+                trash = self._discard(entries, [key])
+                os.replace(tmp, self.entry_dir(key))
+                entries[key] = rec
+            trash += self._discard(entries, self._evict(entries, keep=[key]))
+            self._save(entries)
+            rec = entries.get(key, rec)
+        self._purge(trash)
+        return dict(rec, path=self.project_path(key))
+
+    def stats(self) -> Dict[str, Any]:
+        entries = self._load()
+        return {"entries": len(entries), "bytes": sum(int(e.get("size", 0)) for e in entries.values()),
+                "max_bytes": self.max_bytes}
+
+def describe(stats: Dict[str, Any]) -> str:
+    s = f"{stats['entries']} entries, {stats['bytes'] / 1e9:.2f} GB"
+    if stats["max_bytes"]:
+        s += f" of {stats['max_bytes'] / 1e9:g} GB"
+    return s
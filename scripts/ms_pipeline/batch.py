@@ -0,0 +1,506 @@
+from __future__ import annotations
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from .metrics import MetricsRecorder, machine_memory_mb
+from .workers import worker_command
+
+_MB = 1024.0 * 1024.0
+
+STATES = ("queued", "running", "done", "failed", "cancelled")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    config TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued',
+    priority INTEGER NOT NULL DEFAULT 0,
+    cores REAL NOT NULL DEFAULT 0,
+    memory_mb REAL NOT NULL DEFAULT 0,
+    scratch_gb REAL NOT NULL DEFAULT 0,
+    scratch_path TEXT NOT NULL DEFAULT '',
+    status_path TEXT NOT NULL DEFAULT '',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL DEFAULT 3,
+    not_before REAL NOT NULL DEFAULT 0,
+    host TEXT NOT NULL DEFAULT '',
+    pid INTEGER,
+    out_log TEXT NOT NULL DEFAULT '',
+    added REAL,
+    started REAL,
+    finished REAL,
+    returncode INTEGER,
+    error TEXT NOT NULL DEFAULT ''
+);
+CREATE TABLE IF NOT EXISTS attempts (
+    job_id INTEGER NOT NULL,
+    attempt INTEGER NOT NULL,
+    host TEXT,
+    pid INTEGER,
+    started REAL,
+    finished REAL,
+    ok INTEGER,
+    returncode INTEGER,
+    error TEXT,
+    out_log TEXT,
+    wall_s REAL,
+    cpu_s REAL,
+    peak_rss_mb REAL,
+    PRIMARY KEY (job_id, attempt)
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, priority, id);
+"""
+
+class JobDB:
+    """
+    Job queue and job state in SQLite, so a scheduler that crashes or is killed
+    picks up where it left off. Claims are transactional: several schedulers on
+    one machine may share a database. Keep it on a local disk (SQLite locking
+    is unreliable on network shares); use one database per node.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30.0, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def add(self, config: str, name: str, priority: int = 0, cores: float = 0, memory_mb: float = 0,
+            scratch_gb: float = 0, scratch_path: str = "", status_path: str = "", max_attempts: int = 3) -> int:
+        cur = self.conn.execute(
+            "INSERT INTO jobs (name, config, priority, cores, memory_mb, scratch_gb, scratch_path, status_path,"
+            " max_attempts, added) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (name, config, int(priority), float(cores), float(memory_mb), float(scratch_gb), scratch_path,
+             status_path, max(1, int(max_attempts)), time.time()))
+        return int(cur.lastrowid)
+
+    def get(self, job_id: int) -> Optional[Dict[str, Any]]:
+        row = self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def jobs(self, states: Sequence[str] = ()) -> List[Dict[str, Any]]:
+        if states:
+            q = "SELECT * FROM jobs WHERE state IN (%s) ORDER BY id" % ",".join("?" * len(states))
+            return [dict(r) for r in self.conn.execute(q, tuple(states))]
+        return [dict(r) for r in self.conn.execute("SELECT * FROM jobs ORDER BY id")]
+
+    def ready(self, now: float) -> List[Dict[str, Any]]:
+        """
+        Queued jobs whose retry backoff has passed, highest priority first.
+        """
+        q = "SELECT * FROM jobs WHERE state = 'queued' AND not_before <= ? ORDER BY priority DESC, id"
+        return [dict(r) for r in self.conn.execute(q, (now,))]
+
+    def counts(self) -> Dict[str, int]:
+        out = {s: 0 for s in STATES}
+        for row in self.conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state"):
+            out[row[0]] = int(row[1])
+        return out
+
+    def attempts(self, job_id: int) -> List[Dict[str, Any]]:
+        q = "SELECT * FROM attempts WHERE job_id = ? ORDER BY attempt"
+        return [dict(r) for r in self.conn.execute(q, (job_id,))]
+
+    def claim(self, job_id: int, host: str, out_log: str) -> bool:
+        """
+        Move a queued job to running (one attempt more). False if another
+        scheduler got it first.
+        """
+        cur = self.conn.execute(
+            "UPDATE jobs SET state = 'running', attempts = attempts + 1, host = ?, pid = NULL, out_log = ?,"
+            " started = ?, finished = NULL, returncode = NULL WHERE id = ? AND state = 'queued'",
+            (host, out_log, time.time(), job_id))
+        return cur.rowcount == 1
+
+    def set_pid(self, job_id: int, pid: int) -> None:
+        self.conn.execute("UPDATE jobs SET pid = ? WHERE id = ?", (pid, job_id))
+
+    def record_attempt(self, job_id: int, attempt: int, **fields: Any) -> None:
+        cols = ["job_id", "attempt"] + list(fields)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO attempts (%s) VALUES (%s)" % (",".join(cols), ",".join("?" * len(cols))),
+            (job_id, attempt) + tuple(fields.values()))
+
+    def finish(self, job_id: int, ok: bool, returncode: Optional[int], error: str, retry_delay: float) -> str:
+        """
+        Close the current attempt: done, queued again after retry_delay seconds
+        while attempts remain, or failed. Returns the new state.
+        """
+        job = self.get(job_id) or {}
+        now = time.time()
+        if ok:
+            state, not_before = "done", 0.0
+        elif job.get("attempts", 0) < job.get("max_attempts", 1):
+            state, not_before = "queued", now + retry_delay
+        else:
+            state, not_before = "failed", 0.0
+        self.conn.execute(
+            "UPDATE jobs SET state = ?, not_before = ?, finished = ?, returncode = ?, error = ?, pid = NULL"
+            " WHERE id = ? AND state = 'running'",
+            (state, not_before, now, returncode, error, job_id))
+        return state
+
+    def requeue(self, job_id: int) -> None:
+        """
+        Put a running job back without counting the attempt (scheduler stopped it).
+        """
+        self.conn.execute(
+            "UPDATE jobs SET state = 'queued', attempts = MAX(attempts - 1, 0), pid = NULL, not_before = 0"
+            " WHERE id = ? AND state = 'running'", (job_id,))
+
+    def retry(self, job_ids: Sequence[int] = ()) -> int:
+        """
+        Queue jobs again with fresh attempts: all failed ones by default. Jobs
+        named by id are queued whether they failed, were cancelled or finished
+        ('done'), so a finished job can be rerun, e.g. after its config changed.
+        """
+        if job_ids:
+            q = "UPDATE jobs SET state = 'queued', attempts = 0, not_before = 0, error = ''" \
+                " WHERE state IN ('failed', 'cancelled', 'done') AND id IN (%s)" % ",".join("?" * len(job_ids))
+            return self.conn.execute(q, tuple(job_ids)).rowcount
+        return self.conn.execute(
+            "UPDATE jobs SET state = 'queued', attempts = 0, not_before = 0, error = '' WHERE state = 'failed'").rowcount
+
+    def cancel(self, job_ids: Sequence[int]) -> int:
+        """
+        Cancel queued jobs (running ones are left to finish).
+        """
+        if not job_ids:
+            return 0
+        q = "UPDATE jobs SET state = 'cancelled' WHERE state = 'queued' AND id IN (%s)" % ",".join("?" * len(job_ids))
+        return self.conn.execute(q, tuple(job_ids)).rowcount
+
+class Resources(NamedTuple):
+    max_jobs: int       # concurrent workers on this node
+    cores: float
+    memory_mb: float
+    min_free_gb: float  # space to keep free on every scratch disk
+
+def node_resources(max_jobs: int = 1, cores: float = 0, memory_mb: float = 0, min_free_gb: float = 10) -> Resources:
+    """
+    Node capacity; 0 means all cores / 90% of physical memory.
+    """
+    return Resources(
+        max(1, int(max_jobs)),
+        float(cores or os.cpu_count() or 1),
+        float(memory_mb or machine_memory_mb() * 0.9),
+        float(min_free_gb),
+    )
+
+def _existing(path: str) -> str:
+    path = os.path.abspath(path)
+    while not os.path.exists(path) and os.path.dirname(path) != path:
+        path = os.path.dirname(path)
+    return path
+
+def _free_gb(path: str) -> Optional[float]:
+    try:
+        return shutil.disk_usage(_existing(path)).free / (_MB * 1024.0)
+    except OSError:
+        return None
+
+def _device(path: str) -> Any:
+    try:
+        return os.stat(_existing(path)).st_dev
+    except OSError:
+        return path
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    if sys.platform == "win32":
+        import ctypes
+        k32 = ctypes.windll.kernel32
+        h = k32.OpenProcess(0x1000, False, int(pid))  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not h:
+            return False
+        try:
+            code = ctypes.c_ulong()
+            k32.GetExitCodeProcess(h, ctypes.byref(code))
+            return code.value == 259  # STILL_ACTIVE
+        finally:
+            k32.CloseHandle(h)
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _reap(proc: subprocess.Popen) -> Optional[Tuple[int, Dict[str, float]]]:
+    """
+    (exit code, CPU/peak memory of the child) once the worker has exited, else None.
+    Resource usage needs os.wait4 (not on Windows).
+    """
+    if hasattr(os, "wait4"):
+        try:
+            pid, status, ru = os.wait4(proc.pid, os.WNOHANG)
+        except ChildProcessError:
+            code = proc.poll()
+            return (code, {}) if code is not None else None
+        if pid == 0:
+            return None
+        code = os.waitstatus_to_exitcode(status)
+        proc.returncode = code
+        # ru_maxrss is kB on Linux, bytes on macOS
+        rss = ru.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+        return code, {"cpu_s": round(ru.ru_utime + ru.ru_stime, 2), "peak_rss_mb": round(rss / _MB, 1)}
+    code = proc.poll()
+    return (code, {}) if code is not None else None
+
+def _status_finished(job: Dict[str, Any], pid: Optional[int]) -> bool:
+    """
+    True if the workflow's status.json says this worker finished (used for
+    workers that outlived a crashed scheduler, whose exit code is lost).
+    """
+    try:
+        with open(job["status_path"], "r", encoding="utf-8") as f:
+            st = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return st.get("state") == "finished" and st.get("pid") == pid
+
+def _tail(path: str) -> str:
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - 4096))
+            lines = [ln.strip() for ln in f.read().decode("utf-8", "replace").splitlines() if ln.strip()]
+    except OSError:
+        return ""
+    return lines[-1][:300] if lines else ""
+
+class BatchScheduler:
+    """
+    Runs queued workflow configs in headless Metashape worker processes:
+
+        <metashape> -r scripts/run_workflow.py <config> <name>
+
+    A job starts when a worker slot is free and the running jobs plus this one
+    fit the node's cores and memory and leave min_free_gb on its scratch disk
+    (a job bigger than the node still runs, alone). Failed attempts are queued
+    again after backoff_s, doubling up to backoff_max_s. Each attempt's console
+    output goes to jobs_dir/<id>-<name>/attempt<N>.log; wall time, CPU and
+    peak memory go to the attempts table and to metrics_path.
+    """
+
+    def __init__(self, db: JobDB, resources: Resources, run_script: str, jobs_dir: str,
+                 workers_cfg: Optional[Dict[str, Any]] = None, log: Any = None, poll_s: float = 2.0,
+                 backoff_s: float = 60.0, backoff_max_s: float = 3600.0, metrics_path: str = ""):
+        self.db = db
+        self.resources = resources
+        self.run_script = run_script
+        self.jobs_dir = jobs_dir
+        self.workers_cfg = workers_cfg or {}
+        self.log = log
+        self.poll_s = float(poll_s)
+        self.backoff_s = float(backoff_s)
+        self.backoff_max_s = float(backoff_max_s)
+        self.host = socket.gethostname()
+        self.recorder = MetricsRecorder(metrics_path, run_id=time.strftime("%Y%m%d_%H%M%S")) if metrics_path else None
+        self.running: Dict[int, Dict[str, Any]] = {}
+        self._held: Dict[int, str] = {}
+
+    def _info(self, msg: str, **fields: Any) -> None:
+        if self.log is not None:
+            self.log.info(msg, **fields)
+
+    def _warn(self, msg: str, **fields: Any) -> None:
+        if self.log is not None:
+            self.log.warn(msg, **fields)
+
+    def command(self, job: Dict[str, Any]) -> List[str]:
+        return worker_command(self.workers_cfg, self.run_script, job["config"], job["name"])
+
+    # Admission
+
+    def _blocker(self, job: Dict[str, Any]) -> str:
+        """
+        Why the job cannot start now ("" if it can).
+        """
+        res = self.resources
+        running = [r["job"] for r in self.running.values()]
+        if len(running) >= res.max_jobs:
+            return "all worker slots busy"
+        if job["scratch_path"]:
+            free = _free_gb(job["scratch_path"])
+            if free is not None:
+                dev = _device(job["scratch_path"])
+                reserved = sum(j["scratch_gb"] for j in running if j["scratch_path"] and _device(j["scratch_path"]) == dev)
+                if free - reserved - job["scratch_gb"] < res.min_free_gb:
+                    return (f"needs {job['scratch_gb']:.0f} GB scratch + {res.min_free_gb:.0f} GB free, "
+                            f"{free - reserved:.0f} GB available on {_existing(job['scratch_path'])}")
+        if not running:
+            return ""
+        # cores 0: an equal share of the node per worker slot
+        share = res.cores / res.max_jobs
+        if sum(j["cores"] or share for j in running) + (job["cores"] or share) > res.cores:
+            return "not enough free cores"
+        if sum(j["memory_mb"] for j in running) + job["memory_mb"] > res.memory_mb:
+            return "not enough free memory"
+        return ""
+
+    def _schedule(self) -> None:
+        for job in self.db.ready(time.time()):
+            if len(self.running) >= self.resources.max_jobs:
+                break
+            why = self._blocker(job)
+            if why:
+                if self._held.get(job["id"]) != why:
+                    self._held[job["id"]] = why
+                    self._info(f"Job {job['id']} {job['name']} waiting: {why}", job=job["id"])
+                continue
+            self._held.pop(job["id"], None)
+            self._launch(job)
+
+    # Worker processes
+
+    def _launch(self, job: Dict[str, Any]) -> None:
+        attempt = job["attempts"] + 1
+        job_dir = os.path.join(self.jobs_dir, f"{job['id']:05d}-{job['name']}")
+        out_log = os.path.join(job_dir, f"attempt{attempt}.log")
+        if not self.db.claim(job["id"], self.host, out_log):
+            return
+        job = self.db.get(job["id"]) or job
+        env = dict(os.environ, MS_BATCH_JOB=str(job["id"]), MS_BATCH_ATTEMPT=str(attempt))
+        # Own process group: Ctrl+C or a crash of the scheduler does not take the workers with it
+        kw: Dict[str, Any] = {"creationflags": 0x00000200} if sys.platform == "win32" else {"start_new_session": True}
+        started = time.time()
+        try:
+            os.makedirs(job_dir, exist_ok=True)
+            cmd = self.command(job)
+            with open(out_log, "w", encoding="utf-8") as out:
+                proc = subprocess.Popen(cmd, stdout=out, stderr=subprocess.STDOUT, env=env, **kw)
+        except (OSError, RuntimeError) as e:
+            self._finished(job, attempt, None, started, None, f"{type(e).__name__}: {e}", {})
+            return
+        self.db.set_pid(job["id"], proc.pid)
+        self.running[job["id"]] = {"job": job, "attempt": attempt, "proc": proc, "pid": proc.pid, "started": started}
+        self._info(f"Job {job['id']} {job['name']}: attempt {attempt}/{job['max_attempts']} started (pid {proc.pid})",
+                   job=job["id"], attempt=attempt, pid=proc.pid, out_log=out_log)
+
+    def _poll(self) -> None:
+        for job_id, r in list(self.running.items()):
+            if r["proc"] is None:
+                # Adopted from a previous scheduler: only the pid and status.json are known
+                if _pid_alive(r["pid"]):
+                    continue
+                ok = _status_finished(r["job"], r["pid"])
+                code, usage = (0 if ok else None), {}
+                error = "" if ok else "worker ended while the scheduler was down and did not report finished"
+            else:
+                done = _reap(r["proc"])
+                if done is None:
+                    continue
+                (code, usage), error = done, ""
+            del self.running[job_id]
+            self._finished(r["job"], r["attempt"], r["pid"], r["started"], code, error, usage)
+
+    def _finished(self, job: Dict[str, Any], attempt: int, pid: Optional[int], started: Optional[float],
+                  code: Optional[int], error: str, usage: Dict[str, float]) -> None:
+        if code not in (0, None) and not error:
+            error = f"exit code {code}"
+            last = _tail(job["out_log"])
+            if last:
+                error += f": {last}"
+        ok = code == 0 and not error
+        now = time.time()
+        wall = round(now - started, 1) if started else None
+        self.db.record_attempt(job["id"], attempt, host=self.host, pid=pid, started=started, finished=now, ok=int(ok),
+                               returncode=code, error=error, out_log=job["out_log"], wall_s=wall,
+                               cpu_s=usage.get("cpu_s"), peak_rss_mb=usage.get("peak_rss_mb"))
+        delay = min(self.backoff_max_s, self.backoff_s * 2 ** (attempt - 1))
+        state = self.db.finish(job["id"], ok, code, error, delay)
+        if self.recorder is not None:
+            self.recorder.write({
+                "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "run_id": self.recorder.run_id,
+                "op": "batch_job",
+                "job": job["id"],
+                "name": job["name"],
+                "config": job["config"],
+                "attempt": attempt,
+                "host": self.host,
+                "status": "ok" if ok else "error",
+                "returncode": code,
+                "error": error,
+                "wall_s": wall,
+                "cpu_s": usage.get("cpu_s"),
+                "peak_rss_mb": usage.get("peak_rss_mb"),
+                "out_log": job["out_log"],
+            })
+        if ok:
+            self._info(f"Job {job['id']} {job['name']}: done in {wall}s", job=job["id"], attempt=attempt, wall_s=wall)
+        elif state == "queued":
+            self._warn(f"Job {job['id']} {job['name']}: attempt {attempt} failed ({error}); retry in {delay:.0f}s",
+                       job=job["id"], attempt=attempt)
+        else:
+            self._warn(f"Job {job['id']} {job['name']}: FAILED after {attempt} attempts ({error}), see {job['out_log']}",
+                       job=job["id"], attempt=attempt)
+
+    def recover(self) -> None:
+        """
+        Adopt jobs this host had running when the previous scheduler died. Live
+        workers are watched until they exit; dead ones are judged by status.json.
+        """
+        for job in self.db.jobs(["running"]):
+            if job["host"] != self.host or job["id"] in self.running:
+                continue
+            alive = _pid_alive(job["pid"])
+            self._info(f"Job {job['id']} {job['name']}: recovering attempt {job['attempts']} "
+                       f"(pid {job['pid']}, {'still running' if alive else 'exited'})", job=job["id"])
+            self.running[job["id"]] = {"job": job, "attempt": job["attempts"], "proc": None, "pid": job["pid"],
+                                       "started": job["started"]}
+
+    def stop(self, timeout: float = 60.0) -> None:
+        """
+        Terminate the workers started by this scheduler and queue their jobs
+        again without counting the attempt.
+        """
+        for r in self.running.values():
+            if r["proc"] is not None and r["proc"].poll() is None:
+                r["proc"].terminate()
+        deadline = time.time() + timeout
+        for job_id, r in list(self.running.items()):
+            if r["proc"] is None:
+                continue
+            try:
+                r["proc"].wait(max(0.0, deadline - time.time()))
+            except subprocess.TimeoutExpired:
+                r["proc"].kill()
+            self.db.requeue(job_id)
+            del self.running[job_id]
+            self._info(f"Job {job_id} {r['job']['name']}: stopped, queued again", job=job_id)
+
+    def run(self, watch: bool = False) -> Dict[str, int]:
+        """
+        Schedule until nothing is queued or running (forever with watch=True).
+        Returns the job counts per state.
+        """
+        self.recover()
+        try:
+            while True:
+                self._poll()
+                self._schedule()
+                if not self.running and not watch and not self.db.counts()["queued"]:
+                    break
+                time.sleep(self.poll_s)
+        except KeyboardInterrupt:
+            self._info("Interrupted: stopping workers")
+            self.stop()
+            raise
+        return self.db.counts()
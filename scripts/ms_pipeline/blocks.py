@@ -0,0 +1,293 @@
+from __future__ import annotations
+import json
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .steps import build_dem, build_depth_maps, build_orthomosaic, build_point_cloud
+from .tiling import make_blocks, points_in
+from .workers import run_jobs, write_job
+
+def _mat3(m: Any) -> np.ndarray:
+    return np.array([[float(m[i, j]) for j in range(3)] for i in range(3)])
+
+def _vec(v: Any) -> np.ndarray:
+    return np.array([float(x) for x in v])
+
+def camera_plane_xy(chunk: Any) -> Tuple[List[int], np.ndarray]:
+    """
+    Indices (into chunk.cameras) and region-local XY of the enabled, aligned
+    cameras. Tiling in the region frame avoids any CRS handling and keeps tiles
+    aligned with the region box.
+    """
+    region = chunk.region
+    R = _mat3(region.rot)
+    c = _vec(region.center)
+    idx: List[int] = []
+    pts: List[np.ndarray] = []
+    for i, cam in enumerate(chunk.cameras):
+        if cam.enabled and cam.transform is not None and cam.center is not None:
+            idx.append(i)
+            pts.append(_vec(cam.center))
+    if not pts:
+        return [], np.zeros((0, 2))
+    local = (np.vstack(pts) - c) @ R
+    return idx, local[:, :2]
+
+def _specs(chunk: Any, blocks: List[Any], idx: List[int], index_offset: int = 0) -> List[Dict[str, Any]]:
+    region = chunk.region
+    R = _mat3(region.rot)
+    c = _vec(region.center)
+    size_z = float(_vec(region.size)[2])
+    specs = []
+    for b in blocks:
+        x0, y0, x1, y1 = b.padded
+        center = c + R @ np.array([(x0 + x1) / 2.0, (y0 + y1) / 2.0, 0.0])
+        specs.append({
+            "index": b.index + index_offset,
+            "bounds": list(b.bounds),
+            "padded": list(b.padded),
+            "center": center.tolist(),
+            "size": [x1 - x0, y1 - y0, size_z],
+            "cameras": [idx[i] for i in b.cameras],
+        })
+    return specs
+
+def plan_blocks(chunk: Any, split_cfg: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    JSON-serialisable block specs: region center/size (internal coordinates)
+    and the chunk.cameras indices that stay enabled.
+    """
+    idx, xy = camera_plane_xy(chunk)
+    blocks = make_blocks(
+        xy,
+        split_cfg.get("method", "kdtree"),
+        int(split_cfg.get("target_cameras", 2000)),
+        overlap=float(split_cfg.get("overlap", 0.1)),
+        camera_margin=float(split_cfg.get("camera_margin", 0.1)),
+    )
+    return _specs(chunk, blocks, idx)
+
+def apply_block(Metashape: Any, chunk: Any, spec: Dict[str, Any]) -> None:
+    region = chunk.region
+    region.center = Metashape.Vector(spec["center"])
+    region.size = Metashape.Vector(spec["size"])
+    chunk.region = region
+    keep = set(spec["cameras"])
+    for i, cam in enumerate(chunk.cameras):
+        if i not in keep:
+            cam.enabled = False
+
+def build_block(Metashape: Any, chunk: Any, proc: Dict[str, Any]) -> None:
+    build_depth_maps(Metashape, chunk, proc)
+    build_point_cloud(Metashape, chunk, proc)
+    build_dem(Metashape, chunk, proc)
+    build_orthomosaic(Metashape, chunk, proc)
+
+def block_label(label: str, index: int) -> str:
+    return f"{label} block {index:03d}"
+
+def merged_label(label: str) -> str:
+    return f"{label} (merged)"
+
+def _merge(doc: Any, chunks: List[Any], split_cfg: Dict[str, Any], label: str) -> Any:
+    opts = {"merge_dems": True, "merge_orthomosaics": True}
+    # Keyword names differ between Metashape releases; allow overriding them
+    opts.update(split_cfg.get("merge_options", {}))
+    n_before = len(doc.chunks)
+    doc.mergeChunks(chunks=[c.key for c in chunks], **opts)
+    merged = doc.chunks[n_before] if len(doc.chunks) > n_before else doc.chunks[-1]
+    merged.label = merged_label(label)
+    return merged
+
+def run_block_job(Metashape: Any, job: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Worker side (scripts/ms_worker.py, kind "block"): save the aligned chunk
+    into its own project, restrict it to the block and build dense products.
+    """
+    doc = Metashape.Document()
+    doc.open(job["project"], read_only=True, ignore_lock=True)
+    src = [c for c in doc.chunks if c.label == job["chunk_label"]]
+    if not src:
+        raise RuntimeError(f"Chunk '{job['chunk_label']}' not found in {job['project']}")
+    os.makedirs(os.path.dirname(job["out_project"]), exist_ok=True)
+    doc.save(job["out_project"], chunks=[src[0]])
+    doc.open(job["out_project"])
+    chunk = doc.chunks[0]
+    chunk.label = job["label"]
+    apply_block(Metashape, chunk, job["spec"])
+    build_block(Metashape, chunk, job["processing"])
+    doc.save()
+    return {"ok": True, "project": job["out_project"], "label": job["label"]}
+
+def plan_path(project_path: str) -> str:
+    return os.path.splitext(project_path)[0] + ".blocks.json"
+
+def _save_plan(project_path: str, label: str, specs: List[Dict[str, Any]]) -> None:
+    if not project_path:
+        return
+    path = plan_path(project_path)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"chunk_label": label, "blocks": specs}, f, indent=2)
+    os.replace(tmp, path)
+
+def load_plan(project_path: str, label: str) -> List[Dict[str, Any]]:
+    """
+    Block specs saved by the last split of chunk `label` ([] if none).
+    """
+    path = plan_path(project_path) if project_path else ""
+    if not path or not os.path.isfile(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return data.get("blocks", []) if data.get("chunk_label") == label else []
+
+def _build_specs(Metashape: Any, doc: Any, chunk: Any, specs: List[Dict[str, Any]], proc: Dict[str, Any],
+                 project_path: str, log: Any, wrap: Callable[[Any], Any],
+                 workers_cfg: Optional[Dict[str, Any]]) -> List[Any]:
+    split_cfg = proc.get("split_blocks", {})
+    label = chunk.label
+    mode = split_cfg.get("mode", "sequential")
+    built: List[Any] = []
+    if mode == "parallel":
+        if not project_path:
+            raise ValueError("split_blocks.mode=parallel needs project.project_path")
+        doc.save(project_path)
+        base = os.path.splitext(project_path)[0] + "_blocks"
+        jobs = []
+        for s in specs:
+            name = f"block_{s['index']:03d}"
+            jobs.append(write_job(os.path.join(base, name + ".job.json"), {
+                "kind": "block",
+                "project": project_path,
+                "chunk_label": label,
+                "label": block_label(label, s["index"]),
+                "out_project": os.path.join(base, name + ".psx"),
+                "spec": s,
+                "processing": proc,
+            }))
+        results = run_jobs(jobs, workers_cfg, int(split_cfg.get("workers", 2)), log)
+        for r in results:
+            doc.append(r["project"])
+            built.append(doc.chunks[-1])
+    elif mode == "sequential":
+        for n, s in enumerate(specs):
+            b = chunk.copy()
+            b.label = block_label(label, s["index"])
+            apply_block(Metashape, b, s)
+            log.info(f"Block {n + 1}/{len(specs)} (#{s['index']}): {len(s['cameras'])} cameras")
+            build_block(Metashape, wrap(b), proc)
+            built.append(b)
+            if project_path:
+                doc.save(project_path)
+    else:
+        raise ValueError(f"Unknown split_blocks.mode: {mode}")
+    return built
+
+def _finish_merge(doc: Any, chunk: Any, blocks: List[Any], split_cfg: Dict[str, Any], log: Any) -> Any:
+    if not split_cfg.get("merge", True):
+        return chunk
+    merged = _merge(doc, blocks, split_cfg, chunk.label)
+    log.info(f"Merged {len(blocks)} blocks into '{merged.label}'")
+    if not split_cfg.get("keep_blocks", True):
+        doc.remove(blocks)
+    return merged
+
+def split_and_build(Metashape: Any, doc: Any, chunk: Any, proc: Dict[str, Any], project_path: str,
+                    log: Any, wrap: Optional[Callable[[Any], Any]] = None,
+                    workers_cfg: Optional[Dict[str, Any]] = None) -> Any:
+    """
+    Partition the aligned chunk into overlapping blocks, build depth maps /
+    point cloud / DEM / orthomosaic per block and merge DEMs and orthomosaics
+    into one chunk, which is returned.
+
+    mode "sequential": blocks are chunk copies built one after another in this
+    process (only one block's data is being processed at a time).
+    mode "parallel": the project is saved and every block is built in its own
+    headless Metashape process (at most `workers` at once), then appended back.
+    """
+    split_cfg = proc.get("split_blocks", {})
+    wrap = wrap or (lambda c: c)
+    label = chunk.label
+    specs = plan_blocks(chunk, split_cfg)
+    if not specs:
+        raise RuntimeError("split_blocks: no aligned cameras to tile")
+    log.info(f"Split into {len(specs)} blocks: cameras per block "
+             + ", ".join(str(len(s["cameras"])) for s in specs))
+
+    # Drop blocks left over from a previous run of this stage
+    stale = [c for c in doc.chunks if c.label.startswith(f"{label} block ") or c.label == merged_label(label)]
+    if stale:
+        doc.remove(stale)
+
+    built = _build_specs(Metashape, doc, chunk, specs, proc, project_path, log, wrap, workers_cfg)
+    _save_plan(project_path, label, specs)
+    return _finish_merge(doc, chunk, built, split_cfg, log)
+
+def _cameras_near(idx: List[int], xy: np.ndarray, bounds: List[float], grow: float) -> List[int]:
+    x0, y0, x1, y1 = bounds
+    dx, dy = (x1 - x0) * grow, (y1 - y0) * grow
+    return [idx[n] for n in np.flatnonzero(points_in(xy, (x0 - dx, y0 - dy, x1 + dx, y1 + dy)))]
+
+def update_blocks(Metashape: Any, doc: Any, chunk: Any, proc: Dict[str, Any], project_path: str,
+                  new_cameras: List[int], log: Any, wrap: Optional[Callable[[Any], Any]] = None,
+                  workers_cfg: Optional[Dict[str, Any]] = None) -> Any:
+    """
+    Incremental counterpart of split_and_build: rebuild only the blocks whose
+    padded area contains one of `new_cameras` (chunk.cameras indices), add new
+    blocks for cameras outside every existing block, and re-merge. Falls back to
+    a full split when there is no saved block plan or some blocks are missing.
+    """
+    split_cfg = proc.get("split_blocks", {})
+    wrap = wrap or (lambda c: c)
+    label = chunk.label
+    specs = load_plan(project_path, label)
+    existing = {c.label: c for c in doc.chunks if c.label.startswith(f"{label} block ")}
+    if not specs or any(block_label(label, s["index"]) not in existing for s in specs):
+        log.info("No complete block plan from the previous run; splitting from scratch")
+        return split_and_build(Metashape, doc, chunk, proc, project_path, log, wrap, workers_cfg)
+
+    idx, xy = camera_plane_xy(chunk)
+    pos = {i: n for n, i in enumerate(idx)}
+    new_idx = [i for i in new_cameras if i in pos]
+    new_xy = xy[[pos[i] for i in new_idx]]
+    margin = float(split_cfg.get("camera_margin", 0.1))
+    overlap = float(split_cfg.get("overlap", 0.1))
+
+    touched: List[Dict[str, Any]] = []
+    covered = np.zeros(len(new_xy), dtype=bool)
+    for s in specs:
+        hit = points_in(new_xy, tuple(s["padded"]))
+        if hit.any():
+            covered |= hit
+            # New cameras inside the block (and its margin) take part in the rebuild
+            s["cameras"] = _cameras_near(idx, xy, s["bounds"], overlap + margin)
+            touched.append(s)
+
+    added: List[Dict[str, Any]] = []
+    if not covered.all():
+        # Survey extended beyond the old blocks: tile only the uncovered area
+        extra = make_blocks(new_xy[~covered], split_cfg.get("method", "kdtree"),
+                            int(split_cfg.get("target_cameras", 2000)), overlap=overlap, camera_margin=margin)
+        uncovered = [new_idx[n] for n in np.flatnonzero(~covered)]
+        added = _specs(chunk, extra, uncovered, index_offset=max(s["index"] for s in specs) + 1)
+        for s in added:
+            s["cameras"] = _cameras_near(idx, xy, s["bounds"], overlap + margin)
+
+    log.info(f"Incremental blocks: {len(touched)} of {len(specs)} touched by {len(new_xy)} new cameras, "
+             f"{len(added)} new")
+    rebuild = touched + added
+    stale = [existing[block_label(label, s["index"])] for s in touched]
+    stale += [c for c in doc.chunks if c.label == merged_label(label)]
+    if stale:
+        doc.remove(stale)
+    if rebuild:
+        _build_specs(Metashape, doc, chunk, rebuild, proc, project_path, log, wrap, workers_cfg)
+
+    specs = sorted(specs + added, key=lambda s: s["index"])
+    _save_plan(project_path, label, specs)
+    by_label = {c.label: c for c in doc.chunks}
+    blocks = [by_label[block_label(label, s["index"])] for s in specs]
+    return _finish_merge(doc, chunk, blocks, split_cfg, log)
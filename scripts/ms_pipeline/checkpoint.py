@@ -0,0 +1,98 @@
+from __future__ import annotations
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Sequence, Tuple
+
+MANIFEST_VERSION = 1
+
+def config_hash(*parts: Any) -> str:
+    """
+    Stable hash of JSON-serialisable parts (dict key order does not matter).
+    """
+    blob = json.dumps(parts, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+def photo_fingerprint(photos: Iterable[Tuple[str, int, int]]) -> str:
+    """
+    Fingerprint of the input photo set from (path, size, mtime_ns) entries,
+    as returned by photos.discover_photos. Touching, replacing, adding or
+    removing a photo changes the fingerprint.
+    """
+    h = hashlib.sha256()
+    for p, size, mtime_ns in sorted(photos):
+        h.update(f"{p}\0{size}\0{mtime_ns}\n".encode("utf-8"))
+    return h.hexdigest()
+
+def chain_keys(root_key: str, stages: Sequence[Tuple[str, Any]]) -> List[str]:
+    """
+    Key each stage by its own parameters plus the key of the stage before it,
+    so changing one stage invalidates everything downstream of it.
+    """
+    keys = []
+    prev = root_key
+    for name, params in stages:
+        prev = config_hash(prev, name, params)
+        keys.append(prev)
+    return keys
+
+def manifest_path_for(project_path: str) -> str:
+    return os.path.splitext(project_path)[0] + ".stages.json"
+
+class Checkpoint:
+    """
+    Stage manifest stored next to the .psx project.
+    Records the key each stage completed with; a stage is up to date when its
+    recorded key matches the key computed for the current run.
+    """
+
+    def __init__(self, project_path: str):
+        self.project_path = project_path
+        self.path = manifest_path_for(project_path)
+        self.data: Dict[str, Any] = {"version": MANIFEST_VERSION, "stages": {}}
+        # Graph nodes running in worker threads mark concurrently
+        self._lock = threading.Lock()
+        if os.path.isfile(self.path) and os.path.isfile(project_path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if data.get("version") == MANIFEST_VERSION:
+                    self.data = data
+            except (OSError, ValueError):
+                pass
+
+    @property
+    def stages(self) -> Dict[str, Any]:
+        return self.data.setdefault("stages", {})
+
+    def first_stale(self, names: Sequence[str], keys: Sequence[str]) -> int:
+        """
+        Index of the first stage that has to run; len(names) if all are up to date.
+        """
+        for i, (name, key) in enumerate(zip(names, keys)):
+            rec = self.stages.get(name)
+            if not rec or rec.get("key") != key:
+                return i
+        return len(names)
+
+    def invalidate(self, names: Iterable[str]) -> None:
+        with self._lock:
+            for name in names:
+                self.stages.pop(name, None)
+            self._flush()
+
+    def mark(self, name: str, key: str, **info: Any) -> None:
+        rec = {"key": key, "completed": time.strftime("%Y-%m-%d %H:%M:%S")}
+        rec.update(info)
+        with self._lock:
+            self.stages[name] = rec
+            self._flush()
+
+    def _flush(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.path)
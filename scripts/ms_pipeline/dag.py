@@ -0,0 +1,229 @@
+from __future__ import annotations
+import copy
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Collection, Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from .checkpoint import config_hash
+
+Requires = Union[Tuple[str, ...], Callable[[Dict[str, Any]], Tuple[str, ...]]]
+
+class StepSpec(NamedTuple):
+    name: str
+    fn: Optional[Callable[..., Any]]
+    requires: Requires          # artifacts needed, or a function of the step config
+    provides: Tuple[str, ...]   # artifacts produced
+    sections: Tuple[str, ...]   # config sections the step reads (empty: the whole config)
+
+def step(name: str, requires: Requires = (), provides: Sequence[str] = (), sections: Sequence[str] = ()):
+    """
+    Declare a step for the graph: its name, the artifacts it needs and
+    produces (alignment, depth_maps, dem, ...) and the config sections it reads.
+    """
+    def wrap(fn: Callable[..., Any]) -> Callable[..., Any]:
+        fn.spec = StepSpec(name, fn, requires if callable(requires) else tuple(requires),
+                           tuple(provides), tuple(sections))
+        return fn
+    return wrap
+
+class Node(NamedTuple):
+    id: str
+    step: str
+    fn: Optional[Callable[..., Any]]
+    requires: Tuple[str, ...]
+    provides: Tuple[str, ...]
+    cfg: Dict[str, Any]         # config the step is called with
+    params: Dict[str, Any]      # the part of cfg that keys the node
+
+def _merge(base: Dict[str, Any], override: Dict[str, Any]) -> Dict[str, Any]:
+    out = copy.deepcopy(base)
+    for k, v in override.items():
+        if isinstance(v, dict) and isinstance(out.get(k), dict):
+            out[k] = _merge(out[k], v)
+        else:
+            out[k] = copy.deepcopy(v)
+    return out
+
+def build_graph(spec: Sequence[Any], registry: Dict[str, StepSpec], config_for: Callable[[str], Dict[str, Any]],
+                linear: bool = False) -> Tuple[Dict[str, Node], Dict[str, List[str]]]:
+    """
+    Nodes and dependencies from a graph spec: a list of step names or
+    {"step": ..., "id": ..., "config": {...overrides}, "after": [...]}.
+    Each required artifact comes from the closest earlier node that provides
+    it; "after" adds explicit ordering edges. linear=True makes every node
+    depend on the one before it instead (the fixed processing.stage lists).
+    """
+    nodes: Dict[str, Node] = {}
+    deps: Dict[str, List[str]] = {}
+    after: Dict[str, List[str]] = {}
+    provider: Dict[str, str] = {}
+    for item in spec:
+        if isinstance(item, str):
+            item = {"step": item}
+        name = item.get("step", "")
+        if name not in registry:
+            raise ValueError(f"Unknown graph step: {name!r}")
+        sp = registry[name]
+        nid = item.get("id", name)
+        if nid in nodes:
+            raise ValueError(f"Duplicate graph node id: {nid!r} (set \"id\" to tell them apart)")
+        cfg = _merge(config_for(name), item.get("config", {}))
+        requires = tuple(sp.requires(cfg)) if callable(sp.requires) else sp.requires
+        d: List[str] = []
+        for a in requires:
+            if a not in provider:
+                raise ValueError(f"Graph node {nid!r} needs {a!r} but no earlier node provides it")
+            if provider[a] not in d:
+                d.append(provider[a])
+        if linear:
+            d = [list(nodes)[-1]] if nodes else []
+        params = {s: cfg.get(s, {}) for s in sp.sections} if sp.sections else cfg
+        nodes[nid] = Node(nid, name, sp.fn, requires, sp.provides, cfg, params)
+        deps[nid] = d
+        after[nid] = list(item.get("after", []))
+        for a in sp.provides:
+            provider[a] = nid
+    for nid, extra in after.items():
+        for a in extra:
+            if a not in nodes:
+                raise ValueError(f"Graph node {nid!r}: unknown node in \"after\": {a!r}")
+            if a not in deps[nid]:
+                deps[nid].append(a)
+    return nodes, deps
+
+def topo_order(ids: Sequence[str], deps: Dict[str, Sequence[str]]) -> List[str]:
+    """
+    Kahn's algorithm, keeping the declaration order among ready nodes.
+    """
+    remaining = {i: set(deps.get(i, ())) for i in ids}
+    order: List[str] = []
+    while remaining:
+        ready = [i for i in ids if i in remaining and not remaining[i]]
+        if not ready:
+            raise ValueError("Graph has a cycle: " + ", ".join(sorted(remaining)))
+        for i in ready:
+            del remaining[i]
+            order.append(i)
+        for d in remaining.values():
+            d.difference_update(ready)
+    return order
+
+def node_keys(root_key: str, order: Sequence[str], deps: Dict[str, Sequence[str]],
+              params: Dict[str, Any]) -> Dict[str, str]:
+    """
+    Key of each node from its id, parameters and the keys of its dependencies.
+    For a linear graph these are the keys of checkpoint.chain_keys.
+    """
+    keys: Dict[str, str] = {}
+    for i in order:
+        d = deps.get(i, ())
+        if not d:
+            prev = root_key
+        elif len(d) == 1:
+            prev = keys[d[0]]
+        else:
+            prev = config_hash(*sorted(keys[x] for x in d))
+        keys[i] = config_hash(prev, i, params[i])
+    return keys
+
+def dependants(deps: Dict[str, Sequence[str]]) -> Dict[str, List[str]]:
+    out: Dict[str, List[str]] = {i: [] for i in deps}
+    for i, d in deps.items():
+        for x in d:
+            out[x].append(i)
+    return out
+
+def ancestors(i: str, deps: Dict[str, Sequence[str]]) -> List[str]:
+    out: List[str] = []
+    todo = list(deps.get(i, ()))
+    while todo:
+        x = todo.pop()
+        if x not in out:
+            out.append(x)
+            todo.extend(deps.get(x, ()))
+    return out
+
+def branch_heads(i: str, deps: Dict[str, Sequence[str]]) -> List[str]:
+    """
+    Dependencies of i that are not upstream of another of its dependencies.
+    More than one means i joins branches, whose outputs are in separate
+    chunks when the branches run in workers.
+    """
+    d = list(deps.get(i, ()))
+    up = {a for x in d for a in ancestors(x, deps)}
+    return [x for x in d if x not in up]
+
+def chains(order: Sequence[str], deps: Dict[str, Sequence[str]]) -> List[List[str]]:
+    """
+    Group the graph into maximal linear chains (a node joins the chain of its
+    only dependency when it is that node's only dependant). Chains are the unit
+    of work for worker processes.
+    """
+    down = dependants(deps)
+    out: List[List[str]] = []
+    chain_of: Dict[str, int] = {}
+    for i in order:
+        d = deps.get(i, ())
+        if len(d) == 1 and len(down[d[0]]) == 1 and d[0] in chain_of:
+            c = chain_of[d[0]]
+            out[c].append(i)
+        else:
+            c = len(out)
+            out.append([i])
+        chain_of[i] = c
+    return out
+
+def run_graph(order: Sequence[str], deps: Dict[str, Sequence[str]], run: Callable[[str], Any],
+              max_parallel: int = 1, inline: Collection[str] = ()) -> Dict[str, Any]:
+    """
+    Call run(id) for every id once all of its dependencies have finished, with
+    at most max_parallel running at once in worker threads. Ids in `inline`
+    run in the calling thread while nothing else is running (Metashape calls
+    on the open document). After a failure no new ids start; the first error
+    is raised once the running ones have finished. Returns {id: result}.
+    """
+    limit = max(1, int(max_parallel))
+    pending = list(order)
+    done: Dict[str, Any] = {}
+    running: Dict[Future, str] = {}
+    error: Optional[BaseException] = None
+
+    def ready(i: str) -> bool:
+        return all(d in done for d in deps.get(i, ()))
+
+    with ThreadPoolExecutor(max_workers=limit) as pool:
+        while pending or running:
+            if error is None:
+                for i in list(pending):
+                    if len(running) >= limit:
+                        break
+                    if not ready(i):
+                        continue
+                    if i in inline:
+                        if running:
+                            # Waits for the running ones; later ready ids still use free slots
+                            continue
+                        pending.remove(i)
+                        try:
+                            done[i] = run(i)
+                        except BaseException as e:
+                            error = e
+                        break
+                    pending.remove(i)
+                    running[pool.submit(run, i)] = i
+            if not running:
+                if error is not None or not pending:
+                    break
+                if not any(ready(i) for i in pending):
+                    raise ValueError("Graph has unsatisfiable dependencies: " + ", ".join(pending))
+                continue
+            finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for f in finished:
+                i = running.pop(f)
+                try:
+                    done[i] = f.result()
+                except BaseException as e:
+                    if error is None:
+                        error = e
+    if error is not None:
+        raise error
+    return done
@@ -0,0 +1,372 @@
+from __future__ import annotations
+import hashlib
+import json
+import math
+import os
+import shutil
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .checkpoint import config_hash
+from .enums import maybe_enum
+from .workers import run_jobs, write_job
+
+TMP_DIR = ".export-tmp"
+
+# Leading bytes of readable files, by extension
+MAGIC = {
+    ".tif": (b"II*\x00", b"MM\x00*", b"II+\x00", b"MM\x00+"),
+    ".tiff": (b"II*\x00", b"MM\x00*", b"II+\x00", b"MM\x00+"),
+    ".las": (b"LASF",),
+    ".laz": (b"LASF",),
+    ".pdf": (b"%PDF",),
+    ".ply": (b"ply",),
+    ".jpg": (b"\xff\xd8",),
+    ".jpeg": (b"\xff\xd8",),
+    ".png": (b"\x89PNG",),
+    ".zip": (b"PK",),
+}
+
+# source_data -> chunk attribute whose extent a tiled export splits
+_EXTENT_OF = {"ElevationData": "elevation", "OrthomosaicData": "orthomosaic"}
+
+# Tasks
+
+def _tile_grid(ext: Tuple[float, float, float, float], tiles: Dict[str, Any]) -> List[Tuple[int, int, Tuple[float, float, float, float]]]:
+    """
+    (row, col, bounds) of an nx x ny grid, or of square tiles of `size` CRS units.
+    """
+    w, h = ext[2] - ext[0], ext[3] - ext[1]
+    size = float(tiles.get("size", 0) or 0)
+    nx = max(1, math.ceil(w / size)) if size else max(1, int(tiles.get("nx", 1)))
+    ny = max(1, math.ceil(h / size)) if size else max(1, int(tiles.get("ny", 1)))
+    out = []
+    for r in range(ny):
+        for c in range(nx):
+            out.append((r, c, (ext[0] + w * c / nx, ext[1] + h * r / ny,
+                               ext[0] + w * (c + 1) / nx, ext[1] + h * (r + 1) / ny)))
+    return out
+
+def product_extent(chunk: Any, source: str) -> Optional[Tuple[float, float, float, float]]:
+    """
+    (xmin, ymin, xmax, ymax) of the DEM/orthomosaic in its projection, for tiling.
+    """
+    attrs = [_EXTENT_OF[source]] if source in _EXTENT_OF else ["elevation", "orthomosaic"]
+    for a in attrs:
+        try:
+            p = getattr(chunk, a)
+            ext = (float(p.left), float(p.bottom), float(p.right), float(p.top))
+        except Exception:
+            continue
+        if ext[2] > ext[0] and ext[3] > ext[1]:
+            return ext
+    return None
+
+def _tiled(tasks: List[Dict[str, Any]], chunk: Any, task: Dict[str, Any], source: str, log: Any) -> None:
+    tiles = task["cfg"].get("tiles", {})
+    ext = product_extent(chunk, source) if tiles else None
+    if tiles and ext is None and log is not None:
+        log.warn(f"Export {task['id']}: no DEM/orthomosaic extent to tile, exporting in one piece")
+    if not ext:
+        tasks.append(task)
+        return
+    stem, ext_ = os.path.splitext(task["path"])
+    for r, c, b in _tile_grid(ext, tiles):
+        tasks.append(dict(task, id=f"{task['id']}_r{r}c{c}", path=f"{stem}_r{r}_c{c}{ext_}", region=list(b)))
+
+def export_tasks(chunk: Any, export_cfg: Dict[str, Any], log: Any = None) -> List[Dict[str, Any]]:
+    """
+    One task per output: report, each raster and point cloud (or each tile of
+    it when "tiles" is set), model. Tasks are independent and can run in
+    parallel processes.
+    """
+    out_dir = export_cfg.get("output_dir", "")
+    tasks: List[Dict[str, Any]] = []
+    rep = export_cfg.get("report", {})
+    if rep.get("enabled", False):
+        tasks.append({"id": "report", "kind": "report", "cfg": rep,
+                      "path": rep.get("path", os.path.join(out_dir, "report.pdf"))})
+    for n, r in enumerate(export_cfg.get("rasters", [])):
+        if r.get("enabled", True) and r.get("path", ""):
+            t = {"id": f"raster{n}", "kind": "raster", "cfg": r, "path": r["path"]}
+            _tiled(tasks, chunk, t, str(r.get("source_data", "OrthomosaicData")), log)
+    for n, p in enumerate(export_cfg.get("point_clouds", [])):
+        if p.get("enabled", True) and p.get("path", ""):
+            _tiled(tasks, chunk, {"id": f"point_cloud{n}", "kind": "point_cloud", "cfg": p, "path": p["path"]}, "", log)
+    m = export_cfg.get("model", {})
+    if m.get("enabled", False):
+        tasks.append({"id": "model", "kind": "model", "cfg": m,
+                      "path": m.get("path", os.path.join(out_dir, "model.obj"))})
+    return tasks
+
+# Metashape calls
+
+def _bbox(Metashape: Any, region: Optional[Sequence[float]]) -> Dict[str, Any]:
+    if not region:
+        return {}
+    return {"region": Metashape.BBox(Metashape.Vector(region[:2]), Metashape.Vector(region[2:]))}
+
+def _blocks(c: Dict[str, Any]) -> Dict[str, Any]:
+    if not c.get("split_in_blocks", False):
+        return {}
+    return {"split_in_blocks": True, "block_width": int(c.get("block_width", 10000)),
+            "block_height": int(c.get("block_height", 10000))}
+
+def _export_report(Metashape: Any, chunk: Any, rep: Dict[str, Any], path: str, region: Any) -> None:
+    chunk.exportReport(
+        path=path,
+        title=rep.get("title", ""),
+        description=rep.get("description", ""),
+        font_size=int(rep.get("font_size", 12)),
+        page_numbers=bool(rep.get("page_numbers", True)),
+        save_system_info=bool(rep.get("save_system_info", True)),
+    )
+
+def _export_raster(Metashape: Any, chunk: Any, r: Dict[str, Any], path: str, region: Any) -> None:
+    kw = dict(_blocks(r), **_bbox(Metashape, region))
+    # Internally tiled BigTIFF with overviews reads fast in GIS; off unless asked
+    for key in ("tiff_tiled", "tiff_big", "tiff_overviews"):
+        if key in r:
+            kw[key] = bool(r[key])
+    if "tiff_compression" in r:
+        kw["tiff_compression"] = maybe_enum(Metashape, r["tiff_compression"])
+    chunk.exportRaster(
+        path=path,
+        format=maybe_enum(Metashape, r.get("format", "RasterFormatGeoTIFF"), Metashape.RasterFormatGeoTIFF),
+        image_format=maybe_enum(Metashape, r.get("image_format", "ImageFormatNone"), Metashape.ImageFormatNone),
+        source_data=maybe_enum(Metashape, r.get("source_data", "OrthomosaicData"), Metashape.OrthomosaicData),
+        save_world=bool(r.get("save_world", True)),
+        save_alpha=bool(r.get("save_alpha", True)),
+        white_background=bool(r.get("white_background", True)),
+        clip_to_boundary=bool(r.get("clip_to_boundary", True)),
+        **kw,
+    )
+
+def _export_point_cloud(Metashape: Any, chunk: Any, p: Dict[str, Any], path: str, region: Any) -> None:
+    chunk.exportPointCloud(
+        path=path,
+        format=maybe_enum(Metashape, p.get("format", "PointCloudFormatLAZ"), Metashape.PointCloudFormatLAZ),
+        source_data=maybe_enum(Metashape, p.get("source_data", "PointCloudData"), Metashape.PointCloudData),
+        save_point_color=bool(p.get("save_point_color", True)),
+        save_point_classification=bool(p.get("save_point_classification", True)),
+        **dict(_blocks(p), **_bbox(Metashape, region)),
+    )
+
+def _export_model(Metashape: Any, chunk: Any, m: Dict[str, Any], path: str, region: Any) -> None:
+    chunk.exportModel(
+        path=path,
+        format=maybe_enum(Metashape, m.get("format", "ModelFormatOBJ"), Metashape.ModelFormatOBJ),
+        texture_format=maybe_enum(Metashape, m.get("texture_format", "ImageFormatJPEG"), Metashape.ImageFormatJPEG),
+        save_texture=bool(m.get("save_texture", True)),
+        save_uv=bool(m.get("save_uv", True)),
+        save_normals=bool(m.get("save_normals", True)),
+        save_colors=bool(m.get("save_colors", True)),
+        binary=bool(m.get("binary", True)),
+    )
+
+EXPORTERS = {
+    "report": _export_report,
+    "raster": _export_raster,
+    "point_cloud": _export_point_cloud,
+    "model": _export_model,
+}
+
+def _tmp_dir(task: Dict[str, Any]) -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(task["path"])), TMP_DIR, task["id"])
+
+def run_export_task(Metashape: Any, chunk: Any, task: Dict[str, Any]) -> List[str]:
+    """
+    Export into a private temp folder next to the target, then move every file
+    written (sidecars, blocks, textures) into place with os.replace. Readers
+    never see a half-written file. Returns the final paths.
+    """
+    tmp = _tmp_dir(task)
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    EXPORTERS[task["kind"]](Metashape, chunk, task["cfg"], os.path.join(tmp, os.path.basename(task["path"])),
+                            task.get("region"))
+    dest = os.path.dirname(os.path.abspath(task["path"]))
+    files = []
+    for root, _, names in os.walk(tmp):
+        for name in sorted(names):
+            src = os.path.join(root, name)
+            dst = os.path.join(dest, os.path.relpath(src, tmp))
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            os.replace(src, dst)
+            files.append(dst)
+    # The shared parent is removed by export_products once every task is done:
+    # removing it here races with other workers creating their folders in it
+    shutil.rmtree(tmp, ignore_errors=True)
+    if not files:
+        raise RuntimeError(f"Export {task['id']} wrote no files")
+    return files
+
+def run_export_job(Metashape: Any, job: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Worker side (scripts/ms_worker.py, kind "export"): one export task on the
+    project opened read-only.
+    """
+    doc = Metashape.Document()
+    doc.open(job["project"], read_only=True, ignore_lock=True)
+    src = [c for c in doc.chunks if c.label == job["chunk_label"]]
+    if not src:
+        raise RuntimeError(f"Chunk '{job['chunk_label']}' not found in {job['project']}")
+    return {"ok": True, "files": run_export_task(Metashape, src[0], job["task"])}
+
+# Validation
+
+def validate_file(path: str) -> Dict[str, Any]:
+    """
+    Size, SHA-256 and a header check (magic bytes; point count for LAS/LAZ).
+    """
+    rec: Dict[str, Any] = {"path": path, "ok": False}
+    try:
+        size = os.path.getsize(path)
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            head = f.read(375)
+            h.update(head)
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    except OSError as e:
+        rec["error"] = f"{type(e).__name__}: {e}"
+        return rec
+    rec.update(size=size, sha256=h.hexdigest())
+    if size == 0:
+        rec["error"] = "empty file"
+        return rec
+    magic = MAGIC.get(os.path.splitext(path)[1].lower())
+    if magic is not None and not head.startswith(magic):
+        rec["error"] = "unreadable header"
+        return rec
+    if head.startswith(b"LASF") and len(head) >= 111:
+        # Legacy point count (LAS 1.0-1.3); LAS 1.4 keeps a 64-bit count at 247
+        n = struct.unpack_from("<I", head, 107)[0]
+        if not n and len(head) >= 255:
+            n = struct.unpack_from("<Q", head, 247)[0]
+        rec["points"] = int(n)
+    rec["ok"] = True
+    return rec
+
+def validate_files(paths: Sequence[str], workers: int = 4) -> List[Dict[str, Any]]:
+    # hashlib releases the GIL on large buffers, so threads hash files in parallel
+    with ThreadPoolExecutor(max_workers=max(1, int(workers))) as pool:
+        return list(pool.map(validate_file, paths))
+
+# Orchestration
+
+def manifest_path(export_cfg: Dict[str, Any]) -> str:
+    path = export_cfg.get("manifest", "")
+    if path:
+        return path
+    out_dir = export_cfg.get("output_dir", "")
+    return os.path.join(out_dir, "exports.json") if out_dir else ""
+
+def _load_manifest(path: str) -> Dict[str, Any]:
+    if not path or not os.path.isfile(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f).get("tasks", {})
+    except (OSError, ValueError):
+        return {}
+
+def _save_manifest(path: str, tasks: Dict[str, Any]) -> None:
+    if not path:
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"tasks": tasks}, f, indent=2)
+    os.replace(tmp, path)
+
+def _still_valid(rec: Dict[str, Any], key: str) -> bool:
+    """
+    A task from an earlier run with the same key whose files are unchanged on disk.
+    """
+    if rec.get("key") != key or not rec.get("files"):
+        return False
+    return all(os.path.isfile(f["path"]) and os.path.getsize(f["path"]) == f.get("size") for f in rec["files"])
+
+def export_products(Metashape: Any, chunk: Any, export_cfg: Dict[str, Any], log: Any = None,
+                    project: str = "", chunk_label: str = "", key: str = "",
+                    workers_cfg: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Run every export task, validate the files and retry failed tasks up to
+    export.retries times. With export.workers > 0 and a saved project, tasks
+    run in that many headless Metashape processes that open the project
+    read-only; otherwise one after another in this process. Tasks recorded in
+    the manifest under the same key with unchanged files are skipped, so a
+    rerun after a failed export only redoes what failed.
+    """
+    if not export_cfg:
+        return {}
+    # Silent without a logger (worker jobs call this with none)
+    say = log.info if log is not None else (lambda msg: None)
+    out_dir = export_cfg.get("output_dir", "")
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    tasks = export_tasks(chunk, export_cfg, log)
+    man_path = manifest_path(export_cfg)
+    manifest = _load_manifest(man_path) if key else {}
+    keys = {t["id"]: config_hash(key, t) for t in tasks}
+    pending = []
+    for t in tasks:
+        if key and _still_valid(manifest.get(t["id"], {}), keys[t["id"]]):
+            say(f"Export {t['id']}: up to date, skipping")
+        else:
+            pending.append(t)
+    workers = int(export_cfg.get("workers", 0)) if project else 0
+    retries = int(export_cfg.get("retries", 1))
+    validate_workers = int(export_cfg.get("validate_workers", 4))
+
+    for attempt in range(retries + 1):
+        if not pending:
+            break
+        say(f"Exports: {len(pending)} task(s)" + (f" in {min(workers, len(pending))} worker(s)" if workers else "")
+            + (f", retry {attempt}" if attempt else ""))
+        produced: Dict[str, Any] = {}
+        if workers:
+            base = os.path.join(os.path.splitext(project)[0] + "_exports")
+            jobs = [write_job(os.path.join(base, t["id"] + ".job.json"), {
+                "kind": "export", "project": project, "chunk_label": chunk_label or chunk.label, "task": t,
+            }) for t in pending]
+            for t, r in zip(pending, run_jobs(jobs, workers_cfg, workers, log, check=False)):
+                produced[t["id"]] = r.get("files") if r.get("ok") else (r.get("error") or r.get("output_log", "failed"))
+        else:
+            for t in pending:
+                try:
+                    produced[t["id"]] = run_export_task(Metashape, chunk, t)
+                except Exception as e:
+                    produced[t["id"]] = f"{type(e).__name__}: {e}"
+
+        files = [f for v in produced.values() if isinstance(v, list) for f in v]
+        checked = {r["path"]: r for r in validate_files(files, validate_workers)}
+        failed = []
+        for t in pending:
+            v = produced[t["id"]]
+            if not isinstance(v, list):
+                say(f"Export {t['id']}: FAILED ({v})")
+                failed.append(t)
+                continue
+            recs = [checked[f] for f in v]
+            bad = [r for r in recs if not r["ok"]]
+            if bad:
+                say(f"Export {t['id']}: invalid output: " + "; ".join(f"{r['path']}: {r['error']}" for r in bad))
+                failed.append(t)
+                continue
+            manifest[t["id"]] = {"key": keys[t["id"]], "kind": t["kind"], "files": recs}
+            say(f"Export {t['id']}: {len(recs)} file(s), {sum(r['size'] for r in recs) / 1e6:.1f} MB")
+        if key:
+            _save_manifest(man_path, manifest)
+        pending = failed
+
+    for parent in {os.path.dirname(_tmp_dir(t)) for t in tasks}:
+        try:
+            os.rmdir(parent)
+        except OSError:
+            pass
+    if pending:
+        raise RuntimeError(f"{len(pending)} export task(s) failed: {', '.join(t['id'] for t in pending)}")
+    return {t["id"]: manifest.get(t["id"], {}) for t in tasks}
@@ -0,0 +1,85 @@
+from __future__ import annotations
+import copy
+import json
+import os
+from typing import Any, Dict, List, Sequence, Tuple
+
+from .steps import build_depth_maps, run_match_align_optimize
+
+def _norm(path: str) -> str:
+    return os.path.normcase(os.path.abspath(path))
+
+def diff_photos(chunk: Any, photos: List[str]) -> Tuple[List[str], List[str]]:
+    """
+    Compare the discovered photos with the cameras already in the chunk.
+    Returns (new photo paths, camera photo paths no longer found on disk).
+    """
+    existing = {}
+    for cam in chunk.cameras:
+        photo = getattr(cam, "photo", None)
+        if photo is not None and photo.path:
+            existing[_norm(photo.path)] = photo.path
+    current = {_norm(p) for p in photos}
+    new = [p for p in photos if _norm(p) not in existing]
+    missing = sorted(path for key, path in existing.items() if key not in current)
+    return new, missing
+
+def inputs_path(project_path: str) -> str:
+    return os.path.splitext(project_path)[0] + ".inputs.json"
+
+def input_stamps(entries: Sequence[Tuple[str, int, int]], masks: Dict[str, Dict[str, Any]]) -> Dict[str, List[Any]]:
+    """
+    What setup read for each photo: size, mtime and the mask file (named after its content).
+    """
+    return {_norm(p): [size, mtime_ns, masks.get(p, {}).get("path", "")] for p, size, mtime_ns in entries}
+
+def load_inputs(project_path: str) -> Dict[str, List[Any]]:
+    try:
+        with open(inputs_path(project_path), "r", encoding="utf-8") as f:
+            return json.load(f).get("photos", {})
+    except (OSError, ValueError):
+        return {}
+
+def save_inputs(project_path: str, stamps: Dict[str, List[Any]]) -> None:
+    path = inputs_path(project_path)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"photos": stamps}, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+def changed_inputs(previous: Dict[str, List[Any]], current: Dict[str, List[Any]]) -> List[str]:
+    """
+    Photos of the previous run whose file or mask is different now. An
+    incremental update only adds cameras, so these need a full rerun.
+    Photos no longer on disk are not counted (their cameras are kept).
+    """
+    return sorted(p for p, s in previous.items() if p in current and list(current[p]) != list(s))
+
+def add_new_photos(chunk: Any, new_photos: List[str]) -> List[int]:
+    """
+    Add photos to the chunk; returns the chunk.cameras indices of the new cameras.
+    """
+    if not new_photos:
+        return []
+    n_before = len(chunk.cameras)
+    chunk.addPhotos(new_photos)
+    return list(range(n_before, len(chunk.cameras)))
+
+def incremental_processing(proc: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Copy of the processing config that keeps existing matches, alignment and
+    depth maps: only the new cameras are matched, aligned and get depth maps.
+    """
+    proc = copy.deepcopy(proc)
+    mp = proc.setdefault("match_photos", {})
+    mp["reset_matches"] = False
+    mp["keep_keypoints"] = True
+    proc.setdefault("align_cameras", {})["reset_alignment"] = False
+    proc.setdefault("build_depth_maps", {})["reuse_depth"] = True
+    return proc
+
+def align_new(Metashape: Any, chunk: Any, proc: Dict[str, Any]) -> None:
+    run_match_align_optimize(Metashape, chunk, incremental_processing(proc))
+
+def depth_maps_new(Metashape: Any, chunk: Any, proc: Dict[str, Any]) -> None:
+    build_depth_maps(Metashape, chunk, incremental_processing(proc))
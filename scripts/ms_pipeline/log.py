@@ -1,29 +1,218 @@
-from __future__ import annotations
-import os
-import time
-from typing import Optional
-
-class Logger:
-    def __init__(self, path: str):
-        os.makedirs(os.path.dirname(path), exist_ok=True)
-        self.path = path
-
-    def _write(self, level: str, msg: str) -> None:
-        ts = time.strftime("%Y-%m-%d %H:%M:%S")
-        line = f"[{ts}] {level}: {msg}"
-        with open(self.path, "a", encoding="utf-8") as f:
-            f.write(line + "\n")
-        # Also print to Metashape console / stdout
-        try:
-            print(line)
-        except Exception:
-            pass
-
-    def info(self, msg: str) -> None:
-        self._write("INFO", msg)
-
-    def warn(self, msg: str) -> None:
-        self._write("WARN", msg)
-
-    def error(self, msg: str) -> None:
-        self._write("ERROR", msg)
\ No newline at end of file
+from __future__ import annotations
+import atexit
+import collections
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, List, TextIO, Tuple
+
+class Logger:
+    """
+    Pipeline log. Records are queued and written by a background thread that
+    keeps one file handle open and flushes in batches, so logging never waits
+    on the (possibly network) filesystem.
+
+    Human-readable lines go to <path> and stdout; with structured=True every
+    record is also written as a JSON line to <path minus .log>.jsonl, including
+    stage/chunk/elapsed and any keyword fields passed to info/warn/error.
+    Files rotate to .1, .2, ... when they reach max_bytes (0 = never).
+    Everything queued is written on flush(), close(), errors and process exit.
+    """
+
+    def __init__(self, path: str, structured: bool = True, echo: bool = True,
+                 max_bytes: int = 0, backups: int = 5, flush_interval: float = 0.5):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path = path
+        self.json_path = (os.path.splitext(path)[0] + ".jsonl") if structured else ""
+        self.echo = echo
+        self.max_bytes = int(max_bytes)
+        self.backups = int(backups)
+        self.flush_interval = float(flush_interval)
+        self.context: Dict[str, Any] = {}
+        self._t0 = time.time()
+        # deque append/popleft are atomic, much cheaper than queue.Queue per record
+        self._buf: "collections.deque[Any]" = collections.deque()
+        self._wake = threading.Event()
+        self._files: Dict[str, TextIO] = {}
+        self._closed = False
+        self._thread = threading.Thread(target=self._worker, name="ms-pipeline-log", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # Public API
+
+    def info(self, msg: str, **fields: Any) -> None:
+        self._write("INFO", msg, fields)
+
+    def warn(self, msg: str, **fields: Any) -> None:
+        self._write("WARN", msg, fields)
+
+    def error(self, msg: str, **fields: Any) -> None:
+        self._write("ERROR", msg, fields)
+        # Errors often precede a crash: make sure they are on disk
+        self.flush()
+
+    def bind(self, **context: Any) -> None:
+        """
+        Set fields attached to every following record (e.g. stage=..., chunk=...).
+        None removes a field.
+        """
+        for k, v in context.items():
+            if v is None:
+                self.context.pop(k, None)
+            else:
+                self.context[k] = v
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """
+        Block until everything logged so far is on disk, at most `timeout`
+        seconds (a hung filesystem must not hang the run). If the writer
+        thread has died the queue is written here. Returns False on timeout.
+        """
+        if self._closed:
+            return True
+        done = threading.Event()
+        self._buf.append(done)
+        self._wake.set()
+        deadline = time.monotonic() + float(timeout)
+        while not done.wait(min(0.5, max(0.0, deadline - time.monotonic()))):
+            if not self._thread.is_alive():
+                self._drain()
+                return True
+            if time.monotonic() >= deadline:
+                return False
+        return True
+
+    def close(self, timeout: float = 10.0) -> None:
+        if self._closed:
+            return
+        self._buf.append(None)
+        self._wake.set()
+        self._thread.join(float(timeout))
+        self._closed = True
+        if not self._thread.is_alive():
+            self._drain()
+
+    def __enter__(self) -> "Logger":
+        return self
+
+    def __exit__(self, exc_type: Any, exc: Any, tb: Any) -> None:
+        if exc is not None:
+            self.error(f"{exc_type.__name__}: {exc}")
+        self.close()
+
+    # Internals
+
+    def _write(self, level: str, msg: str, fields: Dict[str, Any]) -> None:
+        now = time.time()
+        head = {"ts": now, "level": level, "msg": msg, "elapsed": round(now - self._t0, 3)}
+        rec = dict(head, **self.context)
+        rec.update(fields)
+        # Context and caller fields never replace the record's own keys
+        rec.update(head)
+        item = (rec, fields)
+        if self._closed:
+            # Late records after close (e.g. from atexit handlers): write synchronously
+            self._emit([item])
+            self._close_files()
+            return
+        self._buf.append(item)
+
+    @staticmethod
+    def _format(rec: Dict[str, Any], fields: Dict[str, Any]) -> str:
+        # Human format stays "[ts] LEVEL: msg"; explicit fields are appended,
+        # bound context only goes to the JSON records.
+        ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(rec["ts"]))
+        line = f"[{ts}] {rec['level']}: {rec['msg']}"
+        if fields:
+            line += " | " + " ".join(f"{k}={v}" for k, v in fields.items())
+        return line
+
+    def _file(self, path: str) -> TextIO:
+        f = self._files.get(path)
+        if f is None:
+            f = open(path, "a", encoding="utf-8")
+            self._files[path] = f
+        return f
+
+    def _rotate(self, path: str) -> None:
+        f = self._files.pop(path, None)
+        if f is not None:
+            f.close()
+        for i in range(self.backups - 1, 0, -1):
+            src = f"{path}.{i}"
+            if os.path.exists(src):
+                os.replace(src, f"{path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(path, f"{path}.1")
+        else:
+            os.remove(path)
+
+    def _append(self, path: str, text: str) -> None:
+        f = self._file(path)
+        f.write(text)
+        if self.max_bytes and f.tell() >= self.max_bytes:
+            self._rotate(path)
+
+    def _emit(self, batch: List[Tuple[Dict[str, Any], Dict[str, Any]]]) -> None:
+        lines = [self._format(r, f) for r, f in batch]
+        try:
+            self._append(self.path, "\n".join(lines) + "\n")
+            if self.json_path:
+                self._append(self.json_path, "".join(json.dumps(r, default=str) + "\n" for r, _ in batch))
+            for f in self._files.values():
+                f.flush()
+        except OSError as e:
+            sys.stderr.write(f"Logger: cannot write {self.path}: {e}\n")
+        if self.echo:
+            # Also print to Metashape console / stdout
+            try:
+                print("\n".join(lines))
+            except Exception:
+                pass
+
+    def _drain(self) -> None:
+        """
+        Write what is still queued from this thread (the writer thread is gone).
+        """
+        batch = []
+        while self._buf:
+            item = self._buf.popleft()
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is not None:
+                batch.append(item)
+        if batch:
+            self._emit(batch)
+        self._close_files()
+
+    def _close_files(self) -> None:
+        for f in self._files.values():
+            try:
+                f.close()
+            except OSError:
+                pass
+        self._files.clear()
+
+    def _worker(self) -> None:
+        stop = False
+        while not stop:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            batch: List[Tuple[Dict[str, Any], Dict[str, Any]]] = []
+            waiters: List[threading.Event] = []
+            while self._buf:
+                item = self._buf.popleft()
+                if item is None:
+                    stop = True
+                elif isinstance(item, threading.Event):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+            if batch:
+                self._emit(batch)
+            for w in waiters:
+                w.set()
+        self._close_files()
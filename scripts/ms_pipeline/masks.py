@@ -0,0 +1,196 @@
+from __future__ import annotations
+import json
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .checkpoint import config_hash
+from .pool import parallel_map
+
+CACHE_VERSION = 1
+
+# Background reference frames, loaded once per worker process
+_BACKGROUNDS: Dict[Tuple[str, int], Any] = {}
+
+def _require_pil() -> Any:
+    try:
+        from PIL import Image
+    except ImportError as e:
+        raise RuntimeError("input.masks needs Pillow in Metashape's Python (see docs/installation.md)") from e
+    return Image
+
+def _load_rgb(Image: Any, path: str, downscale: int) -> Tuple[Any, Tuple[int, int]]:
+    """
+    RGB pixels at 1/downscale size (int16, ready for differences) and the full image size.
+    """
+    im = Image.open(path)
+    full = im.size
+    w, h = max(1, full[0] // downscale), max(1, full[1] // downscale)
+    # JPEG: let the decoder downscale in the DCT domain instead of decoding full size
+    im.draft("RGB", (w, h))
+    im = im.convert("RGB")
+    if im.size != (w, h):
+        im = im.resize((w, h), Image.BOX)
+    return np.asarray(im, dtype=np.int16), full
+
+def _background(Image: Any, path: str, downscale: int) -> Any:
+    key = (path, downscale)
+    if key not in _BACKGROUNDS:
+        _BACKGROUNDS[key] = _load_rgb(Image, path, downscale)
+    return _BACKGROUNDS[key]
+
+def _grow(m: Any, r: int) -> Any:
+    """
+    Binary dilation with a (2r+1) square, as two separable passes of shifted ORs.
+    """
+    if r <= 0:
+        return m
+    for axis in (0, 1):
+        src, m = m, m.copy()
+        for s in range(1, r + 1):
+            if axis == 0:
+                m[s:, :] |= src[:-s, :]
+                m[:-s, :] |= src[s:, :]
+            else:
+                m[:, s:] |= src[:, :-s]
+                m[:, :-s] |= src[:, s:]
+    return m
+
+def _shrink(m: Any, r: int) -> Any:
+    return ~_grow(~m, r) if r > 0 else m
+
+def foreground(rgb: Any, cfg: Dict[str, Any], bg: Optional[Any] = None) -> Any:
+    """
+    Boolean foreground mask of an RGB image: pixels that differ from the
+    background frame by more than `threshold` in any channel, or (without a
+    background frame) pixels further than `tolerance` from every backdrop
+    color. Then an opening of `open_px` removes specks and `dilate_px`
+    grows the object so its edges are kept.
+    """
+    if bg is not None:
+        fg = np.abs(rgb - bg).max(axis=2) > int(cfg.get("threshold", 30))
+    else:
+        tol = int(cfg.get("tolerance", 40))
+        fg = np.ones(rgb.shape[:2], dtype=bool)
+        for c in cfg.get("colors", [[255, 255, 255]]):
+            fg &= np.abs(rgb - np.asarray(c, dtype=np.int16)).max(axis=2) > tol
+    r = int(cfg.get("open_px", 2))
+    fg = _grow(_shrink(fg, r), r)
+    return _grow(fg, int(cfg.get("dilate_px", 4)))
+
+def make_mask(job: Tuple[str, str, Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Compute one mask and write it as an 8-bit PNG at full image size (white =
+    object, black = masked). Runs in a worker process.
+    """
+    path, out_path, cfg = job
+    Image = _require_pil()
+    ds = max(1, int(cfg.get("downscale", 4)))
+    try:
+        rgb, full = _load_rgb(Image, path, ds)
+        bg = None
+        if cfg.get("background"):
+            bg, bg_full = _background(Image, cfg["background"], ds)
+            if bg_full != full:
+                return {"error": f"background is {bg_full[0]}x{bg_full[1]}, photo is {full[0]}x{full[1]}"}
+        fg = foreground(rgb, cfg, bg)
+        im = Image.fromarray(fg.astype(np.uint8) * 255)
+        if im.size != full:
+            im = im.resize(full, Image.NEAREST)
+        tmp = out_path + ".tmp.png"
+        im.save(tmp)
+        os.replace(tmp, out_path)
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+    return {"fraction": round(float(fg.mean()), 4)}
+
+def _background_for(path: str, cfg: Dict[str, Any]) -> str:
+    """
+    Background frame for a photo: backgrounds[<photo folder name>] (one per
+    rig camera), else background.
+    """
+    per_dir = cfg.get("backgrounds", {})
+    return per_dir.get(os.path.basename(os.path.dirname(path)), "") or cfg.get("background", "")
+
+def _load_index(path: str) -> Dict[str, Any]:
+    if not os.path.isfile(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get("version") != CACHE_VERSION:
+        return {}
+    return data.get("masks", {})
+
+def _save_index(path: str, masks: Dict[str, Any]) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": CACHE_VERSION, "masks": masks}, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+def generate_masks(entries: Sequence[Tuple[str, int, int]], cfg: Dict[str, Any], cache_dir: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Mask file (or error) per photo path. Masks are cached in cache_dir under a
+    hash of the photo fingerprint (path, size, mtime), the background frame and
+    the mask settings, so only new or changed photos are processed. Masks
+    covering less than min_foreground or more than max_foreground of the frame
+    are reported as errors: a wrong mask costs more than no mask.
+    """
+    method = {k: cfg[k] for k in ("threshold", "tolerance", "colors", "open_px", "dilate_px", "downscale") if k in cfg}
+    stamps: Dict[str, Any] = {}
+    jobs: List[Tuple[str, str, Dict[str, Any]]] = []
+    keys = []
+    for p, size, mtime_ns in entries:
+        bg = _background_for(p, cfg)
+        if bg and bg not in stamps:
+            st = os.stat(bg)
+            stamps[bg] = [bg, st.st_size, st.st_mtime_ns]
+        key = config_hash(CACHE_VERSION, p, size, mtime_ns, stamps.get(bg), method)[:24]
+        keys.append(key)
+        jobs.append((p, os.path.join(cache_dir, key + ".png"), dict(method, background=bg)))
+
+    os.makedirs(cache_dir, exist_ok=True)
+    index_path = os.path.join(cache_dir, "index.json")
+    index = _load_index(index_path)
+    todo = [i for i, k in enumerate(keys) if k not in index or not os.path.isfile(jobs[i][1])]
+    if todo:
+        _require_pil()
+        results = parallel_map(make_mask, [jobs[i] for i in todo], workers=int(cfg.get("workers", 0)))
+        for i, r in zip(todo, results):
+            index[keys[i]] = r
+        # Drop masks of photos that are gone or changed
+        keep = set(keys)
+        for name in os.listdir(cache_dir):
+            if name.endswith(".png") and name[:-4] not in keep:
+                os.remove(os.path.join(cache_dir, name))
+        _save_index(index_path, {k: v for k, v in index.items() if k in keep})
+
+    lo, hi = float(cfg.get("min_foreground", 0.01)), float(cfg.get("max_foreground", 0.95))
+    out: Dict[str, Dict[str, Any]] = {}
+    for (p, _, _), k, job in zip(entries, keys, jobs):
+        r = dict(index[k])
+        if "error" not in r and not lo <= r["fraction"] <= hi:
+            r["error"] = f"foreground {r['fraction']:.1%} outside {lo:.0%}-{hi:.0%}"
+        if "error" not in r:
+            r["path"] = job[1]
+        out[p] = r
+    return out
+
+def apply_masks(Metashape: Any, cameras: Sequence[Any], masks: Dict[str, Dict[str, Any]]) -> int:
+    """
+    Load each camera's mask file into the chunk. Returns the number of cameras masked.
+    """
+    n = 0
+    for cam in cameras:
+        photo = getattr(cam, "photo", None)
+        rec = masks.get(os.path.abspath(photo.path) if photo is not None else "", {})
+        if not rec.get("path"):
+            continue
+        m = Metashape.Mask()
+        m.load(rec["path"])
+        cam.mask = m
+        n += 1
+    return n
@@ -0,0 +1,374 @@
+from __future__ import annotations
+import calendar
+import math
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .pool import parallel_map
+
+INDEX_VERSION = 1
+
+# Column -> dtype of the on-disk index; missing values are "" / 0 / NaN
+COLUMNS = {
+    "path": "U",
+    "size": np.int64,
+    "mtime_ns": np.int64,
+    "make": "U",
+    "model": "U",
+    "serial": "U",
+    "width": np.int32,
+    "height": np.int32,
+    "orientation": np.int16,
+    "focal": np.float32,
+    "focal35": np.float32,
+    "time": np.float64,
+    "lat": np.float64,
+    "lon": np.float64,
+    "alt": np.float64,
+    "rel_alt": np.float32,
+    "pitch": np.float32,
+    "yaw": np.float32,
+    "error": "U",
+}
+
+# XMP properties (DJI and similar drones) -> column
+XMP_FIELDS = {
+    "RelativeAltitude": "rel_alt",
+    "GimbalPitchDegree": "pitch",
+    "GimbalYawDegree": "yaw",
+}
+_XMP_RE = re.compile(r"\b(?:\w+:)?(" + "|".join(XMP_FIELDS) + r")(?:\s*=\s*\"|>)\s*([-+]?[\d.]+)")
+
+def _rational(v: Any) -> float:
+    try:
+        return float(v)
+    except (TypeError, ValueError, ZeroDivisionError):
+        try:
+            return float(v[0]) / float(v[1])
+        except Exception:
+            return float("nan")
+
+def _dms(v: Any, ref: Any) -> float:
+    d = _rational(v[0]) + _rational(v[1]) / 60.0 + _rational(v[2]) / 3600.0
+    return -d if str(ref).upper() in ("S", "W") else d
+
+def _text(v: Any) -> str:
+    if isinstance(v, bytes):
+        v = v.decode("utf-8", "replace")
+    return str(v).strip("\x00 ") if v is not None else ""
+
+def _exif_time(v: Any) -> Optional[float]:
+    try:
+        return float(calendar.timegm(time.strptime(_text(v)[:19], "%Y:%m:%d %H:%M:%S")))
+    except (TypeError, ValueError):
+        return None
+
+def _xmp(im: Any) -> Dict[str, float]:
+    raw = im.info.get("xmp") or im.info.get("XML:com.adobe.xmp") or b""
+    if not raw and hasattr(im, "tag_v2"):
+        raw = im.tag_v2.get(700, b"")
+    if isinstance(raw, bytes):
+        raw = raw.decode("utf-8", "replace")
+    return {XMP_FIELDS[k]: float(v) for k, v in _XMP_RE.findall(raw or "")}
+
+def have_pillow() -> bool:
+    """
+    Headers are read with Pillow; without it the index has nothing to check.
+    """
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def read_metadata(path: str) -> Dict[str, Any]:
+    """
+    Camera, size, focal length, capture time, EXIF GPS position and drone XMP
+    fields of one photo, from the file header only (no pixel decoding).
+    Missing fields are left out. Runs in a worker thread.
+    """
+    try:
+        from PIL import Image
+    except ImportError:
+        return {"error": "Pillow not available"}
+    try:
+        with Image.open(path) as im:
+            out: Dict[str, Any] = {"width": im.size[0], "height": im.size[1]}
+            exif = im.getexif()
+            for tag, key in ((0x010F, "make"), (0x0110, "model")):
+                if exif.get(tag):
+                    out[key] = _text(exif[tag])
+            if exif.get(0x0112):
+                out["orientation"] = int(exif[0x0112])
+            sub = exif.get_ifd(0x8769)
+            if sub.get(0xA431):
+                out["serial"] = _text(sub[0xA431])
+            if sub.get(0x920A):
+                out["focal"] = _rational(sub[0x920A])
+            if sub.get(0xA405):
+                out["focal35"] = float(sub[0xA405])
+            t = _exif_time(sub.get(0x9003) or exif.get(0x0132))
+            if t is not None:
+                out["time"] = t
+            gps = exif.get_ifd(0x8825)
+            if 2 in gps and 4 in gps:
+                out["lat"] = _dms(gps[2], gps.get(1, "N"))
+                out["lon"] = _dms(gps[4], gps.get(3, "E"))
+                if 6 in gps:
+                    alt = _rational(gps[6])
+                    out["alt"] = -alt if gps.get(5) in (1, b"\x01") else alt
+            out.update(_xmp(im))
+            return out
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+
+def _empty(dtype: Any, n: int) -> Any:
+    if dtype == "U":
+        return np.full(n, "", dtype="U1")
+    if np.issubdtype(dtype, np.floating):
+        return np.full(n, np.nan, dtype=dtype)
+    return np.zeros(n, dtype=dtype)
+
+def _columns(records: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    cols = {}
+    for name, dtype in COLUMNS.items():
+        if dtype == "U":
+            cols[name] = np.array([str(r.get(name, "")) for r in records] or [""], dtype=str)[:len(records)]
+        else:
+            miss = np.nan if np.issubdtype(dtype, np.floating) else 0
+            cols[name] = np.array([r.get(name, miss) for r in records], dtype=dtype)
+    return cols
+
+class MetadataIndex:
+    """
+    Photo metadata as one NumPy array per column (see COLUMNS), with lookups by
+    path, sensor groups and a grid index over the GPS positions.
+    """
+    def __init__(self, cols: Dict[str, Any]):
+        n = len(cols.get("path", []))
+        self.cols = {k: cols[k] if k in cols else _empty(dt, n) for k, dt in COLUMNS.items()}
+        self._rows: Optional[Dict[str, int]] = None
+        self._grid: Optional[Tuple[Any, ...]] = None
+
+    def __len__(self) -> int:
+        return len(self.cols["path"])
+
+    def __getitem__(self, name: str) -> Any:
+        return self.cols[name]
+
+    def find(self, path: str) -> int:
+        if self._rows is None:
+            self._rows = {p: i for i, p in enumerate(self.cols["path"].tolist())}
+        return self._rows.get(path, -1)
+
+    def row(self, i: int) -> Dict[str, Any]:
+        """
+        One photo as a dict in the read_metadata layout (missing fields left out).
+        """
+        out: Dict[str, Any] = {}
+        for name, a in self.cols.items():
+            v = a[i].item()
+            if v == "" or (isinstance(v, float) and math.isnan(v)):
+                continue
+            if v == 0 and name in ("width", "height", "orientation"):
+                continue
+            out[name] = v
+        return out
+
+    def lookup(self, path: str) -> Optional[Dict[str, Any]]:
+        i = self.find(path)
+        return self.row(i) if i >= 0 else None
+
+    def has_gps(self) -> Any:
+        return ~(np.isnan(self.cols["lat"]) | np.isnan(self.cols["lon"]))
+
+    def sensor_groups(self) -> List[Dict[str, Any]]:
+        """
+        Photos grouped the way Metashape creates sensors: camera model, image
+        size and focal length. Largest group first.
+        """
+        c = self.cols
+        focal = np.where(np.isnan(c["focal"]), 0.0, np.round(c["focal"], 1))
+        keys = np.char.add(np.char.add(c["make"], "\x00"), c["model"])
+        keys = np.char.add(np.char.add(keys, "\x00"), np.char.mod("%d", c["width"]))
+        keys = np.char.add(np.char.add(keys, "x"), np.char.mod("%d", c["height"]))
+        keys = np.char.add(np.char.add(keys, "\x00"), np.char.mod("%.1f", focal))
+        ok = c["error"] == ""
+        uniq, inverse, counts = np.unique(keys[ok], return_inverse=True, return_counts=True)
+        rows = np.flatnonzero(ok)
+        out = []
+        for g in np.argsort(-counts, kind="stable"):
+            idx = rows[inverse == g]
+            i = int(idx[0])
+            out.append({
+                "make": str(c["make"][i]), "model": str(c["model"][i]),
+                "width": int(c["width"][i]), "height": int(c["height"][i]), "focal": float(focal[i]),
+                "count": int(counts[g]), "rows": idx,
+            })
+        return out
+
+    def local_xy(self, lat0: Optional[float] = None, lon0: Optional[float] = None) -> Tuple[Any, Any]:
+        """
+        GPS positions in metres on a local equirectangular projection around
+        (lat0, lon0), by default the centre of the set. NaN without GPS.
+        """
+        lat, lon = self.cols["lat"], self.cols["lon"]
+        gps = self.has_gps()
+        if lat0 is None:
+            lat0 = float(lat[gps].mean()) if gps.any() else 0.0
+            lon0 = float(lon[gps].mean()) if gps.any() else 0.0
+        x = (lon - lon0) * 111320.0 * math.cos(math.radians(lat0))
+        y = (lat - lat0) * 110540.0
+        return x, y
+
+    def _build_grid(self) -> Tuple[Any, ...]:
+        """
+        Photos with GPS sorted by grid cell (about 4 photos per cell), so a
+        query only looks at the cells its circle touches.
+        """
+        gps = self.has_gps()
+        lat0 = float(self.cols["lat"][gps].mean()) if gps.any() else 0.0
+        lon0 = float(self.cols["lon"][gps].mean()) if gps.any() else 0.0
+        x, y = self.local_xy(lat0, lon0)
+        rows = np.flatnonzero(gps)
+        x, y = x[rows], y[rows]
+        area = max(float(np.ptp(x)) * float(np.ptp(y)), 1.0) if len(rows) else 1.0
+        cell = max(math.sqrt(area * 4.0 / max(len(rows), 1)), 1.0)
+        ix = np.floor(x / cell).astype(np.int64)
+        iy = np.floor(y / cell).astype(np.int64)
+        ny = int(iy.max() - iy.min() + 1) if len(rows) else 1
+        iy0 = int(iy.min()) if len(rows) else 0
+        key = ix * ny + (iy - iy0)
+        order = np.argsort(key, kind="stable")
+        return lat0, lon0, cell, ny, iy0, key[order], rows[order], x[order], y[order]
+
+    def within(self, lat: float, lon: float, radius_m: float) -> Any:
+        """
+        Rows of the photos within radius_m of a position, nearest first.
+        """
+        if self._grid is None:
+            self._grid = self._build_grid()
+        lat0, lon0, cell, ny, iy0, keys, rows, x, y = self._grid
+        if not len(rows):
+            return rows
+        qx = (lon - lon0) * 111320.0 * math.cos(math.radians(lat0))
+        qy = (lat - lat0) * 110540.0
+        y_lo = max(int(math.floor((qy - radius_m) / cell)) - iy0, 0)
+        y_hi = min(int(math.floor((qy + radius_m) / cell)) - iy0, ny - 1)
+        spans = []
+        if y_lo <= y_hi:
+            for cx in range(int(math.floor((qx - radius_m) / cell)), int(math.floor((qx + radius_m) / cell)) + 1):
+                a, b = np.searchsorted(keys, [cx * ny + y_lo, cx * ny + y_hi + 1])
+                if b > a:
+                    spans.append(np.arange(a, b))
+        if not spans:
+            return rows[:0]
+        cand = np.concatenate(spans)
+        d2 = (x[cand] - qx) ** 2 + (y[cand] - qy) ** 2
+        hit = d2 <= radius_m * radius_m
+        cand, d2 = cand[hit], d2[hit]
+        return rows[cand[np.argsort(d2, kind="stable")]]
+
+    def nearest(self, lat: float, lon: float, k: int = 1) -> Any:
+        """
+        Rows of the k photos nearest to a position.
+        """
+        if self._grid is None:
+            self._grid = self._build_grid()
+        n = len(self._grid[6])
+        if not n:
+            return self._grid[6]
+        r = self._grid[2]
+        while True:
+            hits = self.within(lat, lon, r)
+            if len(hits) >= min(k, n):
+                return hits[:k]
+            r *= 2.0
+
+def load_index(path: str) -> Optional[MetadataIndex]:
+    if not path or not os.path.isfile(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as z:
+            if int(z["version"]) != INDEX_VERSION:
+                return None
+            return MetadataIndex({k: z[k] for k in COLUMNS if k in z.files})
+    except (OSError, ValueError, KeyError):
+        return None
+
+def save_index(path: str, index: MetadataIndex) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez_compressed(f, version=np.int32(INDEX_VERSION), **index.cols)
+    os.replace(tmp, path)
+
+def build_index(entries: Sequence[Tuple[str, int, int]], cache_path: Optional[str] = None,
+                workers: int = 16) -> MetadataIndex:
+    """
+    Metadata of every entry, in entry order. Rows of the cached index whose
+    path, size and mtime still match are reused; only new or changed photos
+    have their headers read (in a thread pool: header reads are I/O bound).
+    """
+    old = load_index(cache_path) if cache_path else None
+    records: List[Optional[Dict[str, Any]]] = []
+    todo = []
+    for n, (p, size, mtime_ns) in enumerate(entries):
+        i = old.find(p) if old is not None else -1
+        if i >= 0 and old["size"][i] == size and old["mtime_ns"][i] == mtime_ns:
+            records.append(old.row(i))
+        else:
+            records.append(None)
+            todo.append(n)
+    if todo:
+        results = parallel_map(read_metadata, [entries[n][0] for n in todo], workers, processes=False)
+        for n, r in zip(todo, results):
+            records[n] = r
+    for rec, (p, size, mtime_ns) in zip(records, entries):
+        rec.update(path=p, size=size, mtime_ns=mtime_ns)
+    index = MetadataIndex(_columns(records))
+    if cache_path and (todo or old is None or len(old) != len(index)):
+        save_index(cache_path, index)
+    return index
+
+def describe_groups(groups: Sequence[Dict[str, Any]]) -> List[str]:
+    return [f"{g['make']} {g['model']}".strip() + f" {g['width']}x{g['height']}"
+            + (f" {g['focal']:g}mm" if g["focal"] else "") + f": {g['count']} photos" for g in groups]
+
+def check_metadata(index: MetadataIndex, cfg: Dict[str, Any]) -> List[str]:
+    """
+    Problems worth knowing before addPhotos: unreadable headers, more camera
+    models than expected, photos without GPS, rotated or portrait frames
+    among landscape ones, missing capture times.
+    """
+    n = len(index)
+    if not n:
+        return []
+    problems = []
+    bad = int((index["error"] != "").sum())
+    if bad:
+        problems.append(f"{bad} photos with unreadable headers")
+    ok = index["error"] == ""
+    models = {(m, d) for m, d in zip(index["make"][ok].tolist(), index["model"][ok].tolist())}
+    max_models = int(cfg.get("max_camera_models", 0))
+    if max_models and len(models) > max_models:
+        problems.append(f"{len(models)} camera models (expected at most {max_models}): "
+                        + ", ".join(sorted(f"{a} {b}".strip() or "unknown" for a, b in models)))
+    min_gps = float(cfg.get("min_gps_fraction", 0))
+    gps = float(index.has_gps()[ok].mean()) if ok.any() else 0.0
+    if min_gps and gps < min_gps:
+        problems.append(f"only {gps:.1%} of photos have GPS (expected {min_gps:.0%})")
+    rotated = int((index["orientation"][ok] > 1).sum())
+    if rotated and not cfg.get("allow_rotated", False):
+        problems.append(f"{rotated} photos have an EXIF rotation; Metashape uses the stored pixel orientation")
+    portrait = (index["height"] > index["width"])[ok]
+    if 0 < portrait.sum() < len(portrait):
+        problems.append(f"{int(portrait.sum())} portrait and {int((~portrait).sum())} landscape photos")
+    no_time = int(np.isnan(index["time"][ok]).sum())
+    if no_time and cfg.get("require_time", False):
+        problems.append(f"{no_time} photos without a capture time")
+    return problems
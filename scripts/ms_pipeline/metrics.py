@@ -0,0 +1,349 @@
+from __future__ import annotations
+import contextlib
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, Optional
+
+try:
+    import psutil  # optional, more accurate counters
+except ImportError:
+    psutil = None
+
+# chunk methods that do real work; everything else passes through untouched
+TRACKED_CALLS = {
+    "addPhotos",
+    "importReference",
+    "matchPhotos",
+    "alignCameras",
+    "optimizeCameras",
+    "buildDepthMaps",
+    "buildPointCloud",
+    "buildDem",
+    "buildOrthomosaic",
+    "buildModel",
+    "buildUV",
+    "buildTexture",
+    "exportReport",
+    "exportRaster",
+    "exportModel",
+    "exportPointCloud",
+    "exportCameras",
+}
+
+_MB = 1024.0 * 1024.0
+
+def _win_counters() -> Dict[str, int]:
+    import ctypes
+    from ctypes import wintypes
+
+    class PMC(ctypes.Structure):
+        _fields_ = [
+            ("cb", wintypes.DWORD),
+            ("PageFaultCount", wintypes.DWORD),
+            ("PeakWorkingSetSize", ctypes.c_size_t),
+            ("WorkingSetSize", ctypes.c_size_t),
+            ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+            ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+            ("PagefileUsage", ctypes.c_size_t),
+            ("PeakPagefileUsage", ctypes.c_size_t),
+        ]
+
+    class IOC(ctypes.Structure):
+        _fields_ = [(n, ctypes.c_ulonglong) for n in (
+            "ReadOperationCount", "WriteOperationCount", "OtherOperationCount",
+            "ReadTransferCount", "WriteTransferCount", "OtherTransferCount")]
+
+    h = ctypes.windll.kernel32.GetCurrentProcess()
+    pmc = PMC()
+    pmc.cb = ctypes.sizeof(PMC)
+    ctypes.windll.psapi.GetProcessMemoryInfo(h, ctypes.byref(pmc), pmc.cb)
+    ioc = IOC()
+    ctypes.windll.kernel32.GetProcessIoCounters(h, ctypes.byref(ioc))
+    return {"rss": int(pmc.WorkingSetSize), "peak_rss": int(pmc.PeakWorkingSetSize), "write_bytes": int(ioc.WriteTransferCount)}
+
+def _posix_counters() -> Dict[str, int]:
+    out = {"rss": 0, "peak_rss": 0, "write_bytes": 0}
+    try:
+        import resource
+        ru = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        out["peak_rss"] = int(ru if sys.platform == "darwin" else ru * 1024)
+    except Exception:
+        pass
+    try:
+        with open("/proc/self/statm", "r") as f:
+            out["rss"] = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        out["rss"] = out["peak_rss"]
+    try:
+        with open("/proc/self/io", "r") as f:
+            for line in f:
+                if line.startswith("write_bytes:"):
+                    out["write_bytes"] = int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return out
+
+def process_counters() -> Dict[str, int]:
+    """
+    Current RSS, process peak RSS and bytes written to storage, all in bytes
+    (0 where the platform does not expose a counter).
+    """
+    if psutil is not None:
+        p = psutil.Process()
+        mem = p.memory_info()
+        try:
+            wb = int(p.io_counters().write_bytes)
+        except (AttributeError, psutil.Error):
+            wb = 0
+        peak = int(getattr(mem, "peak_wset", 0) or 0)
+        if not peak and sys.platform != "win32":
+            peak = _posix_counters()["peak_rss"]
+        return {"rss": int(mem.rss), "peak_rss": peak, "write_bytes": wb}
+    if sys.platform == "win32":
+        try:
+            return _win_counters()
+        except Exception:
+            return {"rss": 0, "peak_rss": 0, "write_bytes": 0}
+    return _posix_counters()
+
+def machine_memory_mb() -> float:
+    """
+    Physical memory of the machine in MB (0 if it cannot be determined).
+    """
+    if psutil is not None:
+        return psutil.virtual_memory().total / _MB
+    if sys.platform == "win32":
+        try:
+            import ctypes
+
+            class MEMSTAT(ctypes.Structure):
+                _fields_ = [("dwLength", ctypes.c_ulong), ("dwMemoryLoad", ctypes.c_ulong)] + [
+                    (n, ctypes.c_ulonglong) for n in (
+                        "ullTotalPhys", "ullAvailPhys", "ullTotalPageFile", "ullAvailPageFile",
+                        "ullTotalVirtual", "ullAvailVirtual", "ullAvailExtendedVirtual")]
+
+            st = MEMSTAT()
+            st.dwLength = ctypes.sizeof(MEMSTAT)
+            ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(st))
+            return st.ullTotalPhys / _MB
+        except Exception:
+            return 0.0
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / _MB
+    except (AttributeError, ValueError, OSError):
+        return 0.0
+
+class _RssSampler:
+    """
+    Polls current RSS in a daemon thread; the process-wide peak counter never
+    resets, so this is what gives a per-call peak.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.peak = process_counters()["rss"]
+        self._stop = threading.Event()
+        self._t = threading.Thread(target=self._run, name="rss-sampler", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, process_counters()["rss"])
+
+    def __enter__(self) -> "_RssSampler":
+        if self.interval > 0:
+            self._t.start()
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self._stop.set()
+        if self._t.is_alive():
+            self._t.join()
+        self.peak = max(self.peak, process_counters()["rss"])
+
+def chunk_size_info(chunk: Any) -> Dict[str, Any]:
+    """
+    Input size of a chunk: enabled/aligned cameras and total megapixels.
+    """
+    cams = getattr(chunk, "cameras", []) or []
+    n = aligned = 0
+    pixels = 0
+    for c in cams:
+        try:
+            if not c.enabled:
+                continue
+            n += 1
+            if c.transform:
+                aligned += 1
+            s = c.sensor
+            pixels += int(s.width) * int(s.height)
+        except Exception:
+            pass
+    return {"cameras": n, "cameras_aligned": aligned, "megapixels": round(pixels / 1e6, 3)}
+
+class MetricsRecorder:
+    """
+    Appends one JSON record per instrumented call to a metrics.jsonl file.
+    """
+
+    def __init__(self, path: str, run_id: str, sample_interval: float = 0.5, **context: Any):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.run_id = run_id
+        self.sample_interval = float(sample_interval)
+        self.stage = ""
+        self.context = dict(context)
+        self.context.setdefault("host", socket.gethostname())
+        self._lock = threading.Lock()
+
+    def write(self, rec: Dict[str, Any]) -> None:
+        line = json.dumps(rec, sort_keys=True, default=str)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def measure(self, op: str, chunk: Any, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        size = chunk_size_info(chunk) if chunk is not None else {}
+        before = process_counters()
+        t0 = time.perf_counter()
+        c0 = time.process_time()
+        status, err = "ok", None
+        sampler = _RssSampler(self.sample_interval)
+        try:
+            with sampler:
+                return fn(*args, **kwargs)
+        except BaseException as e:
+            status, err = "error", f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            wall = time.perf_counter() - t0
+            after = process_counters()
+            rec: Dict[str, Any] = {
+                "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "run_id": self.run_id,
+                "stage": self.stage,
+                "op": op,
+                "status": status,
+                "wall_s": round(wall, 3),
+                "cpu_s": round(time.process_time() - c0, 3),
+                "rss_start_mb": round(before["rss"] / _MB, 1),
+                "peak_rss_mb": round(sampler.peak / _MB, 1),
+                "process_peak_rss_mb": round(after["peak_rss"] / _MB, 1),
+                "write_bytes": max(0, after["write_bytes"] - before["write_bytes"]),
+            }
+            rec.update(size)
+            # Scalar call arguments (downscale, limits, ...) feed the planner's cost model
+            params = {k: v for k, v in kwargs.items() if k != "path" and isinstance(v, (bool, int, float, str))}
+            if params:
+                rec["params"] = params
+            if size.get("megapixels"):
+                rec["s_per_mpix"] = round(wall / size["megapixels"], 6)
+            out = kwargs.get("path")
+            if isinstance(out, str) and os.path.isfile(out):
+                rec["output_bytes"] = os.path.getsize(out)
+            if err:
+                rec["error"] = err
+            rec.update(self.context)
+            self.write(rec)
+
+# tracked calls that accept a progress= callback
+PROGRESS_CALLS = TRACKED_CALLS - {"importReference"}
+
+class InstrumentedChunk:
+    """
+    Transparent proxy around a Metashape.Chunk. Every call listed in
+    TRACKED_CALLS is measured by the recorder and, with a ProgressMonitor,
+    gets a progress= callback. Attribute reads/writes go to the real chunk;
+    use unwrap() when passing the chunk to Metashape APIs that expect the
+    real object.
+    """
+
+    def __init__(self, chunk: Any, recorder: Optional[MetricsRecorder] = None, progress: Any = None):
+        object.__setattr__(self, "_chunk", chunk)
+        object.__setattr__(self, "_recorder", recorder)
+        object.__setattr__(self, "_progress", progress)
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._chunk, name)
+        if name in TRACKED_CALLS and callable(attr):
+            def call(*args: Any, **kwargs: Any) -> Any:
+                mon = self._progress
+                if mon is None or name not in PROGRESS_CALLS or "progress" in kwargs:
+                    return self._invoke(name, attr, args, kwargs)
+                kwargs["progress"] = mon.callback(name, megapixels=chunk_size_info(self._chunk)["megapixels"])
+                ok = False
+                try:
+                    result = self._invoke(name, attr, args, kwargs)
+                    ok = True
+                    return result
+                finally:
+                    mon.finish(ok)
+            return call
+        return attr
+
+    def _invoke(self, name: str, fn: Callable[..., Any], args: Any, kwargs: Dict[str, Any]) -> Any:
+        if self._recorder is None:
+            return fn(*args, **kwargs)
+        return self._recorder.measure(name, self._chunk, fn, *args, **kwargs)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._chunk, name, value)
+
+    def __eq__(self, other: Any) -> bool:
+        return unwrap(other) == self._chunk
+
+    def __hash__(self) -> int:
+        return hash(self._chunk)
+
+def unwrap(chunk: Any) -> Any:
+    return chunk._chunk if isinstance(chunk, InstrumentedChunk) else chunk
+
+def measure(recorder: Optional[MetricsRecorder], op: str, chunk: Any, fn: Callable[..., Any],
+            *args: Any, **kwargs: Any) -> Any:
+    """
+    recorder.measure(), or a plain call without a recorder (metrics.enabled false).
+    """
+    if recorder is None:
+        return fn(*args, **kwargs)
+    return recorder.measure(op, chunk, fn, *args, **kwargs)
+
+@contextlib.contextmanager
+def profile_session(out_base: str, cprofile: bool = False, tracemalloc_: bool = False,
+                    log: Optional[Any] = None) -> Iterator[None]:
+    """
+    Optional Python-side profiling of the orchestration code. Writes
+    <out_base>.prof (cProfile, open with snakeviz/pstats) and
+    <out_base>.tracemalloc.txt (top allocation sites).
+    """
+    prof = None
+    if cprofile:
+        import cProfile
+        prof = cProfile.Profile()
+        prof.enable()
+    if tracemalloc_:
+        import tracemalloc
+        tracemalloc.start(10)
+    try:
+        yield
+    finally:
+        if prof is not None:
+            prof.disable()
+            prof.dump_stats(out_base + ".prof")
+            if log is not None:
+                log.info(f"cProfile stats: {out_base}.prof")
+        if tracemalloc_:
+            import tracemalloc
+            snap = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            with open(out_base + ".tracemalloc.txt", "w", encoding="utf-8") as f:
+                f.write(f"peak traced: {peak / _MB:.1f} MB\n")
+                for stat in snap.statistics("lineno")[:25]:
+                    f.write(f"{stat}\n")
+            if log is not None:
+                log.info(f"tracemalloc peak {peak / _MB:.1f} MB: {out_base}.tracemalloc.txt")
@@ -0,0 +1,239 @@
+from __future__ import annotations
+import fnmatch
+import os
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from .steps import optimize_cameras, run_match_align_optimize
+from .workers import run_jobs, write_job
+
+# multi_chunk.align_chunks.method -> Document.alignChunks method
+ALIGN_METHODS = {"points": 0, "markers": 1, "cameras": 2}
+
+def _rel(path: str, roots: Sequence[str]) -> str:
+    """
+    Path relative to the photo_dirs root that contains it, with "/" separators.
+    """
+    p = os.path.abspath(path)
+    for r in roots:
+        r = os.path.abspath(r)
+        if p.startswith(r.rstrip("\\/") + os.sep):
+            return os.path.relpath(p, r).replace(os.sep, "/")
+    return os.path.basename(p)
+
+def _by_folder(paths: Sequence[str], roots: Sequence[str], depth: int) -> Dict[str, List[str]]:
+    groups: Dict[str, List[str]] = {}
+    for p in paths:
+        parts = _rel(p, roots).split("/")[:-1]
+        name = "/".join(parts[:depth]) if parts else "(root)"
+        groups.setdefault(name, []).append(p)
+    return groups
+
+def _by_sensor(paths: Sequence[str], index: Any) -> Dict[str, List[str]]:
+    if index is None:
+        raise ValueError("multi_chunk.group_by=sensor needs input.metadata.enabled")
+    known = {}
+    for g in index.sensor_groups():
+        name = f"{g['make']} {g['model']} {g['width']}x{g['height']} {g['focal']:g}mm".strip()
+        for i in g["rows"]:
+            known[str(index["path"][i])] = name
+    groups: Dict[str, List[str]] = {}
+    for p in paths:
+        groups.setdefault(known.get(p, "unknown"), []).append(p)
+    return groups
+
+def _by_config(paths: Sequence[str], roots: Sequence[str], patterns: Dict[str, Sequence[str]]) -> Dict[str, List[str]]:
+    if not patterns:
+        raise ValueError("multi_chunk.group_by=config needs multi_chunk.groups")
+    groups: Dict[str, List[str]] = {}
+    for p in paths:
+        rel = _rel(p, roots)
+        name = next((n for n, pats in patterns.items() if any(fnmatch.fnmatch(rel, x) for x in pats)), "other")
+        groups.setdefault(name, []).append(p)
+    return groups
+
+def photo_groups(paths: Sequence[str], roots: Sequence[str], mc_cfg: Dict[str, Any],
+                 index: Any = None) -> Tuple[Dict[str, List[str]], List[str]]:
+    """
+    Photos split into capture groups, each aligned as its own chunk:
+
+    group_by "folder": subdirectory (folder_depth levels below the photo_dirs root)
+    group_by "sensor": camera model / image size / focal length from input.metadata
+    group_by "config": groups {name: [glob on the path below the root]}, the rest in "other"
+
+    Groups smaller than min_photos are folded into the largest one. Returns
+    the groups (sorted by name) and notes for the log.
+    """
+    how = mc_cfg.get("group_by", "folder")
+    if how == "folder":
+        groups = _by_folder(paths, roots, max(1, int(mc_cfg.get("folder_depth", 1))))
+    elif how == "sensor":
+        groups = _by_sensor(paths, index)
+    elif how == "config":
+        groups = _by_config(paths, roots, mc_cfg.get("groups", {}))
+    else:
+        raise ValueError(f"Unknown multi_chunk.group_by: {how}")
+
+    notes = []
+    min_photos = int(mc_cfg.get("min_photos", 20))
+    small = [n for n, g in groups.items() if len(g) < min_photos]
+    if small and len(small) < len(groups):
+        largest = max((n for n in groups if n not in small), key=lambda n: len(groups[n]))
+        for n in small:
+            notes.append(f"group '{n}' has {len(groups[n])} photos (< min_photos {min_photos}), aligned with '{largest}'")
+            groups[largest] += groups.pop(n)
+    return {n: groups[n] for n in sorted(groups)}, notes
+
+def group_label(label: str, name: str) -> str:
+    return f"{label} group {name}"
+
+def aligned_label(label: str) -> str:
+    return f"{label} (aligned)"
+
+def apply_group(chunk: Any, photos: Sequence[str]) -> int:
+    """
+    Remove the cameras whose photo is not in the group; returns how many are left.
+    """
+    keep = {os.path.normcase(os.path.abspath(p)) for p in photos}
+    drop = [c for c in chunk.cameras if os.path.normcase(os.path.abspath(c.photo.path)) not in keep]
+    if drop:
+        chunk.remove(drop)
+    return len(chunk.cameras)
+
+def _aligned(chunk: Any) -> int:
+    return sum(1 for c in chunk.cameras if c.enabled and c.transform is not None)
+
+def run_group_job(Metashape: Any, job: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Worker side (scripts/ms_worker.py, kind "align_group"): save the chunk into
+    its own project, restrict it to the group's photos and match/align it.
+    """
+    doc = Metashape.Document()
+    doc.open(job["project"], read_only=True, ignore_lock=True)
+    src = [c for c in doc.chunks if c.label == job["chunk_label"]]
+    if not src:
+        raise RuntimeError(f"Chunk '{job['chunk_label']}' not found in {job['project']}")
+    os.makedirs(os.path.dirname(job["out_project"]), exist_ok=True)
+    doc.save(job["out_project"], chunks=[src[0]])
+    doc.open(job["out_project"])
+    chunk = doc.chunks[0]
+    chunk.label = job["label"]
+    cameras = apply_group(chunk, job["photos"])
+    run_match_align_optimize(Metashape, chunk, job["processing"])
+    doc.save()
+    return {"ok": True, "project": job["out_project"], "label": job["label"],
+            "cameras": cameras, "aligned": _aligned(chunk)}
+
+def _align_groups(Metashape: Any, doc: Any, chunk: Any, groups: Dict[str, List[str]], proc: Dict[str, Any],
+                  project_path: str, log: Any, wrap: Callable[[Any], Any],
+                  workers_cfg: Optional[Dict[str, Any]]) -> List[Any]:
+    mc_cfg = proc.get("multi_chunk", {})
+    label = chunk.label
+    mode = mc_cfg.get("mode", "parallel")
+    aligned: List[Any] = []
+    if mode == "parallel":
+        if not project_path:
+            raise ValueError("multi_chunk.mode=parallel needs project.project_path")
+        doc.save(project_path)
+        base = os.path.splitext(project_path)[0] + "_groups"
+        jobs = []
+        for n, name in enumerate(groups):
+            job = f"group_{n:03d}"
+            jobs.append(write_job(os.path.join(base, job + ".job.json"), {
+                "kind": "align_group",
+                "project": project_path,
+                "chunk_label": label,
+                "label": group_label(label, name),
+                "out_project": os.path.join(base, job + ".psx"),
+                "photos": groups[name],
+                "processing": proc,
+            }))
+        results = run_jobs(jobs, workers_cfg, int(mc_cfg.get("workers", 2)), log)
+        for name, r in zip(groups, results):
+            doc.append(r["project"])
+            aligned.append(doc.chunks[-1])
+            log.info(f"Group '{name}': {r['aligned']}/{r['cameras']} cameras aligned")
+    elif mode == "sequential":
+        for n, (name, photos) in enumerate(groups.items()):
+            g = chunk.copy()
+            g.label = group_label(label, name)
+            cameras = apply_group(g, photos)
+            log.info(f"Group {n + 1}/{len(groups)} '{name}': {cameras} cameras")
+            run_match_align_optimize(Metashape, wrap(g), proc)
+            log.info(f"Group '{name}': {_aligned(g)}/{cameras} cameras aligned")
+            aligned.append(g)
+            if project_path:
+                doc.save(project_path)
+    else:
+        raise ValueError(f"Unknown multi_chunk.mode: {mode}")
+    return aligned
+
+def _align_chunks(doc: Any, chunks: List[Any], reference: Any, mc_cfg: Dict[str, Any], log: Any) -> None:
+    ac = mc_cfg.get("align_chunks", {})
+    method = ac.get("method", "points")
+    if method == "reference":
+        log.info("Chunks are georeferenced; merging without chunk alignment")
+        return
+    if method not in ALIGN_METHODS:
+        raise ValueError(f"Unknown multi_chunk.align_chunks.method: {method}")
+    others = [c for c in chunks if c is not reference]
+    log.info(f"Aligning {len(others)} chunks to '{reference.label}' by {method}")
+    doc.alignChunks(
+        chunks=[c.key for c in chunks],
+        reference=reference.key,
+        method=ALIGN_METHODS[method],
+        fit_scale=bool(ac.get("fit_scale", True)),
+        downscale=int(ac.get("downscale", 1)),
+        generic_preselection=bool(ac.get("generic_preselection", True)),
+        keypoint_limit=int(ac.get("keypoint_limit", 40000)),
+        filter_mask=bool(ac.get("filter_mask", False)),
+        mask_tiepoints=bool(ac.get("mask_tiepoints", True)),
+    )
+
+def align_groups(Metashape: Any, doc: Any, chunk: Any, groups: Dict[str, List[str]], proc: Dict[str, Any],
+                 project_path: str, log: Any, wrap: Optional[Callable[[Any], Any]] = None,
+                 workers_cfg: Optional[Dict[str, Any]] = None) -> Any:
+    """
+    Match and align each photo group as its own chunk, align the chunks to the
+    one with the most aligned cameras and merge them into one chunk, which is
+    returned. Matching cost grows faster than linearly with the photo count,
+    so several smaller alignments are cheaper even before they run in parallel.
+
+    mode "parallel": the project is saved and every group is aligned in its own
+    headless Metashape process (at most `workers` at once), then appended back.
+    mode "sequential": groups are chunk copies aligned one after another here.
+    """
+    mc_cfg = proc.get("multi_chunk", {})
+    wrap = wrap or (lambda c: c)
+    label = chunk.label
+    if len(groups) < 2:
+        log.info("Multi-chunk: one photo group, aligning a single chunk")
+        run_match_align_optimize(Metashape, chunk, proc)
+        return chunk
+
+    # Drop group chunks left over from a previous run of this stage
+    stale = [c for c in doc.chunks if c.label.startswith(f"{label} group ") or c.label == aligned_label(label)]
+    if stale:
+        doc.remove(stale)
+
+    parts = _align_groups(Metashape, doc, chunk, groups, proc, project_path, log, wrap, workers_cfg)
+    parts = [c for c in parts if _aligned(c) > 0] or parts
+    if len(parts) < len(groups):
+        log.warn(f"Multi-chunk: {len(groups) - len(parts)} groups have no aligned cameras, left out of the merge")
+    reference = max(parts, key=_aligned)
+    _align_chunks(doc, parts, reference, mc_cfg, log)
+
+    opts = {"merge_markers": True, "merge_tiepoints": True}
+    # Keyword names differ between Metashape releases; allow overriding them
+    opts.update(mc_cfg.get("merge_options", {}))
+    n_before = len(doc.chunks)
+    doc.mergeChunks(chunks=[c.key for c in parts], **opts)
+    merged = doc.chunks[n_before] if len(doc.chunks) > n_before else doc.chunks[-1]
+    merged.label = aligned_label(label)
+    log.info(f"Merged {len(parts)} chunks into '{merged.label}': {_aligned(merged)}/{len(merged.cameras)} cameras aligned")
+
+    oc = proc.get("optimize_cameras", {})
+    if mc_cfg.get("optimize_merged", True) and oc.get("enabled", True):
+        optimize_cameras(wrap(merged), oc)
+    if not mc_cfg.get("keep_groups", False):
+        doc.remove([c for c in doc.chunks if c.label.startswith(f"{label} group ")])
+    return merged
@@ -0,0 +1,175 @@
+from __future__ import annotations
+import fnmatch
+import json
+import os
+import re
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from .checkpoint import config_hash
+
+MANIFEST_VERSION = 1
+
+class PhotoEntry(NamedTuple):
+    path: str
+    size: int
+    mtime_ns: int
+
+def _compile_patterns(globs_: List[str]) -> Tuple[Any, Any]:
+    """
+    Split glob patterns into one regex matched against file names and one matched
+    against paths relative to the photo dir (patterns containing a separator).
+    Leading "**/" is dropped: recursion is controlled by the recursive flag.
+    """
+    name_pats, rel_pats = [], []
+    for g in globs_:
+        g = g.replace("\\", "/")
+        while g.startswith("**/"):
+            g = g[3:]
+        if not g:
+            continue
+        g = os.path.normcase(g)
+        (rel_pats if "/" in g else name_pats).append(fnmatch.translate(g))
+    name_re = re.compile("|".join(name_pats)) if name_pats else None
+    rel_re = re.compile("|".join(rel_pats)) if rel_pats else None
+    return name_re, rel_re
+
+def _scan_dir(path: str, rel: str, name_re: Any, rel_re: Any) -> Tuple[List[List[Any]], List[str]]:
+    """
+    One scandir pass: matching files (name, size, mtime_ns) and subdirectory names.
+    Only matching files are stat'ed.
+    """
+    files: List[List[Any]] = []
+    dirs: List[str] = []
+    with os.scandir(path) as it:
+        for e in it:
+            if e.name.startswith("."):
+                continue
+            try:
+                if e.is_dir():
+                    dirs.append(e.name)
+                    continue
+                if not e.is_file():
+                    continue
+            except OSError:
+                continue
+            n = os.path.normcase(e.name)
+            if (name_re is not None and name_re.match(n)) or (
+                rel_re is not None and rel_re.match(os.path.normcase(rel + e.name))
+            ):
+                try:
+                    st = e.stat()
+                except OSError:
+                    continue
+                files.append([e.name, st.st_size, st.st_mtime_ns])
+    files.sort()
+    dirs.sort()
+    return files, dirs
+
+def _restat(path: str, files: List[List[Any]]) -> List[List[Any]]:
+    """
+    Fresh (name, size, mtime_ns) for the files of a cached listing.
+    """
+    out = []
+    for name, _, _ in files:
+        try:
+            st = os.stat(os.path.join(path, name))
+        except OSError:
+            continue
+        out.append([name, st.st_size, st.st_mtime_ns])
+    return out
+
+def _load_manifest(path: Optional[str], patterns_key: str) -> Dict[str, Any]:
+    if not path or not os.path.isfile(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get("version") != MANIFEST_VERSION or data.get("patterns") != patterns_key:
+        return {}
+    return data.get("dirs", {})
+
+def _save_manifest(path: str, patterns_key: str, dirs: Dict[str, Any]) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": MANIFEST_VERSION, "patterns": patterns_key, "dirs": dirs}, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+def discover_photos(
+    photo_dirs: List[str],
+    globs_: List[str],
+    recursive: bool,
+    manifest_path: Optional[str] = None,
+    workers: int = 8,
+) -> List[PhotoEntry]:
+    """
+    Walk every photo dir once, matching all patterns in the same pass.
+    Directories are listed concurrently in a thread pool (I/O bound, mostly
+    network latency). With manifest_path, each directory listing is cached
+    together with the directory mtime; on the next run an unchanged directory
+    is not listed or matched again, only its photos are stat'ed. A photo
+    rewritten in place (same name, no rename) does not change the directory
+    mtime, so it is picked up by that stat.
+
+    Directories reached twice (symlink loops, links to a dir already walked)
+    are listed once.
+    """
+    name_re, rel_re = _compile_patterns(globs_)
+    patterns_key = config_hash(sorted(globs_), bool(recursive))
+    cached = _load_manifest(manifest_path, patterns_key)
+    listings: Dict[str, Any] = {}
+
+    roots = []
+    for d in photo_dirs:
+        if not d:
+            continue
+        d = os.path.abspath(d)
+        if os.path.isdir(d) and d not in roots:
+            roots.append(d)
+
+    def visit(path: str, rel: str) -> Tuple[str, str, Tuple[int, int], Dict[str, Any]]:
+        st = os.stat(path)
+        ident = (st.st_dev, st.st_ino)
+        prev = cached.get(path)
+        if prev is not None and st.st_mtime_ns == prev["mtime_ns"]:
+            # Same names as last time: skip the listing, not the photo stats
+            return path, rel, ident, dict(prev, files=_restat(path, prev["files"]))
+        files, dirs = _scan_dir(path, rel, name_re, rel_re)
+        return path, rel, ident, {"mtime_ns": st.st_mtime_ns, "files": files, "dirs": dirs}
+
+    visited = set()
+    with ThreadPoolExecutor(max_workers=max(1, int(workers))) as pool:
+        pending = {pool.submit(visit, r, "") for r in roots}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                try:
+                    path, rel, ident, listing = fut.result()
+                except OSError:
+                    continue
+                if ident in visited:
+                    continue
+                visited.add(ident)
+                listings[path] = listing
+                if recursive:
+                    for sub in listing["dirs"]:
+                        pending.add(pool.submit(visit, os.path.join(path, sub), rel + sub + "/"))
+
+    if manifest_path:
+        _save_manifest(manifest_path, patterns_key, listings)
+
+    # Emit in photo_dirs order, then path order; de-dupe overlapping roots
+    out: List[PhotoEntry] = []
+    seen = set()
+    for root in roots:
+        prefix = root + os.sep
+        for d in sorted(p for p in listings if p == root or p.startswith(prefix)):
+            for name, size, mtime in listings[d]["files"]:
+                p = os.path.join(d, name)
+                if p not in seen:
+                    seen.add(p)
+                    out.append(PhotoEntry(p, size, mtime))
+    return out
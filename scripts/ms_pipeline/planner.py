@@ -0,0 +1,377 @@
+from __future__ import annotations
+import copy
+import glob
+import json
+import math
+import os
+import socket
+import statistics
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .metadata import MetadataIndex, read_metadata
+from .metrics import machine_memory_mb
+from .pool import parallel_map
+
+# op -> config section holding its parameters
+OP_SECTIONS = {
+    "matchPhotos": "match_photos",
+    "alignCameras": "align_cameras",
+    "optimizeCameras": "optimize_cameras",
+    "buildDepthMaps": "build_depth_maps",
+    "buildPointCloud": "build_point_cloud",
+    "buildDem": "build_dem",
+    "buildOrthomosaic": "build_orthomosaic",
+    "buildModel": "build_model",
+    "buildUV": "build_uv",
+    "buildTexture": "build_texture",
+}
+
+STAGE_OPS = {
+    "align": ("matchPhotos", "alignCameras", "optimizeCameras"),
+    # Estimated as one alignment of all photos: an upper bound for the grouped run
+    "align_groups": ("matchPhotos", "alignCameras", "optimizeCameras"),
+    # one re-optimization per pass; usually a few
+    "filter_tie_points": ("optimizeCameras",),
+    "depth_maps": ("buildDepthMaps",),
+    "point_cloud": ("buildPointCloud",),
+    "dem": ("buildDem",),
+    "orthomosaic": ("buildOrthomosaic",),
+    "model": ("buildModel",),
+    "uv": ("buildUV",),
+    "texture": ("buildTexture",),
+    "blocks": ("buildDepthMaps", "buildPointCloud", "buildDem", "buildOrthomosaic"),
+}
+
+# Uncalibrated defaults for an 8-core workstation with a mid-range GPU:
+# seconds per work unit and MB per memory unit (see op_work). They only get
+# the order of magnitude right; every op recorded in metrics.jsonl replaces them.
+DEFAULT_RATES = {
+    "matchPhotos": 0.05,
+    "alignCameras": 0.01,
+    "optimizeCameras": 0.05,
+    "buildDepthMaps": 3.0,
+    "buildPointCloud": 0.5,
+    "buildDem": 0.05,
+    "buildOrthomosaic": 0.05,
+    "buildModel": 1.0,
+    "buildUV": 0.5,
+    "buildTexture": 2.0,
+}
+DEFAULT_MEMORY = {
+    "matchPhotos": 150.0,
+    "alignCameras": 0.5,
+    "optimizeCameras": 0.3,
+    "buildDepthMaps": 100.0,
+    "buildPointCloud": 2.0,
+    "buildDem": 0.5,
+    "buildOrthomosaic": 50.0,
+    "buildModel": 4.0,
+    "buildUV": 2.0,
+    "buildTexture": 2000.0,
+}
+BASE_MEMORY_MB = 1000.0
+DEFAULT_NEIGHBOURS = 10.0
+DEFAULT_MEGAPIXELS = 20.0
+
+# Knobs the tuner may coarsen, in steps
+TUNING_STEPS = [
+    ("build_depth_maps", "downscale", [1, 2, 4, 8]),
+    ("build_depth_maps", "max_neighbors", [16, 12, 8]),
+    ("match_photos", "downscale", [1, 2, 4]),
+    ("match_photos", "keypoint_limit", [40000, 20000, 10000]),
+    ("build_texture", "texture_size", [16384, 8192, 4096]),
+]
+
+# Defaults of the steps in steps.py
+PARAM_DEFAULTS = {
+    "match_photos": {"downscale": 1, "keypoint_limit": 40000, "tiepoint_limit": 4000},
+    "build_depth_maps": {"downscale": 4, "max_neighbors": 16},
+    "build_uv": {"page_count": 1},
+    "build_texture": {"texture_size": 8192},
+}
+
+class Dataset(NamedTuple):
+    images: int
+    megapixels: float     # per image, median of the sample
+    neighbours: float     # images overlapping each image
+    overlap_source: str   # "gps", "config" or "default"
+    gps_fraction: float   # share of sampled images with EXIF GPS
+
+# Dataset inspection
+
+def _estimate_neighbours(headers: List[Dict[str, Any]], n_images: int, cfg: Dict[str, Any]) -> Tuple[float, str]:
+    if cfg.get("neighbours"):
+        return float(cfg["neighbours"]), "config"
+    geo = [h for h in headers if "lat" in h and "lon" in h]
+    if len(geo) < 3:
+        return DEFAULT_NEIGHBOURS, "default"
+    lat = np.array([h["lat"] for h in geo])
+    lon = np.array([h["lon"] for h in geo])
+    # Local equirectangular metres around the sample centre
+    x = (lon - lon.mean()) * 111320.0 * math.cos(math.radians(float(lat.mean())))
+    y = (lat - lat.mean()) * 110540.0
+
+    height = float(cfg.get("flight_height_m", 0) or 0)
+    alts = [h["alt"] for h in geo if "alt" in h]
+    if not height and alts and cfg.get("ground_altitude_m") is not None:
+        height = float(np.median(alts)) - float(cfg["ground_altitude_m"])
+    f35 = [h["focal35"] for h in geo if h.get("focal35")]
+    if height <= 0 or not f35:
+        return DEFAULT_NEIGHBOURS, "default"
+
+    # Square footprint of the same area as the image footprint on the ground
+    w = 36.0 / float(np.median(f35)) * height
+    aspect = float(np.median([h["height"] / h["width"] for h in geo if h.get("width")] or [0.75]))
+    side = math.sqrt(w * w * aspect)
+    dx = np.abs(x[:, None] - x[None, :])
+    dy = np.abs(y[:, None] - y[None, :])
+    # Footprints overlap when centres are closer than one footprint; scale the
+    # sample count back up to the full set
+    counts = ((dx < side) & (dy < side)).sum(axis=1) - 1
+    return max(1.0, float(np.mean(counts)) * n_images / len(geo)), "gps"
+
+def inspect_dataset(paths: Sequence[str], cfg: Optional[Dict[str, Any]] = None,
+                    index: Optional[MetadataIndex] = None) -> Dataset:
+    """
+    Look at an evenly spaced sample of the photos (planner.sample, default 200):
+    resolution from headers, overlap from EXIF GPS spacing and footprint size.
+    Headers come from the metadata index when there is one (input.metadata).
+    """
+    cfg = cfg or {}
+    n = len(paths)
+    k = max(1, min(n, int(cfg.get("sample", 200))))
+    sample = [paths[int(i)] for i in np.linspace(0, n - 1, k)] if n else []
+    if index is not None:
+        found = [index.lookup(p) for p in sample]
+    else:
+        found = parallel_map(read_metadata, sample, int(cfg.get("workers", 8)), processes=False)
+    headers = [h for h in found if h and "error" not in h]
+    mpix = [h["width"] * h["height"] / 1e6 for h in headers if h.get("width")]
+    megapixels = float(np.median(mpix)) if mpix else float(cfg.get("megapixels", DEFAULT_MEGAPIXELS))
+    neighbours, source = _estimate_neighbours(headers, n, cfg)
+    gps = sum(1 for h in headers if "lat" in h) / len(headers) if headers else 0.0
+    return Dataset(n, round(megapixels, 2), round(neighbours, 1), source, round(gps, 2))
+
+# Cost model
+
+def _p(params: Dict[str, Any], section: str, key: str) -> float:
+    v = params.get(section, {}).get(key, PARAM_DEFAULTS.get(section, {}).get(key, 0))
+    return float(v)
+
+def _ds(v: float) -> float:
+    # Metashape downscale is per image side; 0 means upscaled x2
+    return 1.0 / max(v, 0.5) ** 2
+
+def op_work(op: str, images: float, megapixels: float, neighbours: float,
+            params: Dict[str, Dict[str, Any]]) -> Tuple[float, float]:
+    """
+    (time work, memory work) of one op; runtime = rate * time work and
+    peak memory = BASE_MEMORY_MB + coefficient * memory work. `megapixels` is
+    per image, `params` maps config sections to their parameters.
+    """
+    total = images * megapixels
+    mds = _ds(_p(params, "match_photos", "downscale"))
+    dds = _ds(_p(params, "build_depth_maps", "downscale"))
+    kp = _p(params, "match_photos", "keypoint_limit") / 40000.0
+    tp = _p(params, "match_photos", "tiepoint_limit") / 4000.0
+    if op == "matchPhotos":
+        return total * mds + images * neighbours * kp, megapixels * mds
+    if op == "alignCameras":
+        return images * neighbours * tp, images * tp
+    if op == "optimizeCameras":
+        return images, images
+    if op == "buildDepthMaps":
+        nb = _p(params, "build_depth_maps", "max_neighbors") / 16.0
+        return total * dds * nb, megapixels * dds * nb
+    if op in ("buildPointCloud", "buildDem", "buildModel"):
+        return total * dds, total * dds
+    if op == "buildOrthomosaic":
+        return total, megapixels
+    if op == "buildUV":
+        return images, images
+    if op == "buildTexture":
+        tex = (_p(params, "build_texture", "texture_size") / 8192.0) ** 2 * _p(params, "build_uv", "page_count")
+        return images * tex, tex
+    return 0.0, 0.0
+
+def history_paths(logs_root: str) -> List[str]:
+    return sorted(glob.glob(os.path.join(logs_root, "*", "metrics.jsonl")))
+
+def calibrate(paths: Sequence[str], host: Optional[str] = None, limit: int = 20) -> Dict[str, Dict[str, float]]:
+    """
+    Per-op rate and memory coefficient from metrics.jsonl records (median of
+    the last `limit` successful calls). Records of this host are preferred.
+    The overlap is the planner's estimate recorded with the run, if any.
+    """
+    host = host or socket.gethostname()
+    runs: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    recs: List[Dict[str, Any]] = []
+    for path in paths:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue
+                    if rec.get("op") not in OP_SECTIONS or rec.get("status") != "ok" or not rec.get("cameras"):
+                        continue
+                    recs.append(rec)
+                    # Parameters of all ops of one run (point cloud cost depends on depth map downscale)
+                    run = runs.setdefault(rec.get("run_id", ""), {})
+                    run[OP_SECTIONS[rec["op"]]] = rec.get("params", {})
+        except OSError:
+            continue
+    local = [r for r in recs if r.get("host") == host]
+    recs = local or recs
+
+    samples: Dict[str, Dict[str, List[float]]] = {}
+    for rec in recs:
+        n = float(rec["cameras"])
+        mpix = float(rec.get("megapixels", 0)) / n
+        neighbours = float(rec.get("neighbours") or DEFAULT_NEIGHBOURS)
+        tw, mw = op_work(rec["op"], n, mpix, neighbours, runs.get(rec.get("run_id", ""), {}))
+        s = samples.setdefault(rec["op"], {"rate": [], "memory": []})
+        if tw > 0:
+            s["rate"].append(float(rec["wall_s"]) / tw)
+        if mw > 0 and rec.get("peak_rss_mb"):
+            s["memory"].append(max(0.0, float(rec["peak_rss_mb"]) - BASE_MEMORY_MB) / mw)
+    out: Dict[str, Dict[str, float]] = {}
+    for op, s in samples.items():
+        out[op] = {k: statistics.median(v[-limit:]) for k, v in s.items() if v}
+    return out
+
+def estimate(ds: Dataset, stages: Sequence[str], proc: Dict[str, Any],
+             calibration: Optional[Dict[str, Dict[str, float]]] = None, cores: int = 0) -> List[Dict[str, Any]]:
+    """
+    Estimated runtime and peak memory of each stage.
+    """
+    calibration = calibration or {}
+    cores = cores or os.cpu_count() or 8
+    split = proc.get("split_blocks", {})
+    rows = []
+    for stage in stages:
+        if stage not in STAGE_OPS:
+            continue
+        ops = STAGE_OPS[stage]
+        time_s, peak = 0.0, 0.0
+        calibrated = True
+        for op in ops:
+            images = float(ds.images)
+            time_scale = 1.0
+            if stage == "blocks":
+                # Blocks hold at most target_cameras, and overlap is built twice
+                images = min(images, float(split.get("target_cameras", 2000)))
+                time_scale = (1.0 + 2.0 * float(split.get("overlap", 0.1))) ** 2 * ds.images / max(images, 1.0)
+            tw, mw = op_work(op, images, ds.megapixels, ds.neighbours, proc)
+            cal = calibration.get(op, {})
+            if "rate" in cal:
+                rate = cal["rate"]
+            else:
+                calibrated = False
+                rate = DEFAULT_RATES[op] * 8.0 / cores
+            time_s += rate * tw * time_scale
+            peak = max(peak, BASE_MEMORY_MB + cal.get("memory", DEFAULT_MEMORY[op]) * mw)
+        rows.append({"stage": stage, "time_s": time_s, "peak_mb": peak, "calibrated": calibrated})
+    return rows
+
+def tune(ds: Dataset, stages: Sequence[str], proc: Dict[str, Any], calibration: Dict[str, Dict[str, float]],
+         time_budget_s: float, memory_budget_mb: float, cores: int = 0) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Greedily coarsen TUNING_STEPS until the estimate fits the budgets (0 = no
+    limit). Returns the tuned processing config and one line per change.
+    """
+    proc = copy.deepcopy(proc)
+    changes: Dict[str, List[Any]] = {}
+
+    def over(rows: List[Dict[str, Any]]) -> Tuple[float, float]:
+        t = sum(r["time_s"] for r in rows)
+        m = max((r["peak_mb"] for r in rows), default=0.0)
+        return (max(0.0, t / time_budget_s - 1.0) if time_budget_s else 0.0,
+                max(0.0, m / memory_budget_mb - 1.0) if memory_budget_mb else 0.0)
+
+    used = {op for s in stages for op in STAGE_OPS.get(s, ())}
+    knobs = [k for k in TUNING_STEPS if any(OP_SECTIONS[op] == k[0] for op in used)]
+    cur = over(estimate(ds, stages, proc, calibration, cores))
+    while sum(cur) > 0:
+        best = None
+        for section, key, steps in knobs:
+            value = proc.get(section, {}).get(key, PARAM_DEFAULTS.get(section, {}).get(key))
+            coarser = [s for s in steps if (s > value if key == "downscale" else s < value)]
+            if not coarser:
+                continue
+            trial = copy.deepcopy(proc)
+            trial.setdefault(section, {})[key] = coarser[0]
+            o = over(estimate(ds, stages, trial, calibration, cores))
+            if best is None or sum(o) < sum(best[0]):
+                best = (o, section, key, value, coarser[0], trial)
+        if best is None or sum(best[0]) >= sum(cur):
+            break
+        cur, section, key, old, new, proc = best
+        changes.setdefault(f"{section}.{key}", [old, new])[1] = new
+    return proc, [f"{k}: {old} -> {new}" for k, (old, new) in changes.items()]
+
+def make_plan(ds: Dataset, stages: Sequence[str], proc: Dict[str, Any], planner_cfg: Dict[str, Any],
+              history: Sequence[str] = ()) -> Dict[str, Any]:
+    """
+    Estimated schedule for the stages, with warnings when it exceeds
+    planner.time_budget_h / planner.memory_budget_gb (default: 90% of RAM)
+    and, with planner.auto_tune, the processing config tuned to fit.
+    """
+    cores = os.cpu_count() or 0
+    ram_mb = machine_memory_mb()
+    time_budget = float(planner_cfg.get("time_budget_h", 0) or 0) * 3600.0
+    mem_budget = float(planner_cfg.get("memory_budget_gb", 0) or 0) * 1024.0 or ram_mb * 0.9
+    calibration = calibrate(history)
+
+    rows = estimate(ds, stages, proc, calibration, cores)
+    tuned, changes = tune(ds, stages, proc, calibration, time_budget, mem_budget, cores)
+    auto = bool(planner_cfg.get("auto_tune", False))
+    if auto and changes:
+        rows = estimate(ds, stages, tuned, calibration, cores)
+
+    total = sum(r["time_s"] for r in rows)
+    peak = max((r["peak_mb"] for r in rows), default=0.0)
+    warnings = []
+    if time_budget and total > time_budget:
+        warnings.append(f"estimated {_fmt_h(total)} exceeds the time budget of {_fmt_h(time_budget)}")
+    if mem_budget and peak > mem_budget:
+        warnings.append(f"estimated peak {peak / 1024:.1f} GB exceeds the memory budget of {mem_budget / 1024:.1f} GB")
+    if changes and not auto:
+        warnings.append("to fit the budget, consider: " + "; ".join(changes))
+    if not all(r["calibrated"] for r in rows):
+        warnings.append("some stages use default cost rates; estimates improve after a run with metrics enabled")
+    return {
+        "dataset": ds._asdict(),
+        "machine": {"cores": cores, "memory_gb": round(ram_mb / 1024.0, 1)},
+        "stages": rows,
+        "total_s": total,
+        "peak_mb": peak,
+        "changes": changes if auto else [],
+        "processing": tuned if auto else proc,
+        "warnings": warnings,
+    }
+
+def _fmt_h(s: float) -> str:
+    return f"{s / 3600.0:.1f} h" if s >= 3600 else f"{s / 60.0:.0f} min"
+
+def format_plan(plan: Dict[str, Any]) -> List[str]:
+    ds = plan["dataset"]
+    m = plan["machine"]
+    lines = [
+        f"Photos: {ds['images']} x {ds['megapixels']} MP, ~{ds['neighbours']} overlapping images each "
+        f"({ds['overlap_source']}, GPS in {ds['gps_fraction']:.0%} of sampled photos)",
+        f"Machine: {m['cores']} cores, {m['memory_gb']} GB RAM",
+        f"{'stage':<18}{'time':>10}{'peak RAM':>12}",
+    ]
+    for r in plan["stages"]:
+        mark = "" if r["calibrated"] else "  (default rate)"
+        lines.append(f"{r['stage']:<18}{_fmt_h(r['time_s']):>10}{r['peak_mb'] / 1024:>9.1f} GB{mark}")
+    lines.append(f"{'total':<18}{_fmt_h(plan['total_s']):>10}{plan['peak_mb'] / 1024:>9.1f} GB")
+    for c in plan["changes"]:
+        lines.append(f"Tuned: {c}")
+    for w in plan["warnings"]:
+        lines.append(f"Warning: {w}")
+    return lines
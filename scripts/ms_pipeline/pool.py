@@ -0,0 +1,85 @@
+from __future__ import annotations
+import contextlib
+import glob
+import multiprocessing
+import os
+import sys
+import types
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, List, Optional
+
+def _is_python(exe: str) -> bool:
+    return os.path.basename(exe).lower().startswith("python")
+
+def find_python() -> Optional[str]:
+    """
+    Python interpreter for worker processes.
+    Inside Metashape sys.executable is the Metashape binary, so look for the
+    bundled interpreter next to it (override with METASHAPE_PYTHON).
+    """
+    env = os.environ.get("METASHAPE_PYTHON", "")
+    if env and os.path.isfile(env):
+        return env
+    if sys.executable and _is_python(sys.executable):
+        return sys.executable
+    base = os.path.dirname(sys.executable or "")
+    candidates = [
+        os.path.join(base, "python", "python.exe"),
+        os.path.join(base, "python", "bin", "python3"),
+    ]
+    candidates += sorted(glob.glob(os.path.join(base, "python", "bin", "python3.*")))
+    candidates += sorted(glob.glob(os.path.join(base, "..", "Frameworks", "Python.framework", "Versions", "*", "bin", "python3")))
+    for c in candidates:
+        if os.path.isfile(c):
+            return os.path.abspath(c)
+    return None
+
+@contextlib.contextmanager
+def _without_main() -> Iterator[None]:
+    """
+    Spawned children re-import the parent's __main__ script. Under Metashape that
+    is the workflow script itself, which would start the whole pipeline again in
+    every worker, so hide it while workers are being started.
+    """
+    main = sys.modules.get("__main__")
+    sys.modules["__main__"] = types.ModuleType("__main__")
+    try:
+        yield
+    finally:
+        if main is not None:
+            sys.modules["__main__"] = main
+
+def make_executor(workers: int = 0, processes: bool = True) -> Executor:
+    """
+    Process pool when a usable interpreter is found, thread pool otherwise.
+    workers <= 0 means one per CPU.
+    """
+    n = int(workers) if workers and int(workers) > 0 else (os.cpu_count() or 1)
+    if processes:
+        py = find_python()
+        if py:
+            ctx = multiprocessing.get_context("spawn")
+            ctx.set_executable(py)
+            return ProcessPoolExecutor(max_workers=n, mp_context=ctx)
+    return ThreadPoolExecutor(max_workers=n)
+
+def parallel_map(fn: Callable[[Any], Any], items: Iterable[Any], workers: int = 0, processes: bool = True,
+                 chunksize: int = 0) -> List[Any]:
+    """
+    Ordered map over a worker pool. fn must be a module-level function importable
+    from ms_pipeline (not defined in the calling script).
+    """
+    items = list(items)
+    if not items:
+        return []
+    with make_executor(workers, processes) as ex:
+        if isinstance(ex, ProcessPoolExecutor):
+            n = ex._max_workers
+            cs = chunksize or max(1, min(64, len(items) // (n * 4)))
+            # ProcessPoolExecutor.map submits everything up front, so every
+            # worker is started inside the guard.
+            with _without_main():
+                results = ex.map(fn, items, chunksize=cs)
+        else:
+            results = ex.map(fn, items)
+        return list(results)
@@ -0,0 +1,166 @@
+from __future__ import annotations
+import json
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .checkpoint import config_hash
+from .pool import parallel_map
+
+CACHE_VERSION = 1
+
+def _require_pil() -> Any:
+    try:
+        from PIL import Image
+    except ImportError as e:
+        raise RuntimeError("input.preflight needs Pillow in Metashape's Python (see docs/installation.md)") from e
+    return Image
+
+def _thumbnail(Image: Any, path: str, size: int) -> Any:
+    im = Image.open(path)
+    # JPEG: let the decoder downscale in the DCT domain instead of decoding full size
+    im.draft("L", (size, size))
+    if im.mode in ("I;16", "I;16B", "I", "F"):
+        a = np.asarray(im, dtype=np.float32)
+        hi = float(a.max()) or 1.0
+        im = Image.fromarray((a * (255.0 / hi)).astype(np.uint8))
+    im = im.convert("L")
+    im.thumbnail((size, size))
+    return im
+
+def score_image(job: Tuple[str, int]) -> Dict[str, Any]:
+    """
+    Sharpness (variance of the Laplacian), exposure and a 64-bit difference hash
+    of one downsampled grayscale thumbnail. Runs in a worker process.
+    """
+    path, size = job
+    Image = _require_pil()
+    try:
+        im = _thumbnail(Image, path, size)
+    except Exception as e:
+        return {"error": f"{type(e).__name__}: {e}"}
+
+    a = np.asarray(im, dtype=np.float32)
+    lap = a[:-2, 1:-1] + a[2:, 1:-1] + a[1:-1, :-2] + a[1:-1, 2:] - 4.0 * a[1:-1, 1:-1]
+
+    hist = np.bincount(np.asarray(im, dtype=np.uint8).ravel(), minlength=256).astype(np.float64)
+    hist /= max(hist.sum(), 1.0)
+
+    d = np.asarray(im.resize((9, 8), Image.BILINEAR), dtype=np.int16)
+    bits = (d[:, 1:] > d[:, :-1]).ravel()
+    dhash = int(np.packbits(bits).view(">u8")[0])
+
+    return {
+        "sharpness": float(lap.var()) if lap.size else 0.0,
+        "mean": float(np.dot(hist, np.arange(256))),
+        "over": float(hist[250:].sum()),
+        "under": float(hist[:6].sum()),
+        "dhash": f"{dhash:016x}",
+    }
+
+def _fingerprint(entry: Tuple[str, int, int]) -> str:
+    p, size, mtime_ns = entry
+    return f"{p}|{size}|{mtime_ns}"
+
+def _load_cache(path: Optional[str], params_key: str) -> Dict[str, Any]:
+    if not path or not os.path.isfile(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get("version") != CACHE_VERSION or data.get("params") != params_key:
+        return {}
+    return data.get("scores", {})
+
+def _save_cache(path: str, params_key: str, scores: Dict[str, Any]) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": CACHE_VERSION, "params": params_key, "scores": scores}, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+def score_photos(entries: Sequence[Tuple[str, int, int]], cfg: Dict[str, Any],
+                 cache_path: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Scores for every entry, in order. Cached per file fingerprint (path, size, mtime),
+    so only new or changed photos are decoded.
+    """
+    size = int(cfg.get("thumbnail_size", 512))
+    params_key = config_hash("preflight", size)
+    cache = _load_cache(cache_path, params_key)
+
+    fps = [_fingerprint(e) for e in entries]
+    todo = [i for i, fp in enumerate(fps) if fp not in cache]
+    if todo:
+        _require_pil()
+        results = parallel_map(score_image, [(entries[i][0], size) for i in todo], workers=int(cfg.get("workers", 0)))
+        for i, r in zip(todo, results):
+            cache[fps[i]] = r
+        if cache_path:
+            keep = set(fps)
+            _save_cache(cache_path, params_key, {k: v for k, v in cache.items() if k in keep})
+    return [cache[fp] for fp in fps]
+
+def select_photos(entries: Sequence[Tuple[str, int, int]], scores: Sequence[Dict[str, Any]],
+                  cfg: Dict[str, Any]) -> Dict[str, List[str]]:
+    """
+    Reject reasons per photo path (only rejected photos are listed).
+    Near-duplicates are checked between consecutive frames in capture (path) order;
+    the later frame of a pair is rejected.
+    """
+    n = len(entries)
+    reasons: Dict[str, List[str]] = {}
+    if n == 0:
+        return reasons
+
+    ok = np.array(["error" not in s for s in scores])
+    sharp = np.array([s.get("sharpness", 0.0) for s in scores], dtype=np.float64)
+    over = np.array([s.get("over", 0.0) for s in scores], dtype=np.float64)
+    under = np.array([s.get("under", 0.0) for s in scores], dtype=np.float64)
+    hashes = np.array([int(s.get("dhash", "0"), 16) for s in scores], dtype=np.uint64)
+
+    checks = [("unreadable", ~ok)]
+    min_sharp = float(cfg.get("min_sharpness", 0))
+    ratio = float(cfg.get("min_sharpness_ratio", 0.35))
+    if ok.any() and ratio > 0:
+        min_sharp = max(min_sharp, ratio * float(np.median(sharp[ok])))
+    checks.append(("blurred", ok & (sharp < min_sharp)))
+    checks.append(("overexposed", ok & (over > float(cfg.get("max_overexposed", 0.25)))))
+    checks.append(("underexposed", ok & (under > float(cfg.get("max_underexposed", 0.25)))))
+
+    max_ham = int(cfg.get("duplicate_hamming", 2))
+    if max_ham >= 0 and n > 1:
+        order = np.argsort(np.array([e[0] for e in entries]))
+        x = hashes[order[1:]] ^ hashes[order[:-1]]
+        ham = np.unpackbits(x.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+        same_dir = np.array([os.path.dirname(entries[a][0]) == os.path.dirname(entries[b][0])
+                             for a, b in zip(order[:-1], order[1:])])
+        dup = np.zeros(n, dtype=bool)
+        dup[order[1:]] = (ham <= max_ham) & same_dir & ok[order[1:]] & ok[order[:-1]]
+        checks.append(("near-duplicate", dup))
+
+    for label, mask in checks:
+        for i in np.flatnonzero(mask):
+            reasons.setdefault(entries[i][0], []).append(label)
+    return reasons
+
+def run_preflight(entries: Sequence[Tuple[str, int, int]], cfg: Dict[str, Any],
+                  cache_path: Optional[str] = None) -> Dict[str, List[str]]:
+    scores = score_photos(entries, cfg, cache_path)
+    return select_photos(entries, scores, cfg)
+
+def disable_cameras(chunk: Any, rejected: Dict[str, List[str]], cameras: Optional[Sequence[Any]] = None) -> int:
+    """
+    Disable the cameras (all of the chunk's unless given) whose photo was rejected.
+    """
+    n = 0
+    for cam in (getattr(chunk, "cameras", []) or []) if cameras is None else cameras:
+        photo = getattr(cam, "photo", None)
+        p = os.path.abspath(photo.path) if photo is not None else ""
+        if p in rejected:
+            cam.enabled = False
+            n += 1
+    return n
@@ -0,0 +1,227 @@
+from __future__ import annotations
+import json
+import os
+import statistics
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+class StalledError(RuntimeError):
+    pass
+
+def load_history(metrics_path: str, limit: int = 5000) -> Dict[str, float]:
+    """
+    Median seconds per megapixel of every op from past successful runs
+    (last `limit` records of metrics.jsonl).
+    """
+    if not metrics_path or not os.path.isfile(metrics_path):
+        return {}
+    rates: Dict[str, list] = {}
+    try:
+        with open(metrics_path, "r", encoding="utf-8") as f:
+            lines = f.readlines()[-limit:]
+    except OSError:
+        return {}
+    for line in lines:
+        try:
+            rec = json.loads(line)
+        except ValueError:
+            continue
+        if rec.get("status") == "ok" and rec.get("s_per_mpix"):
+            rates.setdefault(rec["op"], []).append(float(rec["s_per_mpix"]))
+    return {op: statistics.median(v) for op, v in rates.items()}
+
+class ProgressMonitor:
+    """
+    Progress callbacks for Metashape processing calls.
+
+    callback() returns the function passed as progress= to chunk.buildDepthMaps()
+    etc. Progress is logged at most every log_interval seconds (or log_step
+    percent) and written to a JSON status file. ETA blends the observed rate with
+    the historical seconds/megapixel of the same op. A watchdog thread raises a
+    stall alarm when progress has not advanced for stall_minutes; with
+    stall_action="abort" the next callback raises StalledError (Metashape then
+    cancels the operation and the error unwinds the run). If no callback
+    arrives for another stall period, a headless run (hard_exit=True: batch
+    jobs) exits with code 75 so a scheduler can retry it; otherwise the error
+    is logged and the abort stays pending for the next callback.
+    """
+
+    def __init__(self, log: Any, status_path: str = "", history: Optional[Dict[str, float]] = None,
+                 log_interval: float = 60.0, log_step: float = 10.0, status_interval: float = 5.0,
+                 stall_minutes: float = 30.0, stall_action: str = "warn",
+                 clock: Callable[[], float] = time.monotonic, watchdog: bool = True, hard_exit: bool = False,
+                 **status_fields: Any):
+        self.log = log
+        self.status_path = status_path
+        self.history = history or {}
+        self.log_interval = float(log_interval)
+        self.log_step = float(log_step)
+        self.status_interval = float(status_interval)
+        self.stall_s = float(stall_minutes) * 60.0
+        self.stall_action = stall_action
+        self.clock = clock
+        self.hard_exit = hard_exit
+        self.status_fields = status_fields
+        self.stage = ""
+        self._lock = threading.Lock()
+        self._op: Optional[Dict[str, Any]] = None
+        self._stop = threading.Event()
+        self._thread = None
+        if watchdog and self.stall_s > 0:
+            self._thread = threading.Thread(target=self._watch, name="progress-watchdog", daemon=True)
+            self._thread.start()
+
+    # Tracking
+
+    def callback(self, op: str, stage: Optional[str] = None, megapixels: float = 0.0) -> Callable[[float], None]:
+        now = self.clock()
+        with self._lock:
+            self._op = {
+                "op": op,
+                "stage": self.stage if stage is None else stage,
+                "megapixels": float(megapixels or 0.0),
+                "progress": 0.0,
+                "started": now,
+                "last_advance": now,
+                "last_log": now,
+                "last_log_pct": 0.0,
+                "last_status": 0.0,
+                "stalled": False,
+                "abort": False,
+                "hard_stop": False,
+            }
+        self.write_status("running")
+
+        def progress(p: float) -> None:
+            self.update(p)
+
+        return progress
+
+    def update(self, p: float) -> None:
+        now = self.clock()
+        msg = None
+        with self._lock:
+            st = self._op
+            if st is None:
+                return
+            if st["abort"]:
+                raise StalledError(f"{st['op']}: no progress for {self.stall_s / 60:.0f} min, aborting")
+            p = float(p)
+            if p > st["progress"]:
+                st["progress"] = p
+                st["last_advance"] = now
+                if st["stalled"]:
+                    st["stalled"] = False
+                    msg = f"{st['op']}: progress resumed at {p:.1f}%"
+            due_log = (now - st["last_log"] >= self.log_interval
+                       or (self.log_step > 0 and p - st["last_log_pct"] >= self.log_step))
+            if due_log and msg is None:
+                st["last_log"] = now
+                st["last_log_pct"] = p
+                eta = self._eta(st, now)
+                msg = f"{st['op']}: {p:.1f}%" + (f", ETA {_fmt_s(eta)}" if eta is not None else "")
+            due_status = now - st["last_status"] >= self.status_interval
+        if msg:
+            self.log.info(msg, op=st["op"], progress=round(p, 1))
+        if due_status:
+            self.write_status("running")
+
+    def finish(self, ok: bool = True) -> None:
+        self.write_status("done" if ok else "failed")
+        with self._lock:
+            self._op = None
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    # ETA / stall
+
+    def _eta(self, st: Dict[str, Any], now: float) -> Optional[float]:
+        p = st["progress"]
+        elapsed = now - st["started"]
+        rate_eta = elapsed * (100.0 - p) / p if p >= 1.0 else None
+        hist = self.history.get(st["op"])
+        hist_eta = max(0.0, hist * st["megapixels"] - elapsed) if hist and st["megapixels"] else None
+        if rate_eta is None:
+            return hist_eta
+        if hist_eta is None:
+            return rate_eta
+        # Early on the observed rate is noisy: trust history until ~25%
+        w = min(1.0, p / 25.0)
+        return w * rate_eta + (1.0 - w) * hist_eta
+
+    def check(self) -> None:
+        """
+        One watchdog pass (called periodically by the watchdog thread).
+        """
+        now = self.clock()
+        with self._lock:
+            st = self._op
+            if st is None or self.stall_s <= 0:
+                return
+            idle = now - st["last_advance"]
+            if idle < self.stall_s:
+                return
+            first = not st["stalled"]
+            st["stalled"] = True
+            if self.stall_action == "abort":
+                st["abort"] = True
+            hard_stop = self.stall_action == "abort" and idle >= 2 * self.stall_s and not st["hard_stop"]
+            if hard_stop:
+                st["hard_stop"] = True
+            op, p = st["op"], st["progress"]
+        if first:
+            self.log.warn(f"{op}: no progress for {idle / 60:.1f} min (at {p:.1f}%)", op=op, stalled=True)
+            self.write_status("stalled")
+        if hard_stop and self.hard_exit:
+            self.log.error(f"{op}: still no progress after {idle / 60:.1f} min, exiting")
+            self.write_status("stalled")
+            # Skips cleanup: only for headless runs, where the scheduler retries the job
+            os._exit(75)
+        if hard_stop:
+            self.log.error(f"{op}: still no progress after {idle / 60:.1f} min; "
+                           "it is aborted at its next progress update, or cancel it in Metashape")
+
+    def _watch(self) -> None:
+        interval = min(30.0, max(1.0, self.stall_s / 10.0))
+        while not self._stop.wait(interval):
+            self.check()
+
+    def write_status(self, state: str) -> None:
+        if not self.status_path:
+            return
+        now = self.clock()
+        with self._lock:
+            st = dict(self._op) if self._op else {}
+            if self._op:
+                self._op["last_status"] = now
+        rec = dict(self.status_fields)
+        rec.update({"state": state, "updated": time.strftime("%Y-%m-%dT%H:%M:%S")})
+        if st:
+            eta = self._eta(st, now)
+            rec.update({
+                "stage": st["stage"],
+                "op": st["op"],
+                "progress": round(st["progress"], 2),
+                "elapsed_s": round(now - st["started"], 1),
+                "idle_s": round(now - st["last_advance"], 1),
+                "eta_s": round(eta, 1) if eta is not None else None,
+            })
+        tmp = self.status_path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(rec, f, indent=2)
+            os.replace(tmp, self.status_path)
+        except OSError:
+            pass
+
+def _fmt_s(s: float) -> str:
+    s = int(s)
+    if s >= 3600:
+        return f"{s // 3600}h{(s % 3600) // 60:02d}m"
+    if s >= 60:
+        return f"{s // 60}m{s % 60:02d}s"
+    return f"{s}s"
@@ -1,49 +1,316 @@
-from __future__ import annotations
-from typing import Any, Dict
-
-def qc_snapshot(chunk: Any) -> Dict[str, Any]:
-    cams = getattr(chunk, "cameras", []) or []
-    aligned = 0
-    for c in cams:
-        try:
-            if c.transform:
-                aligned += 1
-        except Exception:
-            pass
-
-    # Tie points (API names changed across versions; keep defensive)
-    tie_pts = None
-    try:
-        tie_pts = chunk.tie_points
-    except Exception:
-        pass
-
-    tie_count = None
-    if tie_pts is not None:
-        try:
-            tie_count = len(tie_pts.points)
-        except Exception:
-            tie_count = None
-
-    # Point cloud
-    pc = None
-    try:
-        pc = chunk.point_cloud
-    except Exception:
-        pass
-
-    pc_count = None
-    if pc is not None:
-        try:
-            pc_count = len(pc.points)
-        except Exception:
-            pc_count = None
-
-    markers = getattr(chunk, "markers", []) or []
-    return {
-        "cameras_total": len(cams),
-        "cameras_aligned": aligned,
-        "tie_points_count": tie_count,
-        "point_cloud_points_count": pc_count,
-        "markers_total": len(markers),
-    }
\ No newline at end of file
+from __future__ import annotations
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+# Runbook gates (docs/runbook.md); 0 turns a gate off
+DEFAULT_GATES = {
+    "min_aligned_fraction": 0.95,
+    "min_tie_points": 0,
+    "max_reprojection_error_p95": 0,
+    "max_camera_error_rmse_m": 0,
+    "max_control_rmse_m": 0,
+    "max_check_rmse_m": 0,
+}
+
+# gate -> (metric path, comparison)
+GATE_METRICS = {
+    "min_aligned_fraction": ("cameras.aligned_fraction", ">="),
+    "min_tie_points": ("tie_points.count", ">="),
+    "max_reprojection_error_p95": ("tie_points.reprojection_error.p95", "<="),
+    "max_camera_error_rmse_m": ("cameras.reference_error.rmse", "<="),
+    "max_control_rmse_m": ("markers.control.rmse", "<="),
+    "max_check_rmse_m": ("markers.check.rmse", "<="),
+}
+
+PERCENTILES = (5, 50, 95, 99)
+
+def _count(obj: Any, *attrs: str) -> Optional[int]:
+    """
+    Element count from a metadata attribute (point_count); never iterates.
+    """
+    for a in attrs:
+        try:
+            n = getattr(obj, a)
+        except Exception:
+            continue
+        if isinstance(n, (int, float)) and not isinstance(n, bool):
+            return int(n)
+    return None
+
+def _point_cloud(chunk: Any) -> Any:
+    # Metashape 1.x: dense_cloud (its point_cloud is the sparse cloud, with tracks)
+    for a in ("dense_cloud", "point_cloud"):
+        try:
+            pc = getattr(chunk, a)
+        except Exception:
+            continue
+        if pc is not None and not callable(pc) and not hasattr(pc, "tracks"):
+            return pc
+    return None
+
+def _tie_points(chunk: Any) -> Any:
+    for a in ("tie_points", "point_cloud"):
+        try:
+            tp = getattr(chunk, a)
+        except Exception:
+            continue
+        # Metashape 1.x: chunk.point_cloud is the sparse cloud (it has tracks)
+        if tp is not None and not callable(tp) and (a == "tie_points" or hasattr(tp, "tracks")):
+            return tp
+    return None
+
+def tie_point_count(chunk: Any) -> Optional[int]:
+    tp = _tie_points(chunk)
+    if tp is None:
+        return None
+    n = _count(tp, "point_count")
+    if n is None:
+        try:
+            # A sequence object; its length does not build per-point wrappers
+            n = len(tp.points)
+        except Exception:
+            n = None
+    return n
+
+def tie_point_filter(Metashape: Any) -> Any:
+    """
+    Gradual selection filter class (TiePoints.Filter, PointCloud.Filter before 2.0).
+    """
+    for owner in ("TiePoints", "PointCloud"):
+        cls = getattr(getattr(Metashape, owner, None), "Filter", None)
+        if isinstance(cls, type):
+            return cls
+    return None
+
+def tie_point_values(Metashape: Any, chunk: Any, criterion: str) -> Optional[np.ndarray]:
+    """
+    Per tie point value of a gradual selection criterion (ReprojectionError,
+    ReconstructionUncertainty, ImageCount, ProjectionAccuracy), computed by
+    Metashape and returned as one float array.
+    """
+    Filter = tie_point_filter(Metashape)
+    if Filter is None or _tie_points(chunk) is None:
+        return None
+    try:
+        f = Filter()
+        f.init(chunk, criterion=getattr(Filter, criterion))
+        values = f.values
+        return np.fromiter(values, dtype=np.float64, count=len(values))
+    except Exception:
+        return None
+
+def value_stats(a: np.ndarray) -> Dict[str, Any]:
+    a = a[np.isfinite(a)]
+    if not a.size:
+        return {"n": 0}
+    pct = np.percentile(a, PERCENTILES)
+    out: Dict[str, Any] = {"n": int(a.size), "mean": float(a.mean()), "max": float(a.max())}
+    out.update({f"p{p}": float(v) for p, v in zip(PERCENTILES, pct)})
+    return out
+
+def _errors(a: np.ndarray) -> Dict[str, Any]:
+    """
+    RMSE of (n, 3) east/north/up errors in metres.
+    """
+    if not len(a):
+        return {"n": 0}
+    xy = np.hypot(a[:, 0], a[:, 1])
+    total = np.sqrt((a * a).sum(axis=1))
+    return {
+        "n": int(len(a)),
+        "rmse_xy": float(np.sqrt((xy * xy).mean())),
+        "rmse_z": float(np.sqrt((a[:, 2] ** 2).mean())),
+        "rmse": float(np.sqrt((total * total).mean())),
+        "max": float(total.max()),
+    }
+
+def _sample(items: Sequence[Any], limit: int) -> Sequence[Any]:
+    if limit <= 0 or len(items) <= limit:
+        return items
+    step = len(items) / float(limit)
+    return [items[int(i * step)] for i in range(limit)]
+
+def _reference_errors(chunk: Any, items: Sequence[Any], position: str) -> Dict[str, np.ndarray]:
+    """
+    Estimated minus reference location (east/north/up metres) of cameras or
+    markers with both; split into enabled (control) and disabled (check).
+    """
+    crs = getattr(chunk, "crs", None)
+    try:
+        M = chunk.transform.matrix
+    except Exception:
+        M = None
+    out: Dict[str, List[Any]] = {"control": [], "check": [], "labels_control": [], "labels_check": []}
+    if M is None:
+        return {k: np.zeros((0, 3)) if not k.startswith("labels") else np.array([]) for k in out}
+    for it in items:
+        try:
+            ref = it.reference
+            loc = ref.location
+            p = it.center if position == "center" else it.position
+            if loc is None or p is None:
+                continue
+            est = M.mulp(p)
+            if crs is not None:
+                d = crs.localframe(est).mulv(est - crs.unproject(loc))
+            else:
+                d = est - loc
+        except Exception:
+            continue
+        kind = "control" if getattr(ref, "location_enabled", getattr(ref, "enabled", True)) else "check"
+        out[kind].append((float(d[0]), float(d[1]), float(d[2])))
+        out["labels_" + kind].append(getattr(it, "label", ""))
+    return {k: np.asarray(v, dtype=np.float64).reshape(-1, 3) if not k.startswith("labels") else np.asarray(v)
+            for k, v in out.items()}
+
+def _worst(errors: np.ndarray, labels: np.ndarray, n: int = 5) -> List[Dict[str, Any]]:
+    if not len(errors):
+        return []
+    total = np.sqrt((errors * errors).sum(axis=1))
+    idx = np.argsort(total)[::-1][:n]
+    return [{"label": str(labels[i]), "error_m": round(float(total[i]), 4)} for i in idx]
+
+def qc_snapshot(chunk: Any) -> Dict[str, Any]:
+    """
+    Counts from metadata only: no point cloud or tie point data is read.
+    cameras_aligned counts enabled cameras, like the aligned fraction. The
+    point cloud count is None when the cloud has no point_count: counting
+    the points themselves is what this avoids.
+    """
+    cams = getattr(chunk, "cameras", []) or []
+    aligned = 0
+    for c in cams:
+        try:
+            if getattr(c, "enabled", True) and c.transform:
+                aligned += 1
+        except Exception:
+            pass
+    pc = _point_cloud(chunk)
+    markers = getattr(chunk, "markers", []) or []
+    return {
+        "cameras_total": len(cams),
+        "cameras_aligned": aligned,
+        "tie_points_count": tie_point_count(chunk),
+        "point_cloud_points_count": _count(pc, "point_count") if pc is not None else None,
+        "markers_total": len(markers),
+    }
+
+def qc_metrics(Metashape: Any, chunk: Any, qc_cfg: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Camera, tie point and marker statistics. Tie point values come from
+    Metashape's gradual selection filter as arrays; camera reference errors
+    use at most qc.max_cameras cameras.
+    """
+    snap = qc_snapshot(chunk)
+    cams = list(getattr(chunk, "cameras", []) or [])
+    enabled = [c for c in cams if getattr(c, "enabled", True)]
+    aligned = snap["cameras_aligned"]
+    cam_err = _reference_errors(chunk, _sample(cams, int(qc_cfg.get("max_cameras", 5000))), "center")
+    cam_all = np.concatenate([cam_err["control"], cam_err["check"]])
+    cam_labels = np.concatenate([cam_err["labels_control"], cam_err["labels_check"]])
+    cameras = {
+        "total": len(cams),
+        "enabled": len(enabled),
+        "aligned": aligned,
+        "aligned_fraction": round(aligned / float(len(enabled)), 4) if enabled else None,
+        "reference_error": _errors(cam_all),
+        "worst": _worst(cam_all, cam_labels),
+    }
+
+    tie: Dict[str, Any] = {"count": snap["tie_points_count"]}
+    if snap["tie_points_count"] and qc_cfg.get("tie_point_stats", True):
+        for key, criterion in (("reprojection_error", "ReprojectionError"),
+                               ("reconstruction_uncertainty", "ReconstructionUncertainty"),
+                               ("image_count", "ImageCount")):
+            values = tie_point_values(Metashape, chunk, criterion)
+            if values is not None:
+                tie[key] = value_stats(values)
+
+    mk = _reference_errors(chunk, getattr(chunk, "markers", []) or [], "position")
+    markers = {
+        "total": snap["markers_total"],
+        "control": _errors(mk["control"]),
+        "check": _errors(mk["check"]),
+        "worst": _worst(np.concatenate([mk["control"], mk["check"]]),
+                        np.concatenate([mk["labels_control"], mk["labels_check"]])),
+    }
+    return {
+        "cameras": cameras,
+        "tie_points": tie,
+        "point_cloud": {"count": snap["point_cloud_points_count"]},
+        "markers": markers,
+    }
+
+def _lookup(metrics: Dict[str, Any], path: str) -> Any:
+    v: Any = metrics
+    for part in path.split("."):
+        if not isinstance(v, dict):
+            return None
+        v = v.get(part)
+    return v
+
+def evaluate_gates(metrics: Dict[str, Any], gates_cfg: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Check qc.gates (merged over DEFAULT_GATES). Gates set to 0 are off; gates
+    whose metric is missing (no markers, no tie point filter) are skipped.
+    """
+    gates = dict(DEFAULT_GATES)
+    gates.update(gates_cfg or {})
+    out = []
+    for name, limit in gates.items():
+        if name not in GATE_METRICS or not limit:
+            continue
+        path, op = GATE_METRICS[name]
+        value = _lookup(metrics, path)
+        if value is None:
+            out.append({"gate": name, "metric": path, "limit": limit, "value": None, "passed": None})
+            continue
+        ok = value >= limit if op == ">=" else value <= limit
+        out.append({"gate": name, "metric": path, "limit": limit, "value": value, "passed": bool(ok)})
+    return out
+
+def qc_report(Metashape: Any, chunk: Any, qc_cfg: Dict[str, Any], when: str) -> Dict[str, Any]:
+    metrics = qc_metrics(Metashape, chunk, qc_cfg)
+    gates = evaluate_gates(metrics, qc_cfg.get("gates", {}))
+    return {
+        "when": when,
+        "chunk": getattr(chunk, "label", ""),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "passed": all(g["passed"] is not False for g in gates),
+        "gates": gates,
+        "metrics": metrics,
+    }
+
+def failed_gates(report: Dict[str, Any]) -> List[str]:
+    return [f"{g['gate']}: {g['value']:.4g} (limit {g['limit']})" for g in report["gates"] if g["passed"] is False]
+
+def summary(report: Dict[str, Any]) -> str:
+    m = report["metrics"]
+    cams, tie = m["cameras"], m["tie_points"]
+    parts = [f"aligned {cams['aligned']}/{cams['enabled']}"]
+    if tie.get("count") is not None:
+        parts.append(f"tie points {tie['count']}")
+    if "reprojection_error" in tie and tie["reprojection_error"].get("n"):
+        parts.append(f"reprojection error p50/p95 {tie['reprojection_error']['p50']:.3g}/"
+                     f"{tie['reprojection_error']['p95']:.3g} px")
+    if m["point_cloud"]["count"] is not None:
+        parts.append(f"point cloud {m['point_cloud']['count']}")
+    if cams["reference_error"].get("n"):
+        parts.append(f"camera error RMSE {cams['reference_error']['rmse']:.3g} m")
+    for kind in ("control", "check"):
+        if m["markers"][kind].get("n"):
+            parts.append(f"{kind} RMSE {m['markers'][kind]['rmse']:.3g} m ({m['markers'][kind]['n']})")
+    failed = failed_gates(report)
+    parts.append("gates FAILED: " + "; ".join(failed) if failed else "gates passed")
+    return ", ".join(parts)
+
+def write_report(path: str, reports: List[Dict[str, Any]], **context: Any) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(dict(context, checks=reports), f, indent=2, default=str)
+    os.replace(tmp, path)
@@ -0,0 +1,292 @@
+from __future__ import annotations
+import csv
+import math
+import os
+import re
+from array import array
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+# importReference column codes: label, enabled flag, coordinates, coordinate
+# accuracy, rotation angles, rotation accuracy. "[", "]" and "|" only group
+# columns and take no column of their own.
+COLUMN_CODES = "noxyzXYZabcABC"
+GROUP_CODES = "[]|"
+
+# Geographic (lon/lat) CRSs seen in reference files; anything else is taken as projected
+GEOGRAPHIC_EPSG = {4326, 4979, 4258, 4937, 4269, 4283, 7844, 4167, 4617, 6318, 4612, 6668, 4490}
+
+# Rows read before giving up when none of them parses (wrong delimiter or columns)
+FAIL_FAST_ROWS = 1000
+
+def parse_columns(spec: str) -> List[str]:
+    """
+    One code per CSV column from an importReference columns string ("nxyzXYZ").
+    Raises ValueError for codes Metashape does not know, repeated codes, or a
+    spec without a label or without x/y.
+    """
+    cols = [c for c in spec if c not in GROUP_CODES]
+    unknown = sorted({c for c in cols if c not in COLUMN_CODES})
+    if unknown:
+        raise ValueError(f"reference.columns '{spec}': unknown column code(s) {', '.join(unknown)} "
+                         f"(valid: {COLUMN_CODES})")
+    dup = sorted({c for c in cols if cols.count(c) > 1})
+    if dup:
+        raise ValueError(f"reference.columns '{spec}': repeated column code(s) {', '.join(dup)}")
+    if "n" not in cols or "x" not in cols or "y" not in cols:
+        raise ValueError(f"reference.columns '{spec}': needs a label (n) and x/y coordinates")
+    return cols
+
+def _epsg_code(crs: str) -> Optional[int]:
+    m = re.search(r"(\d+)\s*$", crs or "")
+    return int(m.group(1)) if m else None
+
+def _rows(path: str, delimiter: str, group: bool, skip: int) -> Iterator[Tuple[int, List[str]]]:
+    """
+    (line number, fields) for each data row, streamed. Blank lines and "#"
+    comments are skipped.
+    """
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        for _ in range(skip):
+            if not f.readline():
+                return
+        if group:
+            split = re.compile(re.escape(delimiter) + "+")
+            for n, line in enumerate(f, skip + 1):
+                line = line.strip("\r\n").strip(delimiter)
+                if line.strip() and not line.lstrip().startswith("#"):
+                    yield n, split.split(line)
+            return
+        reader = csv.reader(f, delimiter=delimiter)
+        for row in reader:
+            if row and row[0].strip() and not row[0].lstrip().startswith("#"):
+                yield reader.line_num + skip, row
+
+def _sniff_delimiter(path: str, skip: int, need: int) -> str:
+    """
+    The common delimiter that splits the first data row into at least `need` fields.
+    """
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        lines = [l for l in f.read(1 << 16).splitlines()[skip:] if l.strip() and not l.lstrip().startswith("#")]
+    if not lines:
+        return ""
+    for d in (",", ";", "\t", " "):
+        if len([x for x in lines[0].split(d) if x.strip()]) >= need:
+            return d
+    return ""
+
+def _label_index(photos: Sequence[str]) -> Dict[str, str]:
+    """
+    Photo path by the labels a reference row may use: file name with or
+    without extension, as written or case-folded.
+    """
+    idx: Dict[str, str] = {}
+    for p in photos:
+        name = os.path.basename(p)
+        for key in (name, os.path.splitext(name)[0]):
+            idx.setdefault(key, p)
+            idx.setdefault(key.casefold(), p)
+    return idx
+
+def _metres(x: Any, y: Any, geographic: bool) -> Tuple[Any, Any]:
+    if not geographic:
+        return x, y
+    lat0 = float(np.nanmedian(y))
+    return (x - np.nanmedian(x)) * 111320.0 * math.cos(math.radians(lat0)), (y - np.nanmedian(y)) * 110540.0
+
+def _outliers(values: Dict[str, Any], geographic: bool, cfg: Dict[str, Any]) -> Any:
+    """
+    Rows whose x, y or z is further than outlier_mad robust deviations (and
+    at least min_outlier_m metres) from the median of the file.
+    """
+    k = float(cfg.get("outlier_mad", 8))
+    floor = float(cfg.get("min_outlier_m", 50))
+    n = len(values["x"])
+    out = np.zeros(n, dtype=bool)
+    if k <= 0 or n < 5:
+        return out
+    x, y = _metres(values["x"], values["y"], geographic)
+    for a in (x, y, values.get("z")):
+        if a is None:
+            continue
+        dev = np.abs(a - np.median(a))
+        mad = 1.4826 * float(np.median(dev))
+        out |= dev > max(k * mad, floor)
+    return out
+
+def _gps_check(values: Dict[str, Any], matched: Sequence[str], index: Any,
+               cfg: Dict[str, Any], errors: List[str], warnings: List[str]) -> None:
+    """
+    Lon/lat references against the EXIF GPS of the same photos: catches swapped
+    x/y columns and references in another datum or CRS.
+    """
+    rows = [i for i, p in enumerate(matched) if p]
+    hit = np.array([index.find(matched[i]) for i in rows], dtype=np.int64)
+    keep = hit >= 0
+    rows, hit = np.asarray(rows, dtype=np.int64)[keep], hit[keep]
+    if not len(rows):
+        return
+    lon, lat = index["lon"][hit], index["lat"][hit]
+    ok = ~(np.isnan(lon) | np.isnan(lat))
+    if ok.sum() < 3:
+        return
+    x, y = values["x"][rows][ok], values["y"][rows][ok]
+    lon, lat = lon[ok], lat[ok]
+    direct = float(np.median(np.abs(x - lon) + np.abs(y - lat)))
+    swapped = float(np.median(np.abs(y - lon) + np.abs(x - lat)))
+    if swapped * 10.0 < direct:
+        errors.append("x and y look swapped against the photos' EXIF GPS (check reference.columns)")
+        return
+    dx = (x - lon) * 111320.0 * np.cos(np.radians(lat))
+    dy = (y - lat) * 110540.0
+    off = float(np.median(np.hypot(dx, dy)))
+    limit = float(cfg.get("max_gps_offset_m", 100))
+    if limit > 0 and off > limit:
+        warnings.append(f"reference positions are {off:.0f} m from the EXIF GPS (median); "
+                        f"wrong CRS or datum?")
+
+def validate_reference(ref_cfg: Dict[str, Any], photos: Sequence[str], crs: str = "", index: Any = None,
+                       out_path: str = "") -> Dict[str, Any]:
+    """
+    Stream the reference CSV once, check it against the columns spec, the CRS
+    and the photo set, and (with out_path) write a cleaned copy for
+    importReference. Returns a report with "errors" (the run should stop),
+    "warnings", counts and, when a cleaned file was written, "config": the
+    reference config to import it with.
+    """
+    cfg = ref_cfg.get("validate", {})
+    path = ref_cfg.get("path", "")
+    if not path or not os.path.isfile(path):
+        raise ValueError(f"reference.path not found: {path}")
+    spec = ref_cfg.get("columns", "")
+    if not spec:
+        raise ValueError("reference.validate needs reference.columns (e.g. \"nxyz\")")
+    cols = parse_columns(spec)
+    delimiter = ref_cfg.get("delimiter", ",") or ","
+    group = bool(ref_cfg.get("group_delimiters", False))
+    skip = int(ref_cfg.get("skip_rows", 0))
+    crs = ref_cfg.get("crs_epsg", "") or crs
+
+    label_at = cols.index("n")
+    num = [(j, c) for j, c in enumerate(cols) if c not in "no"]
+    labels: List[str] = []
+    flat = array("d")
+    lines = array("l")
+    bad, bad_examples, seen = 0, [], 0
+    for line_no, row in _rows(path, delimiter, group, skip):
+        seen += 1
+        try:
+            if len(row) < len(cols):
+                raise ValueError(f"{len(row)} field(s), columns '{spec}' need {len(cols)}")
+            nums = [float(row[j]) for j, _ in num]
+        except ValueError as e:
+            bad += 1
+            if len(bad_examples) < 5:
+                bad_examples.append(f"line {line_no}: {e}")
+            if seen >= FAIL_FAST_ROWS and not labels:
+                break
+            continue
+        labels.append(row[label_at].strip())
+        flat.extend(nums)
+        lines.append(line_no)
+
+    # One row per reference, one column per numeric code; NaN/inf rows count as unreadable
+    m = np.frombuffer(flat, dtype=np.float64).reshape(-1, len(num)) if labels else np.zeros((0, len(num)))
+    finite = np.isfinite(m).all(axis=1)
+    if not finite.all():
+        for i in np.flatnonzero(~finite)[:max(0, 5 - len(bad_examples))]:
+            bad_examples.append(f"line {lines[i]}: non-finite value")
+        bad += int((~finite).sum())
+        labels = [l for l, ok in zip(labels, finite) if ok]
+        lines = array("l", np.asarray(lines)[finite].tolist())
+        m = m[finite]
+
+    errors: List[str] = []
+    warnings: List[str] = []
+    report: Dict[str, Any] = {"path": path, "rows": seen, "bad_rows": bad, "errors": errors, "warnings": warnings}
+    if not labels:
+        hint = _sniff_delimiter(path, skip, len(cols))
+        errors.append(f"no readable rows in {path} ({'; '.join(bad_examples[:2]) or 'empty file'})"
+                      + (f"; the file looks {hint!r}-delimited, not {delimiter!r}" if hint and hint != delimiter else ""))
+        return report
+    if bad:
+        msg = f"{bad} of {seen} rows unreadable: " + "; ".join(bad_examples)
+        (errors if bad > float(cfg.get("max_bad_rows", 0.01)) * seen else warnings).append(msg)
+
+    v = {c: m[:, k] for k, (_, c) in enumerate(num)}
+    n = len(labels)
+
+    # CRS: lon/lat degrees vs projected metres
+    code = _epsg_code(crs)
+    geographic = code in GEOGRAPHIC_EPSG
+    in_range = (np.abs(v["x"]) <= 180.0) & (np.abs(v["y"]) <= 90.0)
+    if code is not None and geographic:
+        if not in_range.all() and (np.abs(v["y"]) <= 90.0).mean() < 0.5 <= (np.abs(v["x"]) <= 90.0).mean():
+            errors.append("x and y look swapped: y is outside +-90 while x is not (check reference.columns)")
+        elif in_range.mean() < 0.99:
+            errors.append(f"{int((~in_range).sum())} rows are not lon/lat degrees but crs is {crs} "
+                          f"(check crs_epsg and columns)")
+    elif code is not None and in_range.all() and np.ptp(v["x"]) < 1.0 and np.ptp(v["y"]) < 1.0:
+        errors.append(f"coordinates look like lon/lat degrees but crs {crs} is projected (check crs_epsg)")
+    for c in "XYZ":
+        if c in v and (v[c] <= 0).any():
+            warnings.append(f"{int((v[c] <= 0).sum())} rows with accuracy {c} <= 0")
+
+    # Labels against the photos, through a hash index of photo names
+    idx = _label_index(photos)
+    matched = [idx.get(l) or idx.get(l.casefold()) or "" for l in labels]
+    n_matched = sum(1 for p in matched if p)
+    report.update(labels=n, matched=n_matched, unmatched=n - n_matched,
+                  photos_without_reference=len(set(photos) - set(matched)))
+    items = str(ref_cfg.get("items", "ReferenceItemsAll"))
+    if photos and "Markers" not in items:
+        min_frac = float(cfg.get("min_matched_fraction", 0.5))
+        if n_matched == 0:
+            errors.append(f"no reference label matches a photo (e.g. '{labels[0]}')")
+        elif n_matched < min_frac * min(n, len(photos)):
+            errors.append(f"only {n_matched} of {n} reference labels match a photo")
+        elif n_matched < n and "Cameras" in items:
+            warnings.append(f"{n - n_matched} reference labels match no photo, e.g. "
+                            + ", ".join(l for l, p in zip(labels, matched) if not p)[:200])
+    uniq, counts = np.unique(np.array(labels), return_counts=True)
+    if (counts > 1).any():
+        warnings.append(f"{int((counts > 1).sum())} labels appear more than once, e.g. {uniq[counts > 1][0]}")
+
+    if geographic and index is not None and n_matched:
+        _gps_check(v, matched, index, cfg, errors, warnings)
+
+    outliers = _outliers(v, geographic, cfg) if not errors else np.zeros(n, dtype=bool)
+    report["outliers"] = int(outliers.sum())
+    if outliers.any():
+        ex = ", ".join(labels[i] for i in np.flatnonzero(outliers)[:5])
+        drop = bool(cfg.get("drop_outliers", True))
+        warnings.append(f"{int(outliers.sum())} coordinate outliers{' dropped' if drop else ''}: {ex}")
+        if not drop:
+            outliers[:] = False
+
+    if out_path and not errors:
+        keep = set(np.asarray(lines)[~outliers].tolist())
+        os.makedirs(os.path.dirname(out_path) or ".", exist_ok=True)
+        tmp = out_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8", newline="") as f:
+            w = csv.writer(f, lineterminator="\n")
+            w.writerow(["#" + cols[0]] + cols[1:])
+            for line_no, row in _rows(path, delimiter, group, skip):
+                if line_no in keep:
+                    w.writerow([x.strip() for x in row[:len(cols)]])
+        os.replace(tmp, out_path)
+        report["written"] = len(keep)
+        report["config"] = dict(ref_cfg, path=out_path, columns="".join(cols), delimiter=",",
+                                group_delimiters=False, skip_rows=1)
+    return report
+
+def reference_summary(report: Dict[str, Any]) -> str:
+    s = f"{report.get('labels', 0)} rows"
+    if "matched" in report:
+        s += f", {report['matched']} match photos, {report['photos_without_reference']} photos without reference"
+    if report.get("outliers"):
+        s += f", {report['outliers']} outliers"
+    if "written" in report:
+        s += f"; cleaned file {report['config']['path']} ({report['written']} rows)"
+    return s
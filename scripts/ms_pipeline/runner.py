@@ -0,0 +1,470 @@
+from __future__ import annotations
+import os
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from .artifacts import DEFAULT_ARTIFACTS
+from .blocks import merged_label, split_and_build, update_blocks
+from .dag import StepSpec, chains, dependants, run_graph
+from .exports import export_products
+from .incremental import add_new_photos, align_new, depth_maps_new, diff_photos, save_inputs
+from .masks import apply_masks
+from .metrics import InstrumentedChunk, measure, unwrap
+from .multichunk import align_groups
+from .preflight import disable_cameras
+from .qc import failed_gates, qc_report, qc_snapshot, summary, write_report
+from .staging import relink
+from .steps import filter_tie_points, import_reference_if_any, set_chunk_crs
+from .workers import run_jobs, write_job
+
+# Graph nodes the runner handles itself (they need the document, not just a chunk)
+RUNNER_STEPS = {
+    "setup": StepSpec("setup", None, (), ("photos",), ()),
+    # Dense products per spatial block, merged (ms_pipeline.blocks)
+    "blocks": StepSpec("blocks", None, ("alignment",), ("depth_maps", "point_cloud", "dem", "orthomosaic"),
+                       ("build_depth_maps", "build_point_cloud", "build_dem", "build_orthomosaic", "split_blocks")),
+    # Photo groups aligned as separate chunks, then aligned to each other and merged (ms_pipeline.multichunk)
+    "align_groups": StepSpec("align_groups", None, ("photos",), ("alignment",),
+                             ("match_photos", "align_cameras", "optimize_cameras", "multi_chunk")),
+}
+
+class Graph(NamedTuple):
+    nodes: Dict[str, Any]       # id -> dag.Node
+    deps: Dict[str, List[str]]
+    order: List[str]            # topological order
+    keys: Dict[str, str]        # node keys: own parameters plus the keys upstream
+    params: Dict[str, str]      # own parameter hashes (the incremental gate compares these)
+
+class SetupInputs(NamedTuple):
+    """
+    What the setup node adds to the chunk, with the paths Metashape reads
+    (the staged copies when input.staging is on).
+    """
+    photos: List[str]
+    rejected: Dict[str, Any]        # preflight rejections to disable (empty with action "drop")
+    masks: Dict[str, Any]           # mask records by photo
+    groups: Dict[str, List[str]]    # multi-chunk photo groups
+    crs_epsg: str
+    reference: Dict[str, Any]       # reference import config (the validated copy when checked)
+    staged: Dict[str, str]          # source path -> staged copy
+
+def find_chunk(doc: Any, label: str) -> Any:
+    for c in getattr(doc, "chunks", []) or []:
+        if c.label == label:
+            return c
+    return None
+
+class GraphRunner:
+    """
+    Runs the stage graph of one workflow on an open document.
+
+    Nodes whose checkpoint key is current are skipped; stale ones run in this
+    process or, with max_parallel > 1, as linear chains in worker processes
+    (setup, blocks and align_groups always run here). Each finished node saves
+    the project and is recorded in the checkpoint. With an artifact cache the
+    deepest stale cacheable node is restored instead of run, and outputs of
+    cacheable nodes are stored. QC runs once the alignment is final and before
+    the first export.
+    """
+
+    def __init__(self, Metashape: Any, doc: Any, chunk: Any, graph: Graph, inputs: SetupInputs,
+                 cfg: Dict[str, Any], log: Any, proj_path: str = "", ckpt: Any = None, incremental: bool = False,
+                 static: str = "", stamps: Optional[Dict[str, Any]] = None, cache: Any = None,
+                 recorder: Any = None, monitor: Any = None, qc_path: str = "", workflow_name: str = "workflow"):
+        self.Metashape = Metashape
+        self.doc = doc
+        self.chunk = chunk
+        self.chunk_label = chunk.label
+        self.nodes, self.deps, self.order, self.keys, self.params = graph
+        self.down = dependants(self.deps)
+        self.inputs = inputs
+        self.sources = {v: k for k, v in inputs.staged.items()}
+        self.cfg = cfg
+        self.log = log
+        self.proj_path = proj_path
+        self.ckpt = ckpt
+        self.done = ckpt.stages if ckpt is not None else {}
+        self.incremental = incremental
+        self.static = static
+        self.stamps = stamps or {}
+        self.cache = cache
+        self.recorder = recorder
+        self.monitor = monitor
+        self.qc_cfg = cfg.get("qc", {})
+        self.qc_path = qc_path
+        self.qc_reports: List[Dict[str, Any]] = []
+        self.workflow_name = workflow_name
+        self.workers_cfg = cfg.get("workers", {})
+        artifacts = set(cfg.get("cache", {}).get("artifacts", DEFAULT_ARTIFACTS))
+        self.cacheable = {i for i, n in self.nodes.items() if cache is not None and n.step not in ("setup", "export")
+                          and artifacts & set(n.provides)}
+        # Where each node's output lives: ("", label) in this document or (project, label)
+        self.loc: Dict[str, Any] = {}
+        self.rerun: set = set()
+        self.new_cams: List[int] = []
+        self.qc_logged = False
+        self.cache_hit: Dict[str, Any] = {}
+
+    # Node state
+
+    def wrap(self, c: Any) -> Any:
+        if (self.recorder is None and self.monitor is None) or isinstance(c, InstrumentedChunk):
+            return c
+        return InstrumentedChunk(c, self.recorder, self.monitor)
+
+    def source(self, i: str) -> Any:
+        d = self.deps[i]
+        if not d:
+            return "", self.chunk_label
+        return self.loc[max(d, key=self.order.index)]
+
+    def recorded(self, i: str) -> Any:
+        rec = self.done.get(i, {})
+        label = rec.get("chunk", "")
+        if not label:
+            # Manifests from before the graph runner did not record the chunk
+            merge = (self.nodes[i].step == "blocks"
+                     and self.cfg.get("processing", {}).get("split_blocks", {}).get("merge", True))
+            label = merged_label(self.chunk_label) if merge else self.chunk_label
+        return rec.get("project", ""), label
+
+    def up_to_date(self, i: str) -> bool:
+        rec = self.done.get(i, {})
+        if self.incremental or rec.get("key") != self.keys[i] or any(d in self.rerun for d in self.deps[i]):
+            return False
+        project, label = self.recorded(i)
+        if project:
+            return os.path.isfile(project)
+        return find_chunk(self.doc, label) is not None
+
+    def descendants(self, i: str) -> List[str]:
+        out, todo = [], list(self.down[i])
+        while todo:
+            x = todo.pop()
+            if x not in out:
+                out.append(x)
+                todo.extend(self.down[x])
+        return out
+
+    def local_chunk(self, i: str) -> Any:
+        project, label = self.source(i)
+        doc = self.doc
+        if project:
+            # Output of a worker node: bring its chunk into this document
+            c = find_chunk(doc, label)
+            if c is not None:
+                doc.remove([c])
+            doc.append(project)
+            c = doc.chunks[-1]
+            c.label = label
+            relink([c], self.inputs.staged)
+            return self.wrap(c)
+        return self.wrap(find_chunk(doc, label) if label != self.chunk_label else self.chunk)
+
+    def _mark(self, i: str, label: str, project: str = "") -> None:
+        info = {"static": self.static} if i == "setup" else {}
+        if i == "setup":
+            save_inputs(self.proj_path, self.stamps)
+        self.ckpt.mark(i, self.keys[i], params=self.params[i], chunk=label, project=project, **info)
+
+    def save_node(self, i: str, label: str, project: str = "") -> None:
+        self.loc[i] = (project, label)
+        if not self.proj_path:
+            return
+        if not project:
+            os.makedirs(os.path.dirname(self.proj_path), exist_ok=True)
+            self.log.info(f"Saving project: {self.proj_path}")
+            self.doc.save(self.proj_path)
+        if self.ckpt is not None:
+            self._mark(i, label, project)
+
+    # Artifact cache
+
+    def find_cache_hit(self) -> None:
+        """
+        The deepest stale node with a cached output is restored instead of
+        run, and the stale nodes before it are not needed.
+        """
+        if self.cache is None:
+            return
+        for i in reversed(self.order):
+            if self.up_to_date(i):
+                return
+            rec = self.cache.get(self.keys[i]) if i in self.cacheable else None
+            if rec is not None:
+                self.cache_hit = {"node": i, "rec": rec, "ok": None,
+                                  "skip": [j for j in self.order[:self.order.index(i)] if not self.up_to_date(j)]}
+                return
+
+    def restore(self, i: str, rec: Dict[str, Any]) -> bool:
+        """
+        Replace node i's output chunk with the cached one and record i, and
+        the stale nodes before it, as done.
+        """
+        doc, log = self.doc, self.log
+        label = rec["label"]
+        old = self.chunk if label == self.chunk_label else find_chunk(doc, label)
+        try:
+            measure(self.recorder, "cache_restore", None, doc.append, rec["path"])
+        except Exception as e:
+            log.warn(f"Artifact cache: cannot restore {i} ({type(e).__name__}: {e}), running it")
+            self.cache.drop(self.keys[i])
+            return False
+        c = doc.chunks[-1]
+        if old is not None:
+            doc.remove([old])
+        c.label = label
+        relink([c], self.sources)
+        relink([c], self.inputs.staged)
+        if label == self.chunk_label:
+            self.chunk = c
+        log.info(f"Stage {i}: restored from the artifact cache ({rec['path']})")
+        self.rerun.add(i)
+        if self.ckpt is not None:
+            self.ckpt.invalidate([i] + self.descendants(i))
+        self.save_node(i, label)
+        for j in self.cache_hit["skip"]:
+            # The restored chunk holds their results too (unless it is a separate merged chunk)
+            self.loc[j] = ("", label)
+            if self.ckpt is not None and label == self.chunk_label:
+                self._mark(j, label)
+        return True
+
+    def store(self, i: str) -> None:
+        project, label = self.loc[i]
+        try:
+            # Entries point at the source photos: staged copies may be gone when they are restored
+            rec = measure(self.recorder, "cache_store", None, self.cache.put, self.Metashape, self.keys[i],
+                          project or self.proj_path, label, prepare=lambda c: relink([c], self.sources),
+                          node=i, workflow=self.workflow_name)
+        except Exception as e:
+            self.log.warn(f"Artifact cache: could not store {i} ({type(e).__name__}: {e})")
+            return
+        if rec is None:
+            self.log.warn(f"Artifact cache: output of {i} is larger than cache.max_gb, not stored")
+        else:
+            self.log.info(f"Artifact cache: stored {i} ({rec['size'] / 1e9:.2f} GB)")
+
+    # QC
+
+    def run_qc(self, c: Any, when: str) -> Optional[Dict[str, Any]]:
+        c = unwrap(c)
+        if not self.qc_cfg.get("enabled", True):
+            self.log.info(f"QC: {qc_snapshot(c)}")
+            return None
+        report = measure(self.recorder, "qc", None, qc_report, self.Metashape, c, self.qc_cfg, when)
+        self.qc_reports.append(report)
+        write_report(self.qc_path, self.qc_reports, workflow=self.workflow_name, chunk=self.chunk_label)
+        (self.log.info if report["passed"] else self.log.warn)(f"QC {when}: {summary(report)}")
+        return report
+
+    def log_qc(self, c: Any) -> None:
+        if not self.qc_logged:
+            self.qc_logged = True
+            self.run_qc(c, "before export")
+
+    def qc_gate(self, i: str) -> None:
+        """
+        QC after alignment; with qc.abort_on_fail a failed gate stops the run
+        before the dense stages.
+        """
+        project, label = self.loc[i]
+        if project or not self.qc_cfg.get("enabled", True):
+            return
+        report = self.run_qc(self.chunk if label == self.chunk_label else find_chunk(self.doc, label), f"after {i}")
+        dense = [d for d in self.order if d in self.descendants(i) and self.nodes[d].step != "export"]
+        if not report["passed"] and dense and self.qc_cfg.get("abort_on_fail", False):
+            raise RuntimeError(f"QC gates failed after {i}, not running {', '.join(dense)}: "
+                               + "; ".join(failed_gates(report)) + f" (report: {self.qc_path})")
+
+    # Execution
+
+    def _setup(self, c: Any) -> None:
+        Metashape, log, inp = self.Metashape, self.log, self.inputs
+        if self.incremental:
+            new, missing = diff_photos(c, inp.photos)
+            if missing:
+                log.warn(f"Incremental: {len(missing)} cameras have no photo on disk any more; keeping them")
+            self.new_cams.extend(add_new_photos(c, new))
+            added = [c.cameras[k] for k in self.new_cams]
+            if inp.rejected:
+                log.info(f"Preflight: disabled {disable_cameras(c, inp.rejected, added)} new cameras")
+            if inp.masks:
+                log.info(f"Masks: applied to {apply_masks(Metashape, added, inp.masks)} new cameras")
+            if added and inp.reference.get("enabled", False):
+                # Matched by label: existing cameras get the same values again
+                log.info("Importing reference data...")
+                import_reference_if_any(Metashape, c, inp.reference)
+            log.info(f"Incremental: {len(self.new_cams)} new photos, {len(c.cameras) - len(self.new_cams)} existing")
+            return
+        c.addPhotos(inp.photos)
+        if inp.rejected:
+            log.info(f"Preflight: disabled {disable_cameras(c, inp.rejected)} cameras")
+        if inp.masks:
+            log.info(f"Masks: applied to {apply_masks(Metashape, c.cameras, inp.masks)} cameras")
+
+        # CRS (optional)
+        if inp.crs_epsg:
+            log.info(f"Setting CRS: {inp.crs_epsg}")
+            set_chunk_crs(Metashape, c, inp.crs_epsg)
+
+        # Optional reference import (camera/GCP CSV etc)
+        if inp.reference.get("enabled", False):
+            log.info("Importing reference data...")
+            import_reference_if_any(Metashape, c, inp.reference)
+
+    def run_node(self, i: str, c: Any) -> Any:
+        """
+        Run one node on chunk c; returns the chunk later nodes should use if it changed.
+        """
+        Metashape, doc, log = self.Metashape, self.doc, self.log
+        node = self.nodes[i]
+        incremental = self.incremental
+        if node.step == "setup":
+            self._setup(c)
+        elif node.step == "blocks" and incremental:
+            return update_blocks(Metashape, doc, c, node.cfg, self.proj_path, self.new_cams, log, wrap=self.wrap,
+                                 workers_cfg=self.workers_cfg)
+        elif node.step == "blocks":
+            return split_and_build(Metashape, doc, c, node.cfg, self.proj_path, log, wrap=self.wrap,
+                                   workers_cfg=self.workers_cfg)
+        elif node.step == "align_groups":
+            return align_groups(Metashape, doc, c, self.inputs.groups, node.cfg, self.proj_path, log, wrap=self.wrap,
+                                workers_cfg=self.workers_cfg)
+        elif node.step == "align" and incremental:
+            align_new(Metashape, c, node.cfg)
+        elif node.step == "filter_tie_points":
+            filter_tie_points(Metashape, c, node.cfg, log=log)
+        elif node.step == "depth_maps" and incremental:
+            depth_maps_new(Metashape, c, node.cfg)
+        elif node.step == "export":
+            # The project was saved after the node this exports; workers open it read-only
+            project, label = self.source(i)
+            project = project or (self.proj_path if self.proj_path and os.path.isfile(self.proj_path) else "")
+            export_products(Metashape, c, node.cfg, log=log, project=project, chunk_label=label,
+                            key=self.keys[i], workers_cfg=self.workers_cfg)
+        elif node.fn is not None:
+            node.fn(Metashape, c, node.cfg)
+        return None
+
+    def run_here(self, i: str) -> None:
+        self.execute(i)
+        # QC once the alignment is final (after align, or after tie point filtering)
+        if ("alignment" in self.nodes[i].provides
+                and not any("alignment" in self.nodes[d].provides for d in self.down[i])):
+            self.qc_gate(i)
+
+    def execute(self, i: str) -> None:
+        node, hit, log = self.nodes[i], self.cache_hit, self.log
+        if i == hit.get("node") or i in hit.get("skip", ()):
+            if hit["ok"] is None:
+                hit["ok"] = self.restore(hit["node"], hit["rec"])
+            if hit["ok"]:
+                if i != hit["node"]:
+                    log.info(f"Stage {i}: not needed, {hit['node']} comes from the artifact cache")
+                return
+        if self.up_to_date(i):
+            self.loc[i] = self.recorded(i)
+            if node.step == "export" and not self.loc[i][0]:
+                self.log_qc(self.local_chunk(i))
+            log.info(f"Stage {i}: up to date, skipping")
+            return
+        self.rerun.add(i)
+        if self.ckpt is not None:
+            self.ckpt.invalidate([i] + self.descendants(i))
+        c = self.local_chunk(i)
+        if node.step == "export":
+            # QC snapshot
+            self.log_qc(c)
+        if self.incremental and i != "setup" and not self.new_cams:
+            # Nothing new to add: products are unchanged, only record the new keys
+            log.info(f"Stage {i}: no new photos, skipping")
+            self.save_node(i, c.label)
+            return
+        log.bind(stage=i)
+        log.info(f"Stage {i}: running")
+        if self.recorder is not None:
+            self.recorder.stage = i
+        if self.monitor is not None:
+            self.monitor.stage = i
+        new_chunk = measure(self.recorder, "stage", c, self.run_node, i, c)
+        self.save_node(i, (new_chunk if new_chunk is not None else c).label)
+        if i in self.cacheable:
+            self.store(i)
+        log.bind(stage=None)
+
+    def run_worker(self, ids: List[str]) -> None:
+        """
+        Run a chain of nodes in a headless Metashape process on a copy of the
+        chunk it starts from (exports only read it).
+        """
+        log = self.log
+        # Up-to-date nodes at the head of the chain are reused from their project
+        while ids and self.up_to_date(ids[0]):
+            self.loc[ids[0]] = self.recorded(ids[0])
+            log.info(f"Stage {ids[0]}: up to date, skipping")
+            ids = ids[1:]
+        if not ids:
+            return
+        self.rerun.update(ids)
+        if self.ckpt is not None:
+            self.ckpt.invalidate(ids + [d for i in ids for d in self.descendants(i)])
+        project, label = self.source(ids[0])
+        base = os.path.splitext(self.proj_path)[0] + "_graph"
+        exports_only = all(self.nodes[i].step == "export" for i in ids)
+        # Named after the first node run, so it never overwrites the project it reads
+        out = "" if exports_only else os.path.join(base, ids[0] + ".psx")
+        log.info(f"Stages {', '.join(ids)}: running in a worker")
+        job = write_job(os.path.join(base, ids[0] + ".job.json"), {
+            "kind": "steps",
+            "project": project or self.proj_path,
+            "chunk_label": label,
+            "label": f"{self.chunk_label} [{ids[-1]}]" if out else label,
+            "out_project": out,
+            "nodes": [{"id": i, "step": self.nodes[i].step, "cfg": self.nodes[i].cfg} for i in ids],
+        })
+        result = run_jobs([job], self.workers_cfg, 1, log)[0]
+        for i in ids:
+            self.save_node(i, result["label"], result.get("project", "") or project)
+
+    def run(self, max_parallel: int = 1) -> None:
+        """
+        Run every node. Units of work are single nodes in this process, or
+        with max_parallel > 1 linear chains where everything but the runner's
+        own steps runs in worker processes.
+        """
+        nodes, deps, down, order = self.nodes, self.deps, self.down, self.order
+        self.find_cache_hit()
+        if max_parallel > 1:
+            units = {c[-1]: c for c in chains(order, deps)}
+            inline = {u for u, c in units.items() if any(nodes[i].step in RUNNER_STEPS for i in c)}
+        else:
+            units = {i: [i] for i in order}
+            inline = set(units)
+        unit_of = {i: u for u, c in units.items() for i in c}
+        unit_deps = {u: sorted({unit_of[d] for d in deps[c[0]]}) for u, c in units.items()}
+
+        def run_unit(u: str) -> None:
+            if u in inline:
+                for i in units[u]:
+                    self.run_here(i)
+            else:
+                self.run_worker(units[u])
+
+        run_graph(list(units), unit_deps, run_unit, max_parallel, inline=inline)
+
+        # Final products of worker chains (nothing but exports downstream) go back into this document
+        doc = self.doc
+        leaves = [u for u in units if u not in inline and self.loc[u][0]
+                  and any(nodes[i].step != "export" for i in units[u])
+                  and all(nodes[d].step == "export" for d in down[u])
+                  and (u in self.rerun or find_chunk(doc, self.loc[u][1]) is None)]
+        if leaves:
+            for u in leaves:
+                project, label = self.loc[u]
+                old = find_chunk(doc, label)
+                if old is not None:
+                    doc.remove([old])
+                doc.append(project)
+                doc.chunks[-1].label = label
+                self.log.info(f"Added '{label}' from {project}")
+            doc.save(self.proj_path)
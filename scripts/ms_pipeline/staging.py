@@ -0,0 +1,396 @@
+from __future__ import annotations
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, ContextManager, Dict, List, Optional, Sequence, Tuple
+
+from .artifacts import index_lock
+from .checkpoint import config_hash
+from .metrics import measure
+from .photos import PhotoEntry
+
+INDEX_VERSION = 1
+
+# Read/write buffer for copies; also the bandwidth limiter's granularity
+COPY_BUFFER = 4 * 1024 * 1024
+
+class Throttle:
+    """
+    Shared bandwidth limit for the copy threads (0 = unlimited).
+    """
+
+    def __init__(self, bytes_per_s: float):
+        self.rate = float(bytes_per_s)
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def take(self, n: int) -> None:
+        if self.rate <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(self._next, now)
+            self._next = start + n / self.rate
+            wait = start - now
+        if wait > 0:
+            time.sleep(wait)
+
+def _sha256(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for buf in iter(lambda: f.read(COPY_BUFFER), b""):
+            h.update(buf)
+    return h.hexdigest()
+
+def copy_photo(src: str, dst: str, entry: Tuple[str, int, int], verify: str, throttle: Optional[Throttle] = None,
+               on_bytes: Callable[[int], None] = lambda n: None) -> str:
+    """
+    Copy src to dst through a .part file, keeping the source mtime so cache
+    fingerprints stay valid. verify "size" compares the length, "checksum"
+    also hashes the source while reading and the written copy afterwards.
+    Returns the checksum ("" unless verified by checksum).
+    """
+    _, size, mtime_ns = entry
+    tmp = dst + ".part"
+    h = hashlib.sha256() if verify == "checksum" else None
+    try:
+        with open(src, "rb") as fi, open(tmp, "wb") as fo:
+            for buf in iter(lambda: fi.read(COPY_BUFFER), b""):
+                if throttle is not None:
+                    throttle.take(len(buf))
+                if h is not None:
+                    h.update(buf)
+                fo.write(buf)
+                on_bytes(len(buf))
+        if verify != "none" and os.path.getsize(tmp) != size:
+            raise OSError(f"size mismatch after copy ({os.path.getsize(tmp)} != {size} bytes)")
+        digest = h.hexdigest() if h is not None else ""
+        if h is not None and _sha256(tmp) != digest:
+            raise OSError("checksum mismatch after copy")
+        os.utime(tmp, ns=(mtime_ns, mtime_ns))
+        os.replace(tmp, dst)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    return digest
+
+class PhotoStage:
+    """
+    Local copies of the input photos for one run. Metashape reads every image
+    again in matching, depth maps and texturing; from a network share that is
+    tens of GB per pass. Photos are copied (or hard-linked when mode is
+    "hardlink" and the scratch disk allows it) into
+
+        <scratch_dir>/<photo dir name>-<hash of its path>/<path below the photo dir>
+
+    with `workers` threads and an optional total bandwidth limit. Free space
+    is checked before anything is copied. A copy whose size and mtime match
+    the source is reused, so with keep=True a repeated run of the same site
+    only copies new or changed photos; index.json records when each file was
+    last used and the least recently used ones are deleted beyond max_gb.
+    Without keep the run's copies are deleted by finish().
+    """
+
+    def __init__(self, scratch_dir: str, cfg: Dict[str, Any], log: Any = None):
+        self.root = os.path.abspath(scratch_dir)
+        self.cfg = cfg
+        self.log = log
+        self.mode = cfg.get("mode", "copy")
+        if self.mode not in ("copy", "hardlink"):
+            raise ValueError(f"Unknown input.staging.mode: {self.mode}")
+        self.verify = cfg.get("verify", "size")
+        if self.verify not in ("none", "size", "checksum"):
+            raise ValueError(f"Unknown input.staging.verify: {self.verify}")
+        self.keep = bool(cfg.get("keep", False))
+        self.max_bytes = int(float(cfg.get("max_gb", 0)) * 1e9)
+        self.index_path = os.path.join(self.root, "index.json")
+        self.mapping: Dict[str, str] = {}
+        self._planned: List[str] = []
+        self.stats: Dict[str, Any] = {}
+        os.makedirs(self.root, exist_ok=True)
+
+    def local_path(self, path: str, roots: Sequence[str]) -> str:
+        path = os.path.abspath(path)
+        for r in roots:
+            if path.startswith(r + os.sep):
+                rel = os.path.relpath(path, r)
+                name = f"{os.path.basename(r) or 'photos'}-{config_hash(os.path.normcase(r))[:8]}"
+                return os.path.join(self.root, name, rel)
+        # Outside every photo dir (should not happen): keyed by its folder
+        return os.path.join(self.root, "other-" + config_hash(os.path.normcase(os.path.dirname(path)))[:8],
+                            os.path.basename(path))
+
+    def _load(self) -> Dict[str, Any]:
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return data.get("files", {}) if data.get("version") == INDEX_VERSION else {}
+
+    def _save(self, files: Dict[str, Any]) -> None:
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": INDEX_VERSION, "files": files}, f, separators=(",", ":"))
+        os.replace(tmp, self.index_path)
+
+    def _locked(self) -> ContextManager[None]:
+        return index_lock(os.path.join(self.root, "index.lock"))
+
+    def _rel(self, local: str) -> str:
+        return os.path.relpath(local, self.root).replace(os.sep, "/")
+
+    def _delete(self, files: Dict[str, Any], rels: Sequence[str]) -> int:
+        freed = 0
+        for rel in rels:
+            rec = files.pop(rel, {})
+            try:
+                os.remove(os.path.join(self.root, rel))
+                freed += int(rec.get("size", 0))
+            except OSError:
+                pass
+        return freed
+
+    def _evict(self, files: Dict[str, Any], nbytes: int, keep: Sequence[str]) -> List[str]:
+        """
+        Least recently used files, not used by this run, that free at least nbytes.
+        """
+        keep = set(keep)
+        out = []
+        for rel in sorted(files, key=lambda k: files[k].get("last_used", 0)):
+            if nbytes <= 0:
+                break
+            if rel in keep:
+                continue
+            nbytes -= int(files[rel].get("size", 0))
+            out.append(rel)
+        return out
+
+    def _store_bytes(self, files: Dict[str, Any]) -> int:
+        return sum(int(r.get("size", 0)) for r in files.values())
+
+    def _free(self) -> int:
+        return shutil.disk_usage(self.root).free
+
+    def stage(self, entries: Sequence[PhotoEntry], roots: Sequence[str],
+              progress: Optional[Callable[[float], None]] = None) -> Dict[str, str]:
+        """
+        Copy the photos to scratch; returns source path -> local path. Raises
+        if they do not fit (on_low_space "fail"); with on_low_space "source" an
+        empty mapping is returned and the run reads the photos in place.
+        """
+        roots = [os.path.abspath(r) for r in roots if r]
+        t0 = time.time()
+        plan = [(e, self.local_path(e.path, roots)) for e in entries]
+        todo = []
+        for e, local in plan:
+            try:
+                st = os.stat(local)
+                if st.st_size == e.size and st.st_mtime_ns == e.mtime_ns:
+                    continue
+            except OSError:
+                pass
+            todo.append((e, local))
+        need = sum(e.size for e, _ in todo) if self.mode == "copy" else 0
+        reserve = int(float(self.cfg.get("min_free_gb", 10)) * 1e9)
+
+        if self.keep:
+            # Make room by dropping photos of other runs, oldest use first
+            used = [self._rel(local) for _, local in plan]
+            with self._locked():
+                files = self._load()
+                over = self._store_bytes(files) + need - self.max_bytes if self.max_bytes > 0 else 0
+                evict = self._evict(files, max(over, need + reserve - self._free()), used)
+                freed = self._delete(files, evict)
+                self._save(files)
+            if evict and self.log is not None:
+                self.log.info(f"Staging: removed {len(evict)} least recently used photos ({freed / 1e9:.1f} GB)")
+        free = self._free()
+        if free < need + reserve:
+            msg = (f"needs {need / 1e9:.1f} GB + {reserve / 1e9:.0f} GB free on {self.root}, "
+                   f"{free / 1e9:.1f} GB available")
+            if self.cfg.get("on_low_space", "source") == "fail":
+                raise RuntimeError(f"Photo staging: {msg}")
+            if self.log is not None:
+                self.log.warn(f"Staging: {msg}; reading the photos from their source")
+            return {}
+
+        self._planned = [local for _, local in plan]
+        done_bytes = [0]
+        lock = threading.Lock()
+        total = max(1, sum(e.size for e, _ in todo))
+        counts = {"copied": 0, "linked": 0, "reused": len(plan) - len(todo), "bytes": 0}
+        checksums: Dict[str, str] = {}
+        throttle = Throttle(float(self.cfg.get("bandwidth_mb_s", 0)) * 1e6)
+        retries = int(self.cfg.get("retries", 2))
+
+        def on_bytes(n: int) -> None:
+            with lock:
+                done_bytes[0] += n
+                p = 100.0 * done_bytes[0] / total
+            if progress is not None:
+                progress(p)
+
+        def one(item: Tuple[PhotoEntry, str]) -> None:
+            e, local = item
+            os.makedirs(os.path.dirname(local), exist_ok=True)
+            if self.mode == "hardlink":
+                try:
+                    if os.path.lexists(local):
+                        os.remove(local)
+                    os.link(e.path, local)
+                    with lock:
+                        counts["linked"] += 1
+                    on_bytes(e.size)
+                    return
+                except OSError:
+                    pass
+            for attempt in range(retries + 1):
+                try:
+                    digest = copy_photo(e.path, local, e, self.verify, throttle, on_bytes)
+                    break
+                except OSError as err:
+                    if attempt == retries:
+                        raise OSError(f"cannot stage {e.path}: {err}") from err
+                    if self.log is not None:
+                        self.log.warn(f"Staging: retrying {e.path} ({err})")
+            with lock:
+                counts["copied"] += 1
+                counts["bytes"] += e.size
+                if digest:
+                    checksums[local] = digest
+
+        with ThreadPoolExecutor(max_workers=max(1, int(self.cfg.get("workers", 4)))) as pool:
+            list(pool.map(one, todo))
+        if progress is not None:
+            progress(100.0)
+
+        now = time.time()
+        with self._locked():
+            files = self._load()
+            for e, local in plan:
+                rel = self._rel(local)
+                rec = files.get(rel, {})
+                if local in checksums or rec.get("mtime_ns") != e.mtime_ns:
+                    rec = {"sha256": checksums.get(local, "")}
+                rec.update(source=e.path, size=e.size, mtime_ns=e.mtime_ns, last_used=now)
+                files[rel] = rec
+            self._save(files)
+
+        seconds = time.time() - t0
+        self.stats = dict(counts, photos=len(plan), seconds=round(seconds, 1),
+                          mb_s=round(counts["bytes"] / 1e6 / seconds, 1) if seconds > 0 else 0.0)
+        self.mapping = {e.path: local for e, local in plan}
+        return self.mapping
+
+    def finish(self) -> int:
+        """
+        End of run: without keep, delete this run's copies (returns the bytes
+        freed); with keep, trim the store to max_gb.
+        """
+        if not self._planned:
+            return 0
+        used = [self._rel(local) for local in self._planned]
+        with self._locked():
+            files = self._load()
+            if self.keep:
+                over = self._store_bytes(files) - self.max_bytes if self.max_bytes > 0 else 0
+                freed = self._delete(files, self._evict(files, over, used))
+            else:
+                for rel in used:
+                    files.setdefault(rel, {"size": 0})
+                freed = self._delete(files, used)
+            self._save(files)
+        if not self.keep:
+            for d in sorted({os.path.dirname(p) for p in self._planned}, key=len, reverse=True):
+                while d.startswith(self.root + os.sep):
+                    try:
+                        os.rmdir(d)
+                    except OSError:
+                        break
+                    d = os.path.dirname(d)
+        self._planned = []
+        self.mapping = {}
+        return freed
+
+def describe(stats: Dict[str, Any]) -> str:
+    s = (f"{stats['photos']} photos: {stats['copied']} copied, {stats['reused']} already staged"
+         + (f", {stats['linked']} hard-linked" if stats["linked"] else "")
+         + f"; {stats['bytes'] / 1e9:.2f} GB in {stats['seconds']:g} s")
+    if stats["bytes"]:
+        s += f" ({stats['mb_s']:g} MB/s)"
+    return s
+
+def relink(chunks: Sequence[Any], mapping: Dict[str, str]) -> int:
+    """
+    Point cameras at other photo files (staged copies, or back to the
+    sources with the inverted mapping). Returns the number of cameras changed.
+    """
+    n = 0
+    for chunk in chunks:
+        for cam in chunk.cameras:
+            photo = getattr(cam, "photo", None)
+            if photo is None or not photo.path:
+                continue
+            new = mapping.get(os.path.abspath(photo.path))
+            if new and new != photo.path:
+                photo.path = new
+                n += 1
+    return n
+
+def stage_photos(entries: Sequence[PhotoEntry], roots: Sequence[str], cfg: Dict[str, Any], scratch_dir: str,
+                 log: Any, cleanup: contextlib.ExitStack, recorder: Any = None, monitor: Any = None) -> Dict[str, str]:
+    """
+    Stage the photos of a run (input.staging); returns source path -> local
+    copy, empty when they are read in place. The stage is finished when
+    `cleanup` closes.
+    """
+    photo_stage = PhotoStage(scratch_dir, cfg, log)
+
+    def finish() -> None:
+        try:
+            freed = photo_stage.finish()
+        except Exception as e:
+            log.warn(f"Staging: cleanup of {photo_stage.root} failed: {e}")
+            return
+        if freed:
+            log.info(f"Staging: removed {freed / 1e9:.2f} GB of staged photos from {photo_stage.root}")
+    cleanup.callback(finish)
+    log.info(f"Staging: {len(entries)} photos to {photo_stage.root}")
+    progress = monitor.callback("stage_photos", stage="staging") if monitor is not None else None
+    try:
+        staged = measure(recorder, "staging", None, photo_stage.stage, entries, roots, progress)
+    finally:
+        if monitor is not None:
+            monitor.finish()
+    if staged:
+        log.info(f"Staging: {describe(photo_stage.stats)}")
+    return staged
+
+def relink_staged(doc: Any, staged: Dict[str, str], project_path: str, log: Any,
+                  cleanup: contextlib.ExitStack) -> None:
+    """
+    Point the cameras of a saved project at the staged copies; when `cleanup`
+    closes they point at the sources again and the project is saved, so it
+    never refers to scratch copies that may be gone.
+    """
+    n = relink(doc.chunks, staged)
+    if n:
+        log.info(f"Staging: {n} cameras of the saved project relinked to the staged photos")
+    sources = {v: k for k, v in staged.items()}
+
+    def unstage() -> None:
+        if relink(doc.chunks, sources) and project_path and os.path.isfile(project_path):
+            try:
+                doc.save(project_path)
+            except Exception as e:
+                log.warn(f"Staging: could not save the project with the source photo paths: {e}")
+    cleanup.callback(unstage)
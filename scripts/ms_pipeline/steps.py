@@ -1,254 +1,389 @@
-from __future__ import annotations
-import os
-import glob
-from typing import Any, Dict, List, Optional
-
-from .enums import maybe_enum, require_ms_attr
-
-def collect_photos(photo_dirs: List[str], globs_: List[str], recursive: bool) -> List[str]:
-    paths: List[str] = []
-    for d in photo_dirs:
-        if not d:
-            continue
-        d = os.path.abspath(d)
-        if not os.path.isdir(d):
-            continue
-        for pattern in globs_:
-            g = os.path.join(d, pattern)
-            paths.extend(glob.glob(g, recursive=recursive))
-    # De-dupe while preserving order
-    seen = set()
-    out = []
-    for p in paths:
-        ap = os.path.abspath(p)
-        if ap not in seen and os.path.isfile(ap):
-            seen.add(ap)
-            out.append(ap)
-    return out
-
-def set_chunk_crs(Metashape: Any, chunk: Any, epsg: Optional[str]) -> None:
-    if not epsg:
-        return
-    # Metashape expects EPSG strings like "EPSG::32641" :contentReference[oaicite:11]{index=11}
-    chunk.crs = Metashape.CoordinateSystem(epsg)
-    chunk.updateTransform()
-
-def import_reference_if_any(Metashape: Any, chunk: Any, ref_cfg: Dict[str, Any]) -> None:
-    """
-    Optional: import camera/GCP reference data from CSV/etc via chunk.importReference().
-    """
-    if not ref_cfg or not ref_cfg.get("enabled", False):
-        return
-
-    path = ref_cfg.get("path", "")
-    if not path:
-        raise ValueError("reference.enabled is true but reference.path is empty")
-
-    fmt = maybe_enum(Metashape, ref_cfg.get("format", "ReferenceFormatCSV"), Metashape.ReferenceFormatCSV)
-    columns = ref_cfg.get("columns", "")
-    delimiter = ref_cfg.get("delimiter", ",")
-    group_delimiters = bool(ref_cfg.get("group_delimiters", False))
-    skip_rows = int(ref_cfg.get("skip_rows", 0))
-    items = maybe_enum(Metashape, ref_cfg.get("items", "ReferenceItemsAll"), Metashape.ReferenceItemsAll)
-    crs = ref_cfg.get("crs_epsg", None)
-    crs_obj = Metashape.CoordinateSystem(crs) if crs else None
-
-    chunk.importReference(
-        path,
-        format=fmt,
-        columns=columns,
-        delimiter=delimiter,
-        group_delimiters=group_delimiters,
-        skip_rows=skip_rows,
-        items=items,
-        crs=crs_obj,
-        create_markers=bool(ref_cfg.get("create_markers", False)),
-        ignore_labels=bool(ref_cfg.get("ignore_labels", False)),
-        threshold=float(ref_cfg.get("threshold", 0.1)),
-        load_rotation=bool(ref_cfg.get("load_rotation", True)),
-        load_location_accuracy=bool(ref_cfg.get("load_location_accuracy", False)),
-        load_rotation_accuracy=bool(ref_cfg.get("load_rotation_accuracy", False)),
-        load_enabled=bool(ref_cfg.get("load_enabled", False)),
-    )
-    chunk.updateTransform()
-
-def run_match_align_optimize(Metashape: Any, chunk: Any, cfg: Dict[str, Any]) -> None:
-    mp = cfg.get("match_photos", {})
-    chunk.matchPhotos(
-        downscale=int(mp.get("downscale", 1)),
-        generic_preselection=bool(mp.get("generic_preselection", True)),
-        reference_preselection=bool(mp.get("reference_preselection", True)),
-        filter_mask=bool(mp.get("filter_mask", False)),
-        mask_tiepoints=bool(mp.get("mask_tiepoints", True)),
-        filter_stationary_points=bool(mp.get("filter_stationary_points", True)),
-        keypoint_limit=int(mp.get("keypoint_limit", 40000)),
-        tiepoint_limit=int(mp.get("tiepoint_limit", 4000)),
-        guided_matching=bool(mp.get("guided_matching", False)),
-        reset_matches=bool(mp.get("reset_matches", False)),
-        subdivide_task=bool(mp.get("subdivide_task", True)),
-    )
-
-    ac = cfg.get("align_cameras", {})
-    chunk.alignCameras(
-        min_image=int(ac.get("min_image", 2)),
-        adaptive_fitting=bool(ac.get("adaptive_fitting", False)),
-        reset_alignment=bool(ac.get("reset_alignment", False)),
-        subdivide_task=bool(ac.get("subdivide_task", True)),
-        align_laser_scans=bool(ac.get("align_laser_scans", False)),
-    )
-
-    oc = cfg.get("optimize_cameras", {})
-    if oc.get("enabled", True):
-        chunk.optimizeCameras(
-            fit_f=bool(oc.get("fit_f", True)),
-            fit_cx=bool(oc.get("fit_cx", True)),
-            fit_cy=bool(oc.get("fit_cy", True)),
-            fit_b1=bool(oc.get("fit_b1", False)),
-            fit_b2=bool(oc.get("fit_b2", False)),
-            fit_k1=bool(oc.get("fit_k1", True)),
-            fit_k2=bool(oc.get("fit_k2", True)),
-            fit_k3=bool(oc.get("fit_k3", True)),
-            fit_k4=bool(oc.get("fit_k4", False)),
-            fit_p1=bool(oc.get("fit_p1", True)),
-            fit_p2=bool(oc.get("fit_p2", True)),
-            fit_corrections=bool(oc.get("fit_corrections", False)),
-            adaptive_fitting=bool(oc.get("adaptive_fitting", False)),
-            tiepoint_covariance=bool(oc.get("tiepoint_covariance", False)),
-        )
-
-def build_depth_maps_and_point_cloud(Metashape: Any, chunk: Any, cfg: Dict[str, Any]) -> None:
-    dm = cfg.get("build_depth_maps", {})
-    if dm.get("enabled", True):
-        chunk.buildDepthMaps(
-            downscale=int(dm.get("downscale", 4)),
-            filter_mode=maybe_enum(Metashape, dm.get("filter_mode", "MildFiltering"), Metashape.MildFiltering),
-            reuse_depth=bool(dm.get("reuse_depth", False)),
-            max_neighbors=int(dm.get("max_neighbors", 16)),
-            subdivide_task=bool(dm.get("subdivide_task", True)),
-        )
-
-    pc = cfg.get("build_point_cloud", {})
-    if pc.get("enabled", True):
-        chunk.buildPointCloud(
-            source_data=maybe_enum(Metashape, pc.get("source_data", "DepthMapsData"), Metashape.DepthMapsData),
-            point_colors=bool(pc.get("point_colors", True)),
-            point_confidence=bool(pc.get("point_confidence", False)),
-            keep_depth=bool(pc.get("keep_depth", True)),
-            max_neighbors=int(pc.get("max_neighbors", 100)),
-            uniform_sampling=bool(pc.get("uniform_sampling", True)),
-            points_spacing=float(pc.get("points_spacing", 0.1)),
-            subdivide_task=bool(pc.get("subdivide_task", True)),
-        )
-
-def build_dem_and_ortho(Metashape: Any, chunk: Any, cfg: Dict[str, Any]) -> None:
-    dem = cfg.get("build_dem", {})
-    if dem.get("enabled", True):
-        chunk.buildDem(
-            source_data=maybe_enum(Metashape, dem.get("source_data", "PointCloudData"), Metashape.PointCloudData),
-            interpolation=maybe_enum(Metashape, dem.get("interpolation", "EnabledInterpolation"), Metashape.EnabledInterpolation),
-            resolution=float(dem.get("resolution", 0)),
-            subdivide_task=bool(dem.get("subdivide_task", True)),
-        )
-
-    ortho = cfg.get("build_orthomosaic", {})
-    if ortho.get("enabled", True):
-        chunk.buildOrthomosaic(
-            surface_data=maybe_enum(Metashape, ortho.get("surface_data", "ElevationData"), Metashape.ElevationData),
-            blending_mode=maybe_enum(Metashape, ortho.get("blending_mode", "MosaicBlending"), Metashape.MosaicBlending),
-            fill_holes=bool(ortho.get("fill_holes", True)),
-            ghosting_filter=bool(ortho.get("ghosting_filter", False)),
-            refine_seamlines=bool(ortho.get("refine_seamlines", False)),
-            resolution=float(ortho.get("resolution", 0)),
-            subdivide_task=bool(ortho.get("subdivide_task", True)),
-        )
-
-def build_model_uv_texture(Metashape: Any, chunk: Any, cfg: Dict[str, Any]) -> None:
-    model = cfg.get("build_model", {})
-    if model.get("enabled", True):
-        chunk.buildModel(
-            surface_type=maybe_enum(Metashape, model.get("surface_type", "Arbitrary"), Metashape.Arbitrary),
-            interpolation=maybe_enum(Metashape, model.get("interpolation", "EnabledInterpolation"), Metashape.EnabledInterpolation),
-            face_count=maybe_enum(Metashape, model.get("face_count", "HighFaceCount"), Metashape.HighFaceCount),
-            face_count_custom=int(model.get("face_count_custom", 200000)),
-            source_data=maybe_enum(Metashape, model.get("source_data", "DepthMapsData"), Metashape.DepthMapsData),
-            vertex_colors=bool(model.get("vertex_colors", True)),
-            vertex_confidence=bool(model.get("vertex_confidence", True)),
-            keep_depth=bool(model.get("keep_depth", True)),
-        )
-
-    uv = cfg.get("build_uv", {})
-    if uv.get("enabled", True):
-        chunk.buildUV(
-            mapping_mode=maybe_enum(Metashape, uv.get("mapping_mode", "GenericMapping"), Metashape.GenericMapping),
-            page_count=int(uv.get("page_count", 1)),
-            texture_size=int(uv.get("texture_size", 8192)),
-            pixel_size=float(uv.get("pixel_size", 0)),
-        )
-
-    tex = cfg.get("build_texture", {})
-    if tex.get("enabled", True):
-        chunk.buildTexture(
-            blending_mode=maybe_enum(Metashape, tex.get("blending_mode", "NaturalBlending"), Metashape.NaturalBlending),
-            texture_size=int(tex.get("texture_size", 8192)),
-            downscale=int(tex.get("downscale", 2)),
-            sharpening=int(tex.get("sharpening", 1)),
-            fill_holes=bool(tex.get("fill_holes", True)),
-            ghosting_filter=bool(tex.get("ghosting_filter", True)),
-            texture_type=maybe_enum(Metashape, tex.get("texture_type", "DiffuseMap"), Metashape.DiffuseMap),
-            source_data=maybe_enum(Metashape, tex.get("source_data", "ImagesData"), Metashape.ImagesData),
-            transfer_texture=bool(tex.get("transfer_texture", True)),
-            anti_aliasing=int(tex.get("anti_aliasing", 1)),
-        )
-
-def export_assets(Metashape: Any, chunk: Any, export_cfg: Dict[str, Any]) -> None:
-    if not export_cfg:
-        return
-
-    out_dir = export_cfg.get("output_dir", "")
-    if out_dir:
-        os.makedirs(out_dir, exist_ok=True)
-
-    # Report
-    rep = export_cfg.get("report", {})
-    if rep.get("enabled", False):
-        chunk.exportReport(
-            path=rep.get("path", os.path.join(out_dir, "report.pdf")),
-            title=rep.get("title", ""),
-            description=rep.get("description", ""),
-            font_size=int(rep.get("font_size", 12)),
-            page_numbers=bool(rep.get("page_numbers", True)),
-            save_system_info=bool(rep.get("save_system_info", True)),
-        )
-
-    # Raster exports (DEM + Ortho) using exportRaster() :contentReference[oaicite:12]{index=12}
-    for r in export_cfg.get("rasters", []):
-        if not r.get("enabled", True):
-            continue
-        path = r.get("path", "")
-        if not path:
-            continue
-
-        chunk.exportRaster(
-            path=path,
-            format=maybe_enum(Metashape, r.get("format", "RasterFormatGeoTIFF"), Metashape.RasterFormatGeoTIFF),
-            image_format=maybe_enum(Metashape, r.get("image_format", "ImageFormatNone"), Metashape.ImageFormatNone),
-            source_data=maybe_enum(Metashape, r.get("source_data", "OrthomosaicData"), Metashape.OrthomosaicData),
-            save_world=bool(r.get("save_world", True)),
-            save_alpha=bool(r.get("save_alpha", True)),
-            white_background=bool(r.get("white_background", True)),
-            clip_to_boundary=bool(r.get("clip_to_boundary", True)),
-        )
-
-    # Model export (optional)
-    m = export_cfg.get("model", {})
-    if m.get("enabled", False):
-        chunk.exportModel(
-            path=m.get("path", os.path.join(out_dir, "model.obj")),
-            format=maybe_enum(Metashape, m.get("format", "ModelFormatOBJ"), Metashape.ModelFormatOBJ),
-            texture_format=maybe_enum(Metashape, m.get("texture_format", "ImageFormatJPEG"), Metashape.ImageFormatJPEG),
-            save_texture=bool(m.get("save_texture", True)),
-            save_uv=bool(m.get("save_uv", True)),
-            save_normals=bool(m.get("save_normals", True)),
-            save_colors=bool(m.get("save_colors", True)),
-            binary=bool(m.get("binary", True)),
-        )
\ No newline at end of file
+from __future__ import annotations
+import os
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+from .dag import step
+from .enums import maybe_enum, require_ms_attr
+from .exports import export_products
+from .metrics import unwrap
+from .photos import discover_photos
+from .qc import tie_point_filter, value_stats
+
+def collect_photos(photo_dirs: List[str], globs_: List[str], recursive: bool) -> List[str]:
+    return [e.path for e in discover_photos(photo_dirs, globs_, recursive)]
+
+def set_chunk_crs(Metashape: Any, chunk: Any, epsg: Optional[str]) -> None:
+    if not epsg:
+        return
+    # Metashape expects EPSG strings like "EPSG::32641" :contentReference[oaicite:11]{index=11}
+    chunk.crs = Metashape.CoordinateSystem(epsg)
+    chunk.updateTransform()
+
+def import_reference_if_any(Metashape: Any, chunk: Any, ref_cfg: Dict[str, Any]) -> None:
+    """
+    Optional: import camera/GCP reference data from CSV/etc via chunk.importReference().
+    """
+    if not ref_cfg or not ref_cfg.get("enabled", False):
+        return
+
+    path = ref_cfg.get("path", "")
+    if not path:
+        raise ValueError("reference.enabled is true but reference.path is empty")
+
+    fmt = maybe_enum(Metashape, ref_cfg.get("format", "ReferenceFormatCSV"), Metashape.ReferenceFormatCSV)
+    columns = ref_cfg.get("columns", "")
+    delimiter = ref_cfg.get("delimiter", ",")
+    group_delimiters = bool(ref_cfg.get("group_delimiters", False))
+    skip_rows = int(ref_cfg.get("skip_rows", 0))
+    items = maybe_enum(Metashape, ref_cfg.get("items", "ReferenceItemsAll"), Metashape.ReferenceItemsAll)
+    crs = ref_cfg.get("crs_epsg", None)
+    crs_obj = Metashape.CoordinateSystem(crs) if crs else None
+
+    chunk.importReference(
+        path,
+        format=fmt,
+        columns=columns,
+        delimiter=delimiter,
+        group_delimiters=group_delimiters,
+        skip_rows=skip_rows,
+        items=items,
+        crs=crs_obj,
+        create_markers=bool(ref_cfg.get("create_markers", False)),
+        ignore_labels=bool(ref_cfg.get("ignore_labels", False)),
+        threshold=float(ref_cfg.get("threshold", 0.1)),
+        load_rotation=bool(ref_cfg.get("load_rotation", True)),
+        load_location_accuracy=bool(ref_cfg.get("load_location_accuracy", False)),
+        load_rotation_accuracy=bool(ref_cfg.get("load_rotation_accuracy", False)),
+        load_enabled=bool(ref_cfg.get("load_enabled", False)),
+    )
+    chunk.updateTransform()
+
+@step("align", requires=("photos",), provides=("alignment",),
+      sections=("match_photos", "align_cameras", "optimize_cameras"))
+def run_match_align_optimize(Metashape: Any, chunk: Any, cfg: Dict[str, Any]) -> None:
+    mp = cfg.get("match_photos", {})
+    chunk.matchPhotos(
+        downscale=int(mp.get("downscale", 1)),
+        generic_preselection=bool(mp.get("generic_preselection", True)),
+        reference_preselection=bool(mp.get("reference_preselection", True)),
+        filter_mask=bool(mp.get("filter_mask", False)),
+        mask_tiepoints=bool(mp.get("mask_tiepoints", True)),
+        filter_stationary_points=bool(mp.get("filter_stationary_points", True)),
+        keypoint_limit=int(mp.get("keypoint_limit", 40000)),
+        tiepoint_limit=int(mp.get("tiepoint_limit", 4000)),
+        guided_matching=bool(mp.get("guided_matching", False)),
+        reset_matches=bool(mp.get("reset_matches", False)),
+        keep_keypoints=bool(mp.get("keep_keypoints", False)),
+        subdivide_task=bool(mp.get("subdivide_task", True)),
+    )
+
+    ac = cfg.get("align_cameras", {})
+    chunk.alignCameras(
+        min_image=int(ac.get("min_image", 2)),
+        adaptive_fitting=bool(ac.get("adaptive_fitting", False)),
+        reset_alignment=bool(ac.get("reset_alignment", False)),
+        subdivide_task=bool(ac.get("subdivide_task", True)),
+        align_laser_scans=bool(ac.get("align_laser_scans", False)),
+    )
+
+    oc = cfg.get("optimize_cameras", {})
+    if oc.get("enabled", True):
+        optimize_cameras(chunk, oc)
+
+def optimize_cameras(chunk: Any, oc: Dict[str, Any]) -> None:
+    chunk.optimizeCameras(
+        fit_f=bool(oc.get("fit_f", True)),
+        fit_cx=bool(oc.get("fit_cx", True)),
+        fit_cy=bool(oc.get("fit_cy", True)),
+        fit_b1=bool(oc.get("fit_b1", False)),
+        fit_b2=bool(oc.get("fit_b2", False)),
+        fit_k1=bool(oc.get("fit_k1", True)),
+        fit_k2=bool(oc.get("fit_k2", True)),
+        fit_k3=bool(oc.get("fit_k3", True)),
+        fit_k4=bool(oc.get("fit_k4", False)),
+        fit_p1=bool(oc.get("fit_p1", True)),
+        fit_p2=bool(oc.get("fit_p2", True)),
+        fit_corrections=bool(oc.get("fit_corrections", False)),
+        adaptive_fitting=bool(oc.get("adaptive_fitting", False)),
+        tiepoint_covariance=bool(oc.get("tiepoint_covariance", False)),
+    )
+
+# Gradual selection passes, in this order (USGS-style sparse cloud cleaning)
+DEFAULT_TIE_POINT_CRITERIA = [
+    {"criterion": "ReconstructionUncertainty", "threshold": 15},
+    {"criterion": "ProjectionAccuracy", "threshold": 3},
+    {"criterion": "ReprojectionError", "threshold": 0.3},
+]
+
+@step("filter_tie_points", requires=("alignment",), provides=("alignment",),
+      sections=("filter_tie_points", "optimize_cameras"))
+def filter_tie_points(Metashape: Any, chunk: Any, cfg: Dict[str, Any], log: Any = None) -> List[Dict[str, Any]]:
+    """
+    Iterative gradual selection: for each criterion remove the tie points
+    above its threshold, but never more than max_fraction of the points in one
+    pass, then re-optimize the cameras. Repeats until a whole iteration removes
+    less than min_removed_fraction of the points or max_iterations is reached.
+    Returns one stats record per pass.
+    """
+    fc = cfg.get("filter_tie_points", {})
+    Filter = tie_point_filter(Metashape)
+    if Filter is None:
+        raise RuntimeError("Gradual selection (TiePoints.Filter) is not available in this Metashape version")
+    # Silent without a logger (worker jobs call this with none)
+    say = log.info if log is not None else (lambda msg: None)
+    raw = unwrap(chunk)
+    criteria = fc.get("criteria", DEFAULT_TIE_POINT_CRITERIA)
+    max_fraction = float(fc.get("max_fraction", 0.1))
+    min_removed = float(fc.get("min_removed_fraction", 0.001))
+    oc = cfg.get("optimize_cameras", {})
+    optimize = bool(fc.get("optimize", True)) and oc.get("enabled", True)
+
+    history: List[Dict[str, Any]] = []
+    for it in range(1, int(fc.get("max_iterations", 5)) + 1):
+        start = None
+        removed_it = 0
+        for c in criteria:
+            name = c["criterion"]
+            if not hasattr(Filter, name):
+                raise ValueError(f"Unknown gradual selection criterion: {name}")
+            f = Filter()
+            f.init(raw, criterion=getattr(Filter, name))
+            values = np.fromiter(f.values, dtype=np.float64)
+            n = int(values.size)
+            if start is None:
+                start = n
+            limit = float(c["threshold"])
+            threshold = limit
+            over = int(np.count_nonzero(values > limit))
+            cap = int(max_fraction * n)
+            if over > cap:
+                # Tighten to the value that leaves exactly the cap above it
+                threshold = float(np.partition(values, n - cap - 1)[n - cap - 1]) if cap else float(values.max())
+                over = int(np.count_nonzero(values > threshold))
+            rec = dict(value_stats(values), iteration=it, criterion=name, points=n, limit=limit,
+                       threshold=threshold, removed=over)
+            history.append(rec)
+            say(f"Tie point filter {it}.{name}: {n} points, p50 {rec.get('p50', 0):.3g} p95 {rec.get('p95', 0):.3g}, "
+                f"removing {over} above {threshold:.3g}" + (" (capped)" if threshold != limit else ""))
+            if not over:
+                continue
+            f.removePoints(threshold)
+            removed_it += over
+            if optimize:
+                optimize_cameras(chunk, oc)
+        if not start or removed_it < min_removed * start:
+            say(f"Tie point filter: converged after {it} iteration(s)")
+            break
+    return history
+
+@step("depth_maps", requires=("alignment",), provides=("depth_maps",), sections=("build_depth_maps",))
+def build_depth_maps(Metashape: Any, chunk: Any, cfg: Dict[str, Any]) -> None:
+    dm = cfg.get("build_depth_maps", {})
+    if dm.get("enabled", True):
+        chunk.buildDepthMaps(
+            downscale=int(dm.get("downscale", 4)),
+            filter_mode=maybe_enum(Metashape, dm.get("filter_mode", "MildFiltering"), Metashape.MildFiltering),
+            reuse_depth=bool(dm.get("reuse_depth", False)),
+            max_neighbors=int(dm.get("max_neighbors", 16)),
+            subdivide_task=bool(dm.get("subdivide_task", True)),
+        )
+
+# source_data enum name -> artifact it reads
+_SOURCES = {
+    "TiePointsData": "alignment",
+    "DepthMapsData": "depth_maps",
+    "PointCloudData": "point_cloud",
+    "ElevationData": "dem",
+    "ModelData": "model",
+    "TiledModelData": "tiled_model",
+    "OrthomosaicData": "orthomosaic",
+}
+
+def _source(section: str, key: str, default: str):
+    def requires(cfg: Dict[str, Any]) -> tuple:
+        art = _SOURCES.get(str(cfg.get(section, {}).get(key, default)))
+        return (art,) if art else ("alignment",)
+    return requires
+
+@step("point_cloud", requires=("depth_maps",), provides=("point_cloud",), sections=("build_point_cloud",))
+def build_point_cloud(Metashape: Any, chunk: Any, cfg: Dict[str, Any]) -> None:
+    pc = cfg.get("build_point_cloud", {})
+    if pc.get("enabled", True):
+        chunk.buildPointCloud(
+            source_data=maybe_enum(Metashape, pc.get("source_data", "DepthMapsData"), Metashape.DepthMapsData),
+            point_colors=bool(pc.get("point_colors", True)),
+            point_confidence=bool(pc.get("point_confidence", False)),
+            keep_depth=bool(pc.get("keep_depth", True)),
+            max_neighbors=int(pc.get("max_neighbors", 100)),
+            uniform_sampling=bool(pc.get("uniform_sampling", True)),
+            points_spacing=float(pc.get("points_spacing", 0.1)),
+            subdivide_task=bool(pc.get("subdivide_task", True)),
+        )
+
+def build_depth_maps_and_point_cloud(Metashape: Any, chunk: Any, cfg: Dict[str, Any]) -> None:
+    build_depth_maps(Metashape, chunk, cfg)
+    build_point_cloud(Metashape, chunk, cfg)
+
+@step("dem", requires=_source("build_dem", "source_data", "PointCloudData"), provides=("dem",),
+      sections=("build_dem",))
+def build_dem(Metashape: Any, chunk: Any, cfg: Dict[str, Any]) -> None:
+    dem = cfg.get("build_dem", {})
+    if dem.get("enabled", True):
+        chunk.buildDem(
+            source_data=maybe_enum(Metashape, dem.get("source_data", "PointCloudData"), Metashape.PointCloudData),
+            interpolation=maybe_enum(Metashape, dem.get("interpolation", "EnabledInterpolation"), Metashape.EnabledInterpolation),
+            resolution=float(dem.get("resolution", 0)),
+            subdivide_task=bool(dem.get("subdivide_task", True)),
+        )
+
+@step("orthomosaic", requires=_source("build_orthomosaic", "surface_data", "ElevationData"), provides=("orthomosaic",),
+      sections=("build_orthomosaic",))
+def build_orthomosaic(Metashape: Any, chunk: Any, cfg: Dict[str, Any]) -> None:
+    ortho = cfg.get("build_orthomosaic", {})
+    if ortho.get("enabled", True):
+        chunk.buildOrthomosaic(
+            surface_data=maybe_enum(Metashape, ortho.get("surface_data", "ElevationData"), Metashape.ElevationData),
+            blending_mode=maybe_enum(Metashape, ortho.get("blending_mode", "MosaicBlending"), Metashape.MosaicBlending),
+            fill_holes=bool(ortho.get("fill_holes", True)),
+            ghosting_filter=bool(ortho.get("ghosting_filter", False)),
+            refine_seamlines=bool(ortho.get("refine_seamlines", False)),
+            resolution=float(ortho.get("resolution", 0)),
+            subdivide_task=bool(ortho.get("subdivide_task", True)),
+        )
+
+def build_dem_and_ortho(Metashape: Any, chunk: Any, cfg: Dict[str, Any]) -> None:
+    build_dem(Metashape, chunk, cfg)
+    build_orthomosaic(Metashape, chunk, cfg)
+
+@step("model", requires=_source("build_model", "source_data", "DepthMapsData"), provides=("model",),
+      sections=("build_model",))
+def build_model(Metashape: Any, chunk: Any, cfg: Dict[str, Any]) -> None:
+    model = cfg.get("build_model", {})
+    if model.get("enabled", True):
+        chunk.buildModel(
+            surface_type=maybe_enum(Metashape, model.get("surface_type", "Arbitrary"), Metashape.Arbitrary),
+            interpolation=maybe_enum(Metashape, model.get("interpolation", "EnabledInterpolation"), Metashape.EnabledInterpolation),
+            face_count=maybe_enum(Metashape, model.get("face_count", "HighFaceCount"), Metashape.HighFaceCount),
+            face_count_custom=int(model.get("face_count_custom", 200000)),
+            source_data=maybe_enum(Metashape, model.get("source_data", "DepthMapsData"), Metashape.DepthMapsData),
+            vertex_colors=bool(model.get("vertex_colors", True)),
+            vertex_confidence=bool(model.get("vertex_confidence", True)),
+            keep_depth=bool(model.get("keep_depth", True)),
+        )
+
+@step("uv", requires=("model",), provides=("uv",), sections=("build_uv",))
+def build_uv(Metashape: Any, chunk: Any, cfg: Dict[str, Any]) -> None:
+    uv = cfg.get("build_uv", {})
+    if uv.get("enabled", True):
+        chunk.buildUV(
+            mapping_mode=maybe_enum(Metashape, uv.get("mapping_mode", "GenericMapping"), Metashape.GenericMapping),
+            page_count=int(uv.get("page_count", 1)),
+            texture_size=int(uv.get("texture_size", 8192)),
+            pixel_size=float(uv.get("pixel_size", 0)),
+        )
+
+@step("texture", requires=("uv",), provides=("texture",), sections=("build_texture",))
+def build_texture(Metashape: Any, chunk: Any, cfg: Dict[str, Any]) -> None:
+    tex = cfg.get("build_texture", {})
+    if tex.get("enabled", True):
+        chunk.buildTexture(
+            blending_mode=maybe_enum(Metashape, tex.get("blending_mode", "NaturalBlending"), Metashape.NaturalBlending),
+            texture_size=int(tex.get("texture_size", 8192)),
+            downscale=int(tex.get("downscale", 2)),
+            sharpening=int(tex.get("sharpening", 1)),
+            fill_holes=bool(tex.get("fill_holes", True)),
+            ghosting_filter=bool(tex.get("ghosting_filter", True)),
+            texture_type=maybe_enum(Metashape, tex.get("texture_type", "DiffuseMap"), Metashape.DiffuseMap),
+            source_data=maybe_enum(Metashape, tex.get("source_data", "ImagesData"), Metashape.ImagesData),
+            transfer_texture=bool(tex.get("transfer_texture", True)),
+            anti_aliasing=int(tex.get("anti_aliasing", 1)),
+        )
+
+def build_model_uv_texture(Metashape: Any, chunk: Any, cfg: Dict[str, Any]) -> None:
+    build_model(Metashape, chunk, cfg)
+    build_uv(Metashape, chunk, cfg)
+    build_texture(Metashape, chunk, cfg)
+
+def export_requires(export_cfg: Dict[str, Any]) -> tuple:
+    """
+    Artifacts an export config needs, so export nodes run after what they export.
+    """
+    need = ["alignment"]
+    for r in export_cfg.get("rasters", []):
+        if r.get("enabled", True) and r.get("path", ""):
+            need.append(_SOURCES.get(str(r.get("source_data", "OrthomosaicData")), "orthomosaic"))
+    if export_cfg.get("model", {}).get("enabled", False):
+        need.append("texture" if export_cfg["model"].get("save_texture", True) else "model")
+    if any(p.get("enabled", True) and p.get("path", "") for p in export_cfg.get("point_clouds", [])):
+        need.append("point_cloud")
+    return tuple(dict.fromkeys(need))
+
+def export_subset(export_cfg: Dict[str, Any], keep: Callable[[str], bool], report: bool = True) -> Dict[str, Any]:
+    """
+    Overrides for export_cfg that disable the outputs whose artifact keep()
+    rejects (and the report unless `report`), to split an export node by source.
+    """
+    out: Dict[str, Any] = {}
+    if export_cfg.get("rasters"):
+        out["rasters"] = [dict(r, enabled=bool(r.get("enabled", True)) and keep(
+            _SOURCES.get(str(r.get("source_data", "OrthomosaicData")), "orthomosaic")))
+            for r in export_cfg["rasters"]]
+    if export_cfg.get("point_clouds"):
+        out["point_clouds"] = [dict(p, enabled=bool(p.get("enabled", True)) and keep("point_cloud"))
+                               for p in export_cfg["point_clouds"]]
+    m = export_cfg.get("model", {})
+    if m.get("enabled", False) and not keep("texture" if m.get("save_texture", True) else "model"):
+        out["model"] = {"enabled": False}
+    if not report and export_cfg.get("report", {}).get("enabled", False):
+        out["report"] = {"enabled": False}
+    return out
+
+@step("export", requires=export_requires)
+def export_assets(Metashape: Any, chunk: Any, export_cfg: Dict[str, Any]) -> None:
+    # In-process, one task after another; the runner calls export_products
+    # itself to fan tasks out to workers (see ms_pipeline.exports)
+    export_products(Metashape, chunk, export_cfg)
+
+# Graph steps by name (see ms_pipeline.dag)
+STEPS = {
+    fn.spec.name: fn.spec
+    for fn in (
+        run_match_align_optimize,
+        filter_tie_points,
+        build_depth_maps,
+        build_point_cloud,
+        build_dem,
+        build_orthomosaic,
+        build_model,
+        build_uv,
+        build_texture,
+        export_assets,
+    )
+}
+
+def run_steps_job(Metashape: Any, job: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Worker side (scripts/ms_worker.py, kind "steps"): run a chain of graph
+    steps on a copy of a saved chunk. Without out_project the source project
+    is only read (exports).
+    """
+    doc = Metashape.Document()
+    doc.open(job["project"], read_only=True, ignore_lock=True)
+    src = [c for c in doc.chunks if c.label == job["chunk_label"]]
+    if not src:
+        raise RuntimeError(f"Chunk '{job['chunk_label']}' not found in {job['project']}")
+    chunk = src[0]
+    out = job.get("out_project", "")
+    if out:
+        os.makedirs(os.path.dirname(out), exist_ok=True)
+        doc.save(out, chunks=[chunk])
+        doc.open(out)
+        chunk = doc.chunks[0]
+        chunk.label = job["label"]
+    for node in job["nodes"]:
+        STEPS[node["step"]].fn(Metashape, chunk, node["cfg"])
+        if out:
+            doc.save()
+    return {"ok": True, "project": out, "label": job["label"] if out else job["chunk_label"]}
@@ -0,0 +1,104 @@
+from __future__ import annotations
+import math
+from typing import List, NamedTuple, Sequence, Tuple
+
+import numpy as np
+
+Bounds = Tuple[float, float, float, float]  # xmin, ymin, xmax, ymax
+
+class Block(NamedTuple):
+    index: int
+    bounds: Bounds        # core tile, tiles cover the area without gaps or overlap
+    padded: Bounds        # core tile grown by the overlap; what gets built
+    cameras: np.ndarray   # indices of the cameras used for this block
+
+def _pad(b: Bounds, frac: float) -> Bounds:
+    dx = (b[2] - b[0]) * frac
+    dy = (b[3] - b[1]) * frac
+    return (b[0] - dx, b[1] - dy, b[2] + dx, b[3] + dy)
+
+def points_in(xy: np.ndarray, b: Bounds) -> np.ndarray:
+    """
+    Boolean mask of points inside bounds (inclusive).
+    """
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    return (xy[:, 0] >= b[0]) & (xy[:, 0] <= b[2]) & (xy[:, 1] >= b[1]) & (xy[:, 1] <= b[3])
+
+def _extent(xy: np.ndarray) -> Bounds:
+    lo = xy.min(axis=0)
+    hi = xy.max(axis=0)
+    # Degenerate extents (a single camera line) still get a usable tile
+    span = max(float((hi - lo).max()), 1e-6)
+    eps = span * 1e-6
+    return (float(lo[0]) - eps, float(lo[1]) - eps, float(hi[0]) + eps, float(hi[1]) + eps)
+
+def _finish(xy: np.ndarray, cells: Sequence[Bounds], overlap: float, camera_margin: float) -> List[Block]:
+    blocks: List[Block] = []
+    for cell in cells:
+        padded = _pad(cell, overlap)
+        cams = np.flatnonzero(points_in(xy, _pad(cell, overlap + camera_margin)))
+        if not points_in(xy, cell).any():
+            continue
+        blocks.append(Block(len(blocks), cell, padded, cams))
+    return blocks
+
+def grid_blocks(xy: np.ndarray, target: int, overlap: float = 0.1, camera_margin: float = 0.1) -> List[Block]:
+    """
+    Regular grid over the camera extent with about len(xy) / target cells,
+    shaped to keep cells close to square. Empty cells are dropped.
+    """
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    if len(xy) == 0:
+        return []
+    ext = _extent(xy)
+    w, h = ext[2] - ext[0], ext[3] - ext[1]
+    n_cells = max(1, math.ceil(len(xy) / max(1, int(target))))
+    nx = max(1, min(n_cells, int(round(math.sqrt(n_cells * w / h)))))
+    ny = max(1, math.ceil(n_cells / nx))
+    xs = np.linspace(ext[0], ext[2], nx + 1)
+    ys = np.linspace(ext[1], ext[3], ny + 1)
+    cells = [(float(xs[i]), float(ys[j]), float(xs[i + 1]), float(ys[j + 1])) for j in range(ny) for i in range(nx)]
+    return _finish(xy, cells, overlap, camera_margin)
+
+def kdtree_blocks(xy: np.ndarray, target: int, overlap: float = 0.1, camera_margin: float = 0.1) -> List[Block]:
+    """
+    Recursive median split along the longer side until every cell holds at most
+    `target` cameras. Adapts to uneven density (corridors, dense cores).
+    """
+    xy = np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+    if len(xy) == 0:
+        return []
+    target = max(1, int(target))
+    cells: List[Bounds] = []
+    stack = [(_extent(xy), np.arange(len(xy)))]
+    while stack:
+        cell, idx = stack.pop()
+        if len(idx) <= target:
+            cells.append(cell)
+            continue
+        axis = 0 if (cell[2] - cell[0]) >= (cell[3] - cell[1]) else 1
+        split = float(np.median(xy[idx, axis]))
+        lo_mask = xy[idx, axis] <= split
+        if lo_mask.all() or not lo_mask.any():
+            # All cameras at one coordinate: split the cell geometrically instead
+            split = (cell[axis] + cell[axis + 2]) / 2.0
+            lo_mask = xy[idx, axis] <= split
+            if lo_mask.all() or not lo_mask.any():
+                cells.append(cell)
+                continue
+        if axis == 0:
+            lo, hi = (cell[0], cell[1], split, cell[3]), (split, cell[1], cell[2], cell[3])
+        else:
+            lo, hi = (cell[0], cell[1], cell[2], split), (cell[0], split, cell[2], cell[3])
+        stack.append((hi, idx[~lo_mask]))
+        stack.append((lo, idx[lo_mask]))
+    cells.sort(key=lambda b: (b[1], b[0]))
+    return _finish(xy, cells, overlap, camera_margin)
+
+def make_blocks(xy: np.ndarray, method: str, target: int, overlap: float = 0.1,
+                camera_margin: float = 0.1) -> List[Block]:
+    if method == "grid":
+        return grid_blocks(xy, target, overlap, camera_margin)
+    if method == "kdtree":
+        return kdtree_blocks(xy, target, overlap, camera_margin)
+    raise ValueError(f"Unknown split_blocks.method: {method}")
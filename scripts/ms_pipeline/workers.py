@@ -0,0 +1,92 @@
+from __future__ import annotations
+import json
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+SCRIPTS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+WORKER_SCRIPT = os.path.join(SCRIPTS_DIR, "ms_worker.py")
+
+def metashape_exe(cfg: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Metashape binary for headless worker processes: workers.metashape_exe,
+    then METASHAPE_EXE, then the running Metashape itself.
+    """
+    exe = (cfg or {}).get("metashape_exe", "") or os.environ.get("METASHAPE_EXE", "")
+    if exe:
+        return exe
+    if sys.executable and not os.path.basename(sys.executable).lower().startswith("python"):
+        return sys.executable
+    raise RuntimeError("Cannot find the Metashape executable for worker processes. "
+                       "Set workers.metashape_exe in the config or METASHAPE_EXE.")
+
+def worker_command(cfg: Optional[Dict[str, Any]], script: str, *args: str) -> List[str]:
+    cfg = cfg or {}
+    cmd = [metashape_exe(cfg)]
+    # A stand-in executable (scripts/stub_metashape.py, scripts/fake_metashape/launcher.py)
+    # runs under this Python
+    if cmd[0].lower().endswith(".py"):
+        cmd.insert(0, sys.executable)
+    if cfg.get("offscreen", sys.platform.startswith("linux")):
+        cmd += ["-platform", "offscreen"]
+    return cmd + ["-r", script] + list(args)
+
+def write_job(path: str, job: Dict[str, Any]) -> str:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(job, f, indent=2)
+    return path
+
+def result_path(job_path: str) -> str:
+    return os.path.splitext(job_path)[0] + ".result.json"
+
+def write_result(job_path: str, result: Dict[str, Any]) -> None:
+    tmp = result_path(job_path) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    os.replace(tmp, result_path(job_path))
+
+def _run_one(cmd: List[str], job_path: str) -> Dict[str, Any]:
+    out_log = os.path.splitext(job_path)[0] + ".out.log"
+    rp = result_path(job_path)
+    if os.path.exists(rp):
+        os.remove(rp)
+    with open(out_log, "w", encoding="utf-8") as out:
+        code = subprocess.call(cmd, stdout=out, stderr=subprocess.STDOUT)
+    result: Dict[str, Any] = {"ok": False}
+    if os.path.isfile(rp):
+        with open(rp, "r", encoding="utf-8") as f:
+            result = json.load(f)
+    result["returncode"] = code
+    result["job"] = job_path
+    result["output_log"] = out_log
+    if code != 0:
+        result["ok"] = False
+    return result
+
+def run_jobs(job_paths: List[str], cfg: Optional[Dict[str, Any]] = None, max_parallel: int = 1,
+             log: Any = None, check: bool = True) -> List[Dict[str, Any]]:
+    """
+    Run job files through scripts/ms_worker.py in headless Metashape processes,
+    at most max_parallel at a time. Returns one result per job, in order; raises
+    if any job failed (after all of them finished) unless check is False.
+    """
+    def one(job_path: str) -> Dict[str, Any]:
+        cmd = worker_command(cfg, WORKER_SCRIPT, job_path)
+        if log is not None:
+            log.info(f"Worker start: {os.path.basename(job_path)}")
+        r = _run_one(cmd, job_path)
+        if log is not None:
+            state = "done" if r.get("ok") else f"FAILED (exit {r['returncode']}, see {r['output_log']})"
+            log.info(f"Worker {state}: {os.path.basename(job_path)}")
+        return r
+
+    with ThreadPoolExecutor(max_workers=max(1, int(max_parallel))) as pool:
+        results = list(pool.map(one, job_paths))
+    failed = [r for r in results if not r.get("ok")]
+    if failed and check:
+        raise RuntimeError(f"{len(failed)} of {len(results)} worker jobs failed: "
+                           + ", ".join(r.get("error", "") or r["output_log"] for r in failed))
+    return results
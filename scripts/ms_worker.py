@@ -0,0 +1,51 @@
+"""
+Headless worker entry point:
+
+    metashape -r scripts/ms_worker.py <job.json>
+
+Runs one job written by ms_pipeline.workers.write_job and writes
+<job>.result.json next to it.
+"""
+from __future__ import annotations
+import json
+import os
+import sys
+import traceback
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, THIS_DIR)
+
+try:
+    import Metashape
+except Exception as e:
+    raise RuntimeError("This script must be run inside Agisoft Metashape Professional.") from e
+
+from ms_pipeline.workers import write_result
+from ms_pipeline.blocks import run_block_job
+from ms_pipeline.exports import run_export_job
+from ms_pipeline.multichunk import run_group_job
+from ms_pipeline.steps import run_steps_job
+
+JOB_KINDS = {
+    "block": run_block_job,
+    "steps": run_steps_job,
+    "export": run_export_job,
+    "align_group": run_group_job,
+}
+
+def main(argv: list[str]) -> None:
+    if len(argv) < 2:
+        raise RuntimeError("Usage: ms_worker.py <job.json>")
+    job_path = argv[1]
+    with open(job_path, "r", encoding="utf-8") as f:
+        job = json.load(f)
+    try:
+        handler = JOB_KINDS[job["kind"]]
+        result = handler(Metashape, job)
+    except Exception as e:
+        write_result(job_path, {"ok": False, "error": f"{type(e).__name__}: {e}", "traceback": traceback.format_exc()})
+        raise
+    write_result(job_path, result)
+
+if __name__ == "__main__":
+    main(sys.argv)
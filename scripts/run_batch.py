@@ -0,0 +1,174 @@
+"""
+Batch runner: a queue of workflow configs run in headless Metashape workers.
+
+    python scripts/run_batch.py add workflows/aerial_gcps/config.json [more configs] [--priority 5]
+    python scripts/run_batch.py run --max-jobs 2 --metashape-exe /opt/metashape-pro/metashape.sh
+    python scripts/run_batch.py status
+    python scripts/run_batch.py retry [job ids]      (default: all failed jobs; ids also rerun done jobs)
+    python scripts/run_batch.py cancel <job ids>
+
+Runs in any Python 3.9+ (the scheduler does not need Metashape). The queue
+lives in logs/batch/jobs.sqlite (--db); see docs/runbook.md, "Batch runs".
+"""
+from __future__ import annotations
+import argparse
+import os
+import sys
+import time
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.abspath(os.path.join(THIS_DIR, ".."))
+sys.path.insert(0, THIS_DIR)
+
+from ms_pipeline.batch import BatchScheduler, JobDB, node_resources
+from ms_pipeline.config import load_json
+from ms_pipeline.log import Logger
+
+BATCH_DIR = os.path.join(REPO_ROOT, "logs", "batch")
+RUN_SCRIPT = os.path.join(THIS_DIR, "run_workflow.py")
+
+def _job_name(config_path: str) -> str:
+    # workflows/<name>/config.json -> <name>
+    base = os.path.splitext(os.path.basename(config_path))[0]
+    if base == "config":
+        return os.path.basename(os.path.dirname(os.path.abspath(config_path))) or base
+    return base
+
+def _abs(path: str) -> str:
+    return path if os.path.isabs(path) else os.path.join(REPO_ROOT, path)
+
+def _memory_estimate_mb(config_path: str) -> float:
+    """
+    Planner peak memory for the config (0 if it cannot be estimated).
+    """
+    try:
+        from run_workflow import estimate
+        return float(estimate(config_path).get("peak_mb", 0.0))
+    except Exception as e:
+        print(f"  memory estimate failed ({type(e).__name__}: {e}); set batch.memory_gb in the config")
+        return 0.0
+
+def cmd_add(db: JobDB, args: argparse.Namespace) -> None:
+    for path in args.configs:
+        config_path = os.path.abspath(path)
+        cfg = load_json(config_path)
+        b = cfg.get("batch", {})
+        name = args.name or _job_name(config_path)
+        memory_mb = float(b.get("memory_gb", 0) or 0) * 1024.0
+        if not memory_mb and args.estimate:
+            memory_mb = _memory_estimate_mb(config_path)
+        proj_path = cfg.get("project", {}).get("project_path", "")
+        staging = cfg.get("input", {}).get("staging", {})
+        scratch = b.get("scratch_path", "") or (staging.get("scratch_dir", "") if staging.get("enabled", False) else "")
+        scratch = scratch or (os.path.dirname(_abs(proj_path)) if proj_path else "")
+        status = cfg.get("progress", {}).get("status_path", "") or os.path.join(REPO_ROOT, "logs", name, "status.json")
+        retries = args.retries if args.retries is not None else int(b.get("retries", 2))
+        job_id = db.add(
+            config_path, name,
+            priority=args.priority if args.priority is not None else int(b.get("priority", 0)),
+            cores=float(b.get("cores", 0) or 0),
+            memory_mb=memory_mb,
+            scratch_gb=float(b.get("scratch_gb", 0) or 0),
+            scratch_path=_abs(scratch) if scratch else "",
+            status_path=_abs(status),
+            max_attempts=retries + 1,
+        )
+        print(f"Added job {job_id}: {name} ({config_path}), memory {memory_mb / 1024.0:.1f} GB")
+
+def cmd_run(db: JobDB, args: argparse.Namespace) -> None:
+    res = node_resources(args.max_jobs, args.cores, args.memory_gb * 1024.0, args.min_free_gb)
+    workers_cfg = {"metashape_exe": args.metashape_exe}
+    if args.offscreen is not None:
+        workers_cfg["offscreen"] = args.offscreen == "on"
+    log = Logger(os.path.join(BATCH_DIR, "scheduler.log"))
+    with log:
+        log.info(f"Batch scheduler: {db.path}; {res.max_jobs} slots, {res.cores:g} cores, "
+                 f"{res.memory_mb / 1024.0:.1f} GB memory, keep {res.min_free_gb:g} GB scratch free")
+        sched = BatchScheduler(
+            db, res, RUN_SCRIPT, os.path.join(BATCH_DIR, "jobs"),
+            workers_cfg=workers_cfg, log=log, poll_s=args.poll_s,
+            backoff_s=args.backoff_s, backoff_max_s=args.backoff_max_s,
+            metrics_path=os.path.join(BATCH_DIR, "metrics.jsonl"),
+        )
+        try:
+            counts = sched.run(watch=args.watch)
+        except KeyboardInterrupt:
+            counts = None
+        else:
+            log.info("Batch finished: " + ", ".join(f"{k} {v}" for k, v in counts.items() if v))
+    if counts is None:
+        sys.exit(130)
+    if counts.get("failed"):
+        sys.exit(1)
+
+def cmd_status(db: JobDB, args: argparse.Namespace) -> None:
+    now = time.time()
+    print(f"{'id':>4}  {'state':<9} {'try':>5}  {'prio':>4}  {'mem GB':>6}  name / detail")
+    for j in db.jobs():
+        detail = ""
+        if j["state"] == "running":
+            detail = f"pid {j['pid']} on {j['host']}, {now - (j['started'] or now):.0f}s, log {j['out_log']}"
+        elif j["state"] == "queued" and j["not_before"] > now:
+            detail = f"retry in {j['not_before'] - now:.0f}s ({j['error']})"
+        elif j["state"] == "failed":
+            detail = f"{j['error']}; log {j['out_log']}"
+        print(f"{j['id']:>4}  {j['state']:<9} {j['attempts']:>2}/{j['max_attempts']:<2}  {j['priority']:>4}  "
+              f"{j['memory_mb'] / 1024.0:>6.1f}  {j['name']}" + (f"  {detail}" if detail else ""))
+        if args.attempts:
+            for a in db.attempts(j["id"]):
+                print(f"        attempt {a['attempt']}: {'ok' if a['ok'] else 'failed'} rc={a['returncode']} "
+                      f"wall {a['wall_s']}s cpu {a['cpu_s']}s peak {a['peak_rss_mb']} MB {a['error'] or ''}")
+    print(", ".join(f"{k} {v}" for k, v in db.counts().items()))
+
+def main(argv: list[str]) -> None:
+    ap = argparse.ArgumentParser(description="Queue workflow configs and run them in headless Metashape workers.")
+    ap.add_argument("--db", default=os.path.join(BATCH_DIR, "jobs.sqlite"), help="job database")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("add", help="queue workflow configs")
+    p.add_argument("configs", nargs="+")
+    p.add_argument("--name", default="", help="workflow name (logs/<name>/); default from the config path")
+    p.add_argument("--priority", type=int, default=None, help="higher runs first (default batch.priority or 0)")
+    p.add_argument("--retries", type=int, default=None, help="retries after a failure (default batch.retries or 2)")
+    p.add_argument("--no-estimate", dest="estimate", action="store_false",
+                   help="do not estimate memory with the planner when batch.memory_gb is not set")
+
+    p = sub.add_parser("run", help="run queued jobs until the queue is empty")
+    p.add_argument("--max-jobs", type=int, default=1, help="concurrent workers on this node")
+    p.add_argument("--cores", type=float, default=0, help="cores to schedule (default: all)")
+    p.add_argument("--memory-gb", type=float, default=0, help="memory to schedule (default: 90%% of RAM)")
+    p.add_argument("--min-free-gb", type=float, default=10, help="scratch space to keep free")
+    p.add_argument("--metashape-exe", default="", help="Metashape binary (or METASHAPE_EXE)")
+    p.add_argument("--offscreen", choices=["on", "off"], default=None, help="-platform offscreen (default on Linux)")
+    p.add_argument("--backoff-s", type=float, default=60, help="delay before the first retry, doubled each time")
+    p.add_argument("--backoff-max-s", type=float, default=3600)
+    p.add_argument("--poll-s", type=float, default=2)
+    p.add_argument("--watch", action="store_true", help="keep waiting for new jobs")
+
+    p = sub.add_parser("status", help="list jobs")
+    p.add_argument("--attempts", action="store_true", help="show every attempt with its metrics")
+
+    p = sub.add_parser("retry", help="queue failed jobs again")
+    p.add_argument("ids", nargs="*", type=int, help="failed, cancelled or done jobs to run again (default: all failed)")
+
+    p = sub.add_parser("cancel", help="cancel queued jobs")
+    p.add_argument("ids", nargs="+", type=int)
+
+    args = ap.parse_args(argv[1:])
+    db = JobDB(args.db)
+    try:
+        if args.cmd == "add":
+            cmd_add(db, args)
+        elif args.cmd == "run":
+            cmd_run(db, args)
+        elif args.cmd == "status":
+            cmd_status(db, args)
+        elif args.cmd == "retry":
+            print(f"Queued {db.retry(args.ids)} job(s) again")
+        elif args.cmd == "cancel":
+            print(f"Cancelled {db.cancel(args.ids)} job(s)")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -1,126 +1,523 @@
-from __future__ import annotations
-import os
-import sys
-import time
-
-try:
-    import Metashape
-except Exception as e:
-    raise RuntimeError("This script must be run inside Agisoft Metashape Professional.") from e
-
-from ms_pipeline.config import load_json
-from ms_pipeline.log import Logger
-from ms_pipeline.steps import (
-    collect_photos,
-    set_chunk_crs,
-    import_reference_if_any,
-    run_match_align_optimize,
-    build_depth_maps_and_point_cloud,
-    build_dem_and_ortho,
-    build_model_uv_texture,
-    export_assets,
-)
-from ms_pipeline.qc import qc_snapshot
-
-def _now_stamp() -> str:
-    return time.strftime("%Y%m%d_%H%M%S")
-
-def run(config_path: str, workflow_name: str = "workflow") -> None:
-    cfg = load_json(config_path)
-
-    repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
-    logs_dir = os.path.join(repo_root, "logs", workflow_name)
-    log_path = os.path.join(logs_dir, f"{_now_stamp()}.log")
-    log = Logger(log_path)
-
-    log.info(f"Config: {os.path.abspath(config_path)}")
-    log.info(f"Metashape version: {getattr(Metashape, 'version', 'unknown')}")
-    log.info(f"Workflow: {workflow_name}")
-
-    # Document / chunk
-    doc = Metashape.app.document
-    try:
-        doc.clear()
-    except Exception:
-        pass
-
-    chunk = doc.addChunk()
-    chunk.label = cfg.get("project", {}).get("chunk_label", workflow_name)
-
-    # Inputs
-    inp = cfg.get("input", {})
-    photo_dirs = inp.get("photo_dirs", [])
-    photo_globs = inp.get("photo_globs", ["*.jpg", "*.jpeg", "*.tif", "*.tiff", "*.png"])
-    recursive = bool(inp.get("recursive", True))
-
-    photos = collect_photos(photo_dirs, photo_globs, recursive)
-    if not photos:
-        raise RuntimeError("No photos found. Check input.photo_dirs and input.photo_globs.")
-
-    log.info(f"Photos found: {len(photos)}")
-    chunk.addPhotos(photos)
-
-    # CRS (optional)
-    epsg = inp.get("crs_epsg", "")
-    if epsg:
-        log.info(f"Setting CRS: {epsg}")
-        set_chunk_crs(Metashape, chunk, epsg)
-
-    # Optional reference import (camera/GCP CSV etc)
-    reference_cfg = cfg.get("reference", {})
-    if reference_cfg.get("enabled", False):
-        log.info("Importing reference data...")
-        import_reference_if_any(Metashape, chunk, reference_cfg)
-
-    # Processing
-    proc = cfg.get("processing", {})
-    stage = proc.get("stage", "aerial_products")
-
-    log.info(f"Processing stage: {stage}")
-    run_match_align_optimize(Metashape, chunk, proc)
-
-    if stage in ("aerial_products", "aerial_dem_ortho"):
-        build_depth_maps_and_point_cloud(Metashape, chunk, proc)
-        build_dem_and_ortho(Metashape, chunk, proc)
-    elif stage in ("object_model_texture",):
-        build_depth_maps_and_point_cloud(Metashape, chunk, proc)
-        build_model_uv_texture(Metashape, chunk, proc)
-    else:
-        raise ValueError(f"Unknown processing.stage: {stage}")
-
-    # QC snapshot
-    qc = qc_snapshot(chunk)
-    log.info(f"QC: {qc}")
-
-    # Exports
-    export_cfg = cfg.get("export", {})
-    if export_cfg:
-        # Allow relative output paths to be relative to repo root
-        out_dir = export_cfg.get("output_dir", "")
-        if out_dir and not os.path.isabs(out_dir):
-            export_cfg["output_dir"] = os.path.abspath(os.path.join(repo_root, out_dir))
-        export_assets(Metashape, chunk, export_cfg)
-
-    # Save project (optional)
-    proj_path = cfg.get("project", {}).get("project_path", "")
-    if proj_path:
-        if not os.path.isabs(proj_path):
-            proj_path = os.path.abspath(os.path.join(repo_root, proj_path))
-        os.makedirs(os.path.dirname(proj_path), exist_ok=True)
-        log.info(f"Saving project: {proj_path}")
-        doc.save(proj_path)
-
-    log.info("DONE")
-
-def main(argv: list[str]) -> None:
-    if len(argv) >= 2:
-        config_path = argv[1]
-        workflow_name = os.path.splitext(os.path.basename(config_path))[0]
-        run(config_path=config_path, workflow_name=workflow_name)
-        return
-
-    # GUI-friendly fallback: run a default selector via workflow wrappers instead
-    raise RuntimeError("No config path provided. Use a workflow wrapper in workflows/<name>/run.py.")
-
-if __name__ == "__main__":
+from __future__ import annotations
+import contextlib
+import os
+import sys
+import tempfile
+import time
+
+try:
+    import Metashape
+except Exception:
+    # Only needed for processing; --plan runs in any Python
+    Metashape = None
+
+from ms_pipeline.config import load_json
+from ms_pipeline.log import Logger
+from ms_pipeline.metrics import MetricsRecorder, measure, profile_session
+from ms_pipeline.progress import ProgressMonitor, load_history
+from ms_pipeline.checkpoint import Checkpoint, config_hash, photo_fingerprint
+from ms_pipeline.dag import ancestors, branch_heads, build_graph, dependants, node_keys, topo_order
+from ms_pipeline.photos import discover_photos
+from ms_pipeline.metadata import build_index, check_metadata, describe_groups, have_pillow
+from ms_pipeline.planner import format_plan, history_paths, inspect_dataset, make_plan
+from ms_pipeline.preflight import run_preflight
+from ms_pipeline.masks import generate_masks
+from ms_pipeline.reference import reference_summary, validate_reference
+from ms_pipeline.staging import relink_staged, stage_photos
+from ms_pipeline.steps import STEPS, export_subset
+from ms_pipeline.artifacts import ArtifactCache, describe as describe_cache
+from ms_pipeline.multichunk import photo_groups
+from ms_pipeline.incremental import changed_inputs, input_stamps, inputs_path, load_inputs
+from ms_pipeline.runner import RUNNER_STEPS, Graph, GraphRunner, SetupInputs, find_chunk
+
+REGISTRY = dict(STEPS, **RUNNER_STEPS)
+
+# processing.stage -> fixed linear graph (processing.graph replaces it)
+STAGES = {
+    "aerial_products": ["align", "depth_maps", "point_cloud", "dem", "orthomosaic"],
+    "object_model_texture": ["align", "depth_maps", "point_cloud", "model", "uv", "texture"],
+}
+STAGES["aerial_dem_ortho"] = STAGES["aerial_products"]
+
+# Aerial stages with processing.split_blocks enabled
+SPLIT_STAGES = ["align", "blocks"]
+
+def _now_stamp() -> str:
+    return time.strftime("%Y%m%d_%H%M%S")
+
+def _abs_from_root(repo_root: str, path: str) -> str:
+    if path and not os.path.isabs(path):
+        return os.path.abspath(os.path.join(repo_root, path))
+    return path
+
+def _file_stamp(path: str) -> list:
+    try:
+        st = os.stat(path)
+        return [path, st.st_size, st.st_mtime_ns]
+    except OSError:
+        return [path, None, None]
+
+def _photo_entries(inp, repo_root: str, proj_path: str, use_manifest: bool = True):
+    photo_dirs = inp.get("photo_dirs", [])
+    photo_globs = inp.get("photo_globs", ["*.jpg", "*.jpeg", "*.tif", "*.tiff", "*.png"])
+    recursive = bool(inp.get("recursive", True))
+
+    # Directory listing cache: explicit path, false to disable, default next to the project
+    manifest = inp.get("photo_manifest", None) if use_manifest else False
+    if manifest is None:
+        manifest = os.path.splitext(proj_path)[0] + ".photos.json" if proj_path else ""
+    manifest = _abs_from_root(repo_root, manifest) if manifest else None
+
+    return discover_photos(photo_dirs, photo_globs, recursive,
+                           manifest_path=manifest, workers=int(inp.get("scan_workers", 8)))
+
+def _metadata_index(inp, entries, repo_root: str, proj_path: str, log: Logger):
+    """
+    EXIF/XMP index of the photos (input.metadata), cached next to the project.
+    """
+    meta_cfg = inp.get("metadata", {})
+    if not meta_cfg.get("enabled", False):
+        return None
+    if not have_pillow():
+        log.warn("Metadata: Pillow not available, metadata index skipped (see docs/installation.md)")
+        return None
+    cache = meta_cfg.get("cache_path", "")
+    if not cache and proj_path:
+        cache = os.path.splitext(proj_path)[0] + ".metadata.npz"
+    return build_index(entries, _abs_from_root(repo_root, cache) or None, workers=int(meta_cfg.get("workers", 16)))
+
+def _graph_spec(proc):
+    """
+    (name, graph spec, linear) for processing.graph or the fixed processing.stage lists.
+    The setup node is always first; an export node is added if the graph has none.
+    """
+    graph = proc.get("graph", {})
+    if graph.get("nodes"):
+        spec = list(graph["nodes"])
+        if not any((n if isinstance(n, str) else n.get("step")) == "export" for n in spec):
+            spec.append("export")
+        return "graph", ["setup"] + spec, False
+    stage = proc.get("stage", "aerial_products")
+    if stage not in STAGES:
+        raise ValueError(f"Unknown processing.stage: {stage}")
+    spec = STAGES[stage]
+    if proc.get("split_blocks", {}).get("enabled", False):
+        if stage not in ("aerial_products", "aerial_dem_ortho"):
+            raise ValueError("processing.split_blocks is only supported for aerial stages")
+        spec = SPLIT_STAGES
+    if proc.get("filter_tie_points", {}).get("enabled", False):
+        spec = spec[:spec.index("align") + 1] + ["filter_tie_points"] + spec[spec.index("align") + 1:]
+    if proc.get("multi_chunk", {}).get("enabled", False):
+        spec = ["align_groups" if s == "align" else s for s in spec]
+    return stage, ["setup"] + spec + ["export"], True
+
+def _split_exports(spec, nodes, deps, order):
+    """
+    Graph spec for worker branches (graph.max_parallel > 1): an "export" node
+    given by name that reads outputs of several branches becomes one export
+    per branch, each with the outputs that branch provides (the report stays
+    with the last). Other nodes that join branches are rejected: no single
+    chunk holds all of their inputs. Returns None when nothing is split.
+    """
+    out, split = [], False
+    for item in spec:
+        nid = item if isinstance(item, str) else item.get("id", item.get("step", ""))
+        heads = sorted(branch_heads(nid, deps), key=order.index)
+        if len(heads) < 2:
+            out.append(item)
+            continue
+        if item != "export":
+            raise ValueError(f"Graph node {nid!r} joins branches {', '.join(heads)}; with graph.max_parallel > 1 "
+                             "each branch is a separate chunk, so give every branch its own node")
+        # Each output goes with the last branch holding the node that provides its artifact
+        owner = {}
+        for p in deps[nid]:
+            h = [h for h in heads if h == p or p in ancestors(h, deps)][-1]
+            for a in nodes[p].provides:
+                owner[a] = h
+        for h in heads:
+            last = h == heads[-1]
+            out.append({"step": "export", "id": "export" if last else f"export_{h}",
+                        "config": export_subset(nodes[nid].cfg, lambda a, h=h: owner.get(a, heads[-1]) == h,
+                                                report=last)})
+        split = True
+    return out if split else None
+
+def _plan(cfg, entries, spec, repo_root: str, index=None):
+    planner_cfg = cfg.get("planner", {})
+    ds = inspect_dataset([e.path for e in entries], planner_cfg, index)
+    steps = [n if isinstance(n, str) else n.get("step", "") for n in spec]
+    return make_plan(ds, steps, cfg.get("processing", {}), planner_cfg,
+                     history_paths(os.path.join(repo_root, "logs")))
+
+def estimate(config_path: str) -> dict:
+    """
+    Planner estimate for a config (runtime, peak memory) without touching Metashape.
+    """
+    cfg = load_json(config_path)
+    repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    proj_path = _abs_from_root(repo_root, cfg.get("project", {}).get("project_path", ""))
+    # Read only: no photo manifest or metadata cache is written (both would create the project folder)
+    entries = _photo_entries(cfg.get("input", {}), repo_root, proj_path, use_manifest=False)
+    if not entries:
+        raise RuntimeError("No photos found. Check input.photo_dirs and input.photo_globs.")
+    _, spec, _ = _graph_spec(cfg.get("processing", {}))
+    return _plan(cfg, entries, spec, repo_root)
+
+def plan(config_path: str, workflow_name: str = "workflow") -> dict:
+    """
+    Dry run: print the estimated schedule without touching Metashape.
+    """
+    result = estimate(config_path)
+    print(f"Plan for {workflow_name} ({os.path.abspath(config_path)})")
+    for line in format_plan(result):
+        print(line)
+    return result
+
+def run(config_path: str, workflow_name: str = "workflow") -> None:
+    if Metashape is None:
+        raise RuntimeError("This script must be run inside Agisoft Metashape Professional.")
+    cfg = load_json(config_path)
+
+    repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+    logs_dir = os.path.join(repo_root, "logs", workflow_name)
+    stamp = _now_stamp()
+    log_path = os.path.join(logs_dir, f"{stamp}.log")
+    log_cfg = cfg.get("logging", {})
+    log = Logger(
+        log_path,
+        structured=bool(log_cfg.get("structured", True)),
+        max_bytes=int(float(log_cfg.get("max_mb", 0)) * 1024 * 1024),
+        backups=int(log_cfg.get("backups", 5)),
+    )
+
+    log.info(f"Config: {os.path.abspath(config_path)}")
+    log.info(f"Metashape version: {getattr(Metashape, 'version', 'unknown')}")
+    log.info(f"Workflow: {workflow_name}")
+
+    # Per-call wall/CPU/RSS/IO metrics, appended to logs/<workflow>/metrics.jsonl
+    metrics_cfg = cfg.get("metrics", {})
+    recorder = None
+    if metrics_cfg.get("enabled", True):
+        recorder = MetricsRecorder(
+            metrics_cfg.get("path", "") or os.path.join(logs_dir, "metrics.jsonl"),
+            run_id=stamp,
+            sample_interval=float(metrics_cfg.get("sample_interval", 0.5)),
+            workflow=workflow_name,
+            config=os.path.abspath(config_path),
+            metashape_version=getattr(Metashape, "version", "unknown"),
+        )
+        log.info(f"Metrics: {recorder.path}")
+
+    # Progress callbacks on every processing call, status file and stall alarm
+    prog_cfg = cfg.get("progress", {})
+    monitor = None
+    if prog_cfg.get("enabled", True):
+        monitor = ProgressMonitor(
+            log,
+            status_path=prog_cfg.get("status_path", "") or os.path.join(logs_dir, "status.json"),
+            history=load_history(recorder.path) if recorder is not None else None,
+            log_interval=float(prog_cfg.get("log_interval_s", 60)),
+            log_step=float(prog_cfg.get("log_step", 10)),
+            status_interval=float(prog_cfg.get("status_interval_s", 5)),
+            stall_minutes=float(prog_cfg.get("stall_minutes", 30)),
+            stall_action=prog_cfg.get("stall_action", "warn"),
+            # Exiting the process is only right when a batch runner retries it
+            hard_exit=bool(prog_cfg.get("hard_exit", "MS_BATCH_JOB" in os.environ)),
+            workflow=workflow_name,
+            run_id=stamp,
+            pid=os.getpid(),
+        )
+
+    # The logger writes from a background thread; leaving the with-block logs
+    # any exception and flushes everything to disk.
+    with log, profile_session(
+        os.path.splitext(log_path)[0],
+        cprofile=bool(metrics_cfg.get("cprofile", False)),
+        tracemalloc_=bool(metrics_cfg.get("tracemalloc", False)),
+        log=log,
+    ), contextlib.ExitStack() as cleanup:
+        state = "failed"
+        try:
+            _run(cfg, workflow_name, repo_root, log, recorder, monitor, cleanup)
+            state = "finished"
+        finally:
+            if monitor is not None:
+                monitor.close()
+                monitor.write_status(state)
+
+def _run(cfg, workflow_name: str, repo_root: str, log: Logger, recorder, monitor, cleanup) -> None:
+    project_cfg = cfg.get("project", {})
+    chunk_label = project_cfg.get("chunk_label", workflow_name)
+    log.bind(chunk=chunk_label)
+    proj_path = _abs_from_root(repo_root, project_cfg.get("project_path", ""))
+
+    # Inputs
+    inp = cfg.get("input", {})
+    entries = measure(recorder, "discover_photos", None, _photo_entries, inp, repo_root, proj_path)
+    photos = [e.path for e in entries]
+    if not photos:
+        raise RuntimeError("No photos found. Check input.photo_dirs and input.photo_globs.")
+    log.info(f"Photos found: {len(photos)}")
+
+    # Photo metadata from the headers: catch mixed cameras, missing GPS or
+    # rotated frames before Metashape spends time importing
+    meta_cfg = inp.get("metadata", {})
+    index = measure(recorder, "metadata", None, _metadata_index, inp, entries, repo_root, proj_path, log)
+    if index is not None:
+        for line in describe_groups(index.sensor_groups()):
+            log.info(f"Metadata: {line}")
+        problems = check_metadata(index, meta_cfg)
+        for p in problems:
+            log.warn(f"Metadata: {p}")
+        if problems and meta_cfg.get("abort_on_fail", False):
+            raise RuntimeError("Photo metadata checks failed: " + "; ".join(problems))
+
+    # Optional image quality pre-flight (blur, exposure, near-duplicates)
+    preflight_cfg = inp.get("preflight", {})
+    rejected = {}
+    if preflight_cfg.get("enabled", False):
+        pf_cache = preflight_cfg.get("cache_path", "")
+        if not pf_cache and proj_path:
+            pf_cache = os.path.splitext(proj_path)[0] + ".preflight.json"
+        rejected = measure(recorder, "preflight", None, run_preflight, entries, preflight_cfg,
+                            _abs_from_root(repo_root, pf_cache) or None)
+        action = preflight_cfg.get("action", "disable")
+        log.info(f"Preflight: {len(rejected)} of {len(photos)} photos rejected (action: {action})")
+        for p, why in sorted(rejected.items()):
+            log.info(f"Preflight: {', '.join(why)}: {p}")
+        if action == "drop":
+            entries = [e for e in entries if e.path not in rejected]
+            photos = [e.path for e in entries]
+            if not photos:
+                raise RuntimeError("Preflight rejected every photo. Check input.preflight thresholds.")
+
+    # Optional foreground masks (turntable/backdrop removed) for matching and depth maps
+    masks_cfg = inp.get("masks", {})
+    masks = {}
+    if masks_cfg.get("enabled", False):
+        masks_cfg = dict(masks_cfg, background=_abs_from_root(repo_root, masks_cfg.get("background", "")),
+                         backgrounds={k: _abs_from_root(repo_root, v) for k, v in masks_cfg.get("backgrounds", {}).items()})
+        mask_dir = masks_cfg.get("cache_dir", "")
+        if not mask_dir:
+            mask_dir = (os.path.splitext(proj_path)[0] + ".masks" if proj_path
+                        else os.path.join(repo_root, "logs", workflow_name, "masks"))
+        masks = measure(recorder, "masks", None, generate_masks, entries, masks_cfg, _abs_from_root(repo_root, mask_dir))
+        bad = {p: r["error"] for p, r in masks.items() if "error" in r}
+        log.info(f"Masks: {len(masks) - len(bad)} of {len(masks)} photos masked")
+        for p, why in sorted(bad.items()):
+            log.warn(f"Masks: no mask ({why}): {p}")
+
+    reference_cfg = cfg.get("reference", {})
+    epsg = inp.get("crs_epsg", "")
+
+    # Reference CSV checked against the columns spec, CRS and photos before
+    # anything runs; the cleaned copy is what gets imported
+    reference_import = reference_cfg
+    if reference_cfg.get("enabled", False) and reference_cfg.get("validate", {}).get("enabled", False):
+        clean = reference_cfg["validate"].get("clean_path", "")
+        if not clean and proj_path:
+            clean = os.path.splitext(proj_path)[0] + ".reference.csv"
+        ref_report = measure(recorder, "reference", None, validate_reference,
+                              dict(reference_cfg, path=_abs_from_root(repo_root, reference_cfg.get("path", ""))),
+                              photos, crs=epsg, index=index, out_path=_abs_from_root(repo_root, clean))
+        for w in ref_report["warnings"]:
+            log.warn(f"Reference: {w}")
+        if ref_report["errors"]:
+            raise RuntimeError("Reference file check failed: " + "; ".join(ref_report["errors"]))
+        log.info(f"Reference: {reference_summary(ref_report)}")
+        reference_import = ref_report.get("config", reference_import)
+
+    # Processing
+    proc = cfg.setdefault("processing", {})
+    stage, spec, linear = _graph_spec(proc)
+    log.info(f"Processing stage: {stage}")
+
+    # Photo groups (sessions, turntable orientations) aligned as separate chunks
+    groups = {}
+    if any((n if isinstance(n, str) else n.get("step")) == "align_groups" for n in spec):
+        groups, notes = photo_groups([e.path for e in entries], inp.get("photo_dirs", []),
+                                     proc.get("multi_chunk", {}), index)
+        for n in notes:
+            log.warn(f"Multi-chunk: {n}")
+        log.info(f"Multi-chunk: {len(groups)} photo groups: "
+                 + ", ".join(f"{name} ({len(g)})" for name, g in groups.items()))
+    incremental = bool(project_cfg.get("incremental", False))
+    if incremental:
+        # Later runs only match the new photos; keep keypoints of the existing ones
+        proc.setdefault("match_photos", {}).setdefault("keep_keypoints", True)
+    if masks:
+        # Matching ignores masked areas unless the config says otherwise
+        proc.setdefault("match_photos", {}).setdefault("filter_mask", True)
+
+    # Cost estimate per stage against the time/memory budget, optionally tuning parameters
+    planner_cfg = cfg.get("planner", {})
+    if planner_cfg.get("enabled", False):
+        plan_ = measure(recorder, "planner", None, _plan, cfg, entries, spec, repo_root, index)
+        for line in format_plan(plan_):
+            if line.startswith("Warning: "):
+                log.warn(f"Plan: {line[len('Warning: '):]}")
+            else:
+                log.info(f"Plan: {line}")
+        if plan_["changes"]:
+            proc = cfg["processing"] = plan_["processing"]
+        if recorder is not None:
+            # Calibration fits the matching/alignment rates with the overlap the estimate assumed
+            recorder.context["neighbours"] = plan_["dataset"]["neighbours"]
+
+    export_cfg = cfg.get("export", {})
+    if export_cfg:
+        # Allow relative output paths to be relative to repo root
+        out_dir = export_cfg.get("output_dir", "")
+        if out_dir and not os.path.isabs(out_dir):
+            export_cfg["output_dir"] = os.path.abspath(os.path.join(repo_root, out_dir))
+
+    # Stage graph: setup, processing steps, exports. Each node is keyed by its
+    # own config plus the keys of the nodes it depends on, so a rerun only runs
+    # nodes whose inputs or parameters changed.
+    setup_params = {
+        "chunk_label": chunk_label,
+        "photos": photo_fingerprint(entries),
+        "crs_epsg": epsg,
+        "preflight": preflight_cfg if preflight_cfg.get("enabled", False) else None,
+        "masks": masks_cfg if masks else None,
+        "mask_files": config_hash(sorted((p, r.get("path", "")) for p, r in masks.items())) if masks else None,
+        "reference": reference_cfg,
+        "reference_file": _file_stamp(reference_cfg.get("path", "")) if reference_cfg.get("enabled", False) else None,
+    }
+
+    def config_for(step: str):
+        return setup_params if step == "setup" else export_cfg if step == "export" else proc
+
+    graph_cfg = proc.get("graph", {})
+    max_parallel = int(graph_cfg.get("max_parallel", 1)) if proj_path else 1
+    nodes, deps = build_graph(spec, REGISTRY, config_for, linear=linear)
+    order = topo_order(list(nodes), deps)
+    split = _split_exports(spec, nodes, deps, order) if max_parallel > 1 else None
+    if split is not None:
+        nodes, deps = build_graph(split, REGISTRY, config_for, linear=linear)
+        order = topo_order(list(nodes), deps)
+        log.info("Graph: exports split per branch: " + ", ".join(i for i in order if nodes[i].step == "export"))
+    keys = node_keys(config_hash(stage if linear else spec), order, deps, {i: n.params for i, n in nodes.items()})
+    down = dependants(deps)
+    # Per-node parameter hashes (without upstream) and the setup inputs other
+    # than the photos (and their masks): an incremental update needs both unchanged up to align
+    params = {i: config_hash(i, n.params) for i, n in nodes.items()}
+    static = config_hash({k: v for k, v in setup_params.items() if k not in ("photos", "mask_files")})
+
+    ckpt = None
+    if proj_path and project_cfg.get("resume", True):
+        ckpt = Checkpoint(proj_path)
+    done = ckpt.stages if ckpt is not None else {}
+    resume = done.get("setup", {}).get("key") == keys["setup"]
+
+    if incremental and (ckpt is None or resume or "align" not in nodes):
+        incremental = False
+    if incremental:
+        # Depth maps and blocks are also kept for the existing cameras, so their settings must match too
+        gate = order[1:order.index("align") + 1] + [i for i in order if nodes[i].step in ("depth_maps", "blocks")]
+        if done.get("setup", {}).get("static") != static or any(
+                done.get(n, {}).get("params") != params[n] for n in gate):
+            log.info("Incremental: no matching previous run (or settings changed), processing everything")
+            incremental = False
+    # Photos and masks changed in place would keep their old cameras and products
+    stamps = input_stamps(entries, masks)
+    if incremental:
+        changed = changed_inputs(load_inputs(proj_path), stamps)
+        if not os.path.isfile(inputs_path(proj_path)):
+            log.info("Incremental: no record of the previous run's photos, processing everything")
+            incremental = False
+        elif changed:
+            log.info(f"Incremental: {len(changed)} earlier photos or their masks changed (e.g. {changed[0]}), "
+                     "processing everything")
+            incremental = False
+    if incremental and max_parallel > 1:
+        log.info("Incremental: running every node in this process")
+        max_parallel = 1
+
+    # Artifact cache: chunks after expensive nodes, kept on scratch under the node
+    # key so a run with the same photos and upstream parameters reuses them
+    cache_cfg = cfg.get("cache", {})
+    cache = None
+    if cache_cfg.get("enabled", False):
+        if not proj_path:
+            log.warn("Artifact cache: needs project.project_path, not used")
+        elif incremental or max_parallel > 1 or any(len(deps[i]) > 1 or len(down[i]) > 1 for i in order):
+            log.info("Artifact cache: only used for linear graphs run in this process, not used")
+        else:
+            cache_dir = (_abs_from_root(repo_root, cache_cfg.get("dir", ""))
+                         or os.path.join(os.path.dirname(proj_path), "artifact_cache"))
+            cache = ArtifactCache(cache_dir, int(float(cache_cfg.get("max_gb", 0)) * 1e9))
+            log.info(f"Artifact cache: {cache.root} ({describe_cache(cache.stats())})")
+
+    # QC report (JSON next to the log); the runner adds to it after alignment and before export
+    qc_cfg = cfg.get("qc", {})
+    qc_path = _abs_from_root(repo_root, qc_cfg.get("report_path", "")) or os.path.splitext(log.path)[0] + ".qc.json"
+
+    # Local copies of the photos for Metashape to read (input.staging). Photo
+    # checks, their caches and the stage keys keep using the source paths.
+    staging_cfg = inp.get("staging", {})
+    staged = {}
+    if staging_cfg.get("enabled", False) and resume and all(done.get(i, {}).get("key") == keys[i] for i in order):
+        log.info("Staging: every stage is up to date, photos not staged")
+    elif staging_cfg.get("enabled", False):
+        scratch = (_abs_from_root(repo_root, staging_cfg.get("scratch_dir", ""))
+                   or os.path.join(tempfile.gettempdir(), "ms_staging"))
+        staged = stage_photos(entries, inp.get("photo_dirs", []), staging_cfg, scratch, log, cleanup,
+                              recorder=recorder, monitor=monitor)
+
+    # Document / chunk
+    doc = Metashape.app.document
+    chunk = None
+    if incremental or resume:
+        log.info(f"{'Incremental update of' if incremental else 'Resuming'} project: {proj_path}")
+        doc.open(proj_path, read_only=False, ignore_lock=True)
+        chunk = find_chunk(doc, chunk_label)
+        if chunk is None:
+            log.warn(f"Chunk '{chunk_label}' not found in saved project; starting over")
+            incremental = False
+    if chunk is None:
+        try:
+            doc.clear()
+        except Exception:
+            pass
+        chunk = doc.addChunk()
+        chunk.label = chunk_label
+    if staged:
+        relink_staged(doc, staged, proj_path, log, cleanup)
+
+    inputs = SetupInputs(
+        photos=[staged.get(p, p) for p in photos],
+        rejected=({staged.get(p, p): why for p, why in rejected.items()}
+                  if preflight_cfg.get("action", "disable") == "disable" else {}),
+        masks={staged.get(p, p): r for p, r in masks.items()},
+        groups={name: [staged.get(p, p) for p in g] for name, g in groups.items()},
+        crs_epsg=epsg,
+        reference=reference_import if reference_cfg.get("enabled", False) else {},
+        staged=staged,
+    )
+    runner = GraphRunner(Metashape, doc, chunk, Graph(nodes, deps, order, keys, params), inputs, cfg, log,
+                         proj_path=proj_path, ckpt=ckpt, incremental=incremental, static=static, stamps=stamps,
+                         cache=cache, recorder=recorder, monitor=monitor, qc_path=qc_path,
+                         workflow_name=workflow_name)
+    runner.run(max_parallel)
+
+    log.info("DONE")
+
+def main(argv: list[str]) -> None:
+    args = [a for a in argv[1:] if a != "--plan"]
+    if args:
+        config_path = args[0]
+        # Optional second argument: workflow name (logs/<name>/), as passed by run_batch.py
+        workflow_name = args[1] if len(args) > 1 else os.path.splitext(os.path.basename(config_path))[0]
+        if "--plan" in argv[1:]:
+            plan(config_path=config_path, workflow_name=workflow_name)
+        else:
+            run(config_path=config_path, workflow_name=workflow_name)
+        return
+
+    # GUI-friendly fallback: run a default selector via workflow wrappers instead
+    raise RuntimeError("No config path provided. Use a workflow wrapper in workflows/<name>/run.py.")
+
+if __name__ == "__main__":
     main(sys.argv)
\ No newline at end of file
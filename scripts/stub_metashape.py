@@ -0,0 +1,81 @@
+"""
+Stand-in for the Metashape binary, for trying the batch scheduler without a
+licence or GPU:
+
+    python scripts/run_batch.py run --metashape-exe scripts/stub_metashape.py
+
+Takes the same "[-platform offscreen] -r <script> <config> [name]" command
+line. Instead of running the script it pretends to: prints progress for a
+while, writes logs/<name>/status.json like a real run and exits. Behaviour
+comes from the config's "stub" block, else environment variables:
+
+    seconds        METASHAPE_STUB_SECONDS        run time (default 3)
+    fail_attempts  METASHAPE_STUB_FAIL_ATTEMPTS  fail while the batch attempt is <= this (default 0)
+    memory_mb      METASHAPE_STUB_MEMORY_MB      memory to allocate (default 0)
+    exit_code      METASHAPE_STUB_EXIT_CODE      exit code of a failed run (default 1)
+"""
+from __future__ import annotations
+import json
+import os
+import sys
+import time
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+def _setting(stub: dict, key: str, default: float) -> float:
+    if key in stub:
+        return float(stub[key])
+    return float(os.environ.get(f"METASHAPE_STUB_{key.upper()}", default))
+
+def _write_status(path: str, state: str, **fields) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    rec = {"workflow": fields.pop("workflow", ""), "pid": os.getpid(), "state": state,
+           "updated": time.strftime("%Y-%m-%dT%H:%M:%S")}
+    rec.update(fields)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(rec, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+def main(argv: list[str]) -> int:
+    if "-r" not in argv:
+        print("stub_metashape: expected -r <script> [args]")
+        return 2
+    i = argv.index("-r")
+    script, args = argv[i + 1], argv[i + 2:]
+    if not args:
+        print(f"stub_metashape: {os.path.basename(script)} needs a config path")
+        return 2
+    config_path = args[0]
+    name = args[1] if len(args) > 1 else os.path.splitext(os.path.basename(config_path))[0]
+    with open(config_path, "r", encoding="utf-8") as f:
+        cfg = json.load(f)
+    stub = cfg.get("stub", {})
+    seconds = _setting(stub, "seconds", 3)
+    fail_attempts = int(_setting(stub, "fail_attempts", 0))
+    memory_mb = _setting(stub, "memory_mb", 0)
+    exit_code = int(_setting(stub, "exit_code", 1))
+    attempt = int(os.environ.get("MS_BATCH_ATTEMPT", "1"))
+
+    status = cfg.get("progress", {}).get("status_path", "") or os.path.join(REPO_ROOT, "logs", name, "status.json")
+    if not os.path.isabs(status):
+        status = os.path.join(REPO_ROOT, status)
+
+    print(f"stub_metashape: {script} {config_path} ({name}), attempt {attempt}, pid {os.getpid()}")
+    ballast = b"\x01" * int(memory_mb * 1024 * 1024)
+    steps = max(1, int(seconds * 2))
+    for n in range(steps):
+        _write_status(status, "running", workflow=name, progress=round(100.0 * n / steps, 1))
+        print(f"stub_metashape: progress {100.0 * n / steps:.0f}%", flush=True)
+        time.sleep(seconds / steps)
+    del ballast
+
+    if attempt <= fail_attempts:
+        _write_status(status, "failed", workflow=name)
+        print(f"stub_metashape: simulated failure on attempt {attempt}")
+        return exit_code
+    _write_status(status, "finished", workflow=name, progress=100.0)
+    print("stub_metashape: DONE")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
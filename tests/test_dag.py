@@ -0,0 +1,31 @@
+"""
+Graph scheduling (ms_pipeline.dag), no Metashape needed.
+
+    python -m pytest tests
+"""
+from __future__ import annotations
+import os
+import sys
+import threading
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "scripts"))
+
+from ms_pipeline.dag import run_graph  # noqa: E402
+
+def test_inline_node_does_not_hold_back_other_ready_nodes():
+    started = {"b": threading.Event()}
+    overlap = []
+
+    def run(i):
+        if i == "a":
+            # Running while b starts means b did not wait behind the inline node
+            overlap.append(started["b"].wait(5))
+        elif i == "b":
+            started["b"].set()
+        return i
+
+    order = ["a", "inline", "b"]
+    done = run_graph(order, {}, run, max_parallel=2, inline={"inline"})
+    assert set(done) == set(order)
+    assert overlap == [True]
@@ -0,0 +1,51 @@
+"""
+Export nodes of branching graphs run in workers (graph.max_parallel > 1).
+
+    python -m pytest tests
+"""
+from __future__ import annotations
+import os
+import sys
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.join(os.path.dirname(HERE), "scripts")
+sys.path.insert(0, SCRIPTS_DIR)
+sys.path.insert(0, os.path.join(SCRIPTS_DIR, "fake_metashape"))
+
+from ms_pipeline.dag import branch_heads, build_graph, topo_order  # noqa: E402
+from run_workflow import REGISTRY, _split_exports  # noqa: E402
+
+EXPORT = {
+    "report": {"enabled": True},
+    "rasters": [{"path": "dem.tif", "source_data": "ElevationData"}, {"path": "ortho.tif"}],
+    "model": {"enabled": True, "path": "model.obj"},
+}
+BRANCHES = ["setup", "align", "depth_maps", "point_cloud", "dem", "orthomosaic", "model", "uv", "texture"]
+
+def _graph(spec):
+    nodes, deps = build_graph(spec, REGISTRY, lambda s: EXPORT if s == "export" else {})
+    return nodes, deps, topo_order(list(nodes), deps)
+
+def test_implicit_export_is_split_per_branch():
+    spec = BRANCHES + ["export"]
+    split = _split_exports(spec, *_graph(spec))
+    nodes, deps, _ = _graph(split)
+    assert branch_heads("export_orthomosaic", deps) == ["orthomosaic"]
+    assert branch_heads("export", deps) == ["texture"]
+    ortho, tex = nodes["export_orthomosaic"].cfg, nodes["export"].cfg
+    assert [r["enabled"] for r in ortho["rasters"]] == [True, True]
+    assert not ortho["model"]["enabled"] and not ortho["report"]["enabled"]
+    assert [r["enabled"] for r in tex["rasters"]] == [False, False]
+    assert tex["model"]["enabled"] and tex["report"]["enabled"]
+
+def test_linear_export_is_kept():
+    spec = ["setup", "align", "depth_maps", "point_cloud", "dem", "orthomosaic",
+            {"id": "export", "step": "export", "config": {"model": {"enabled": False}}}]
+    assert _split_exports(spec, *_graph(spec)) is None
+
+def test_explicit_join_is_rejected():
+    spec = BRANCHES + [{"id": "exp", "step": "export"}]
+    with pytest.raises(ValueError, match="joins branches"):
+        _split_exports(spec, *_graph(spec))
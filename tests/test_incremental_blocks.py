@@ -0,0 +1,96 @@
+"""
+Incremental updates on the fake Metashape module (scripts/fake_metashape).
+
+    python -m pytest tests
+"""
+from __future__ import annotations
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.join(os.path.dirname(HERE), "scripts")
+sys.path.insert(0, SCRIPTS_DIR)
+sys.path.insert(0, os.path.join(SCRIPTS_DIR, "fake_metashape"))
+
+import Metashape  # noqa: E402  (the fake)
+from ms_pipeline.blocks import merged_label, split_and_build, update_blocks  # noqa: E402
+
+class _Log:
+    def __init__(self):
+        self.lines = []
+
+    def info(self, msg, **fields):
+        self.lines.append(msg)
+
+    warn = info
+
+SPLIT = {"enabled": True, "method": "grid", "target_cameras": 100, "overlap": 0.1,
+         "camera_margin": 0.1, "mode": "sequential", "keep_blocks": True}
+
+def test_update_blocks_tiles_cameras_past_the_old_blocks(tmp_path):
+    Metashape.configure(grid_columns=20, camera_spacing_m=20.0, tie_points_per_camera=10)
+    project = str(tmp_path / "project.psx")
+    proc = {"split_blocks": SPLIT}
+    log = _Log()
+    doc = Metashape.Document()
+    chunk = doc.addChunk()
+    chunk.label = "survey"
+    chunk.addPhotos([os.path.join(str(tmp_path), "a", f"IMG_{i:04d}.JPG") for i in range(200)])
+    chunk.alignCameras()
+    split_and_build(Metashape, doc, chunk, proc, project, log)
+    old = {c.label for c in doc.chunks if c.label.startswith("survey block ")}
+
+    # The next flight continues the camera grid beyond every old block
+    n_before = len(chunk.cameras)
+    chunk.addPhotos([os.path.join(str(tmp_path), "b", f"IMG_{i:04d}.JPG") for i in range(200)])
+    new = list(range(n_before, len(chunk.cameras)))
+    chunk.alignCameras()
+    merged = update_blocks(Metashape, doc, chunk, proc, project, new, log)
+
+    blocks = {c.label: c for c in doc.chunks if c.label.startswith("survey block ")}
+    added = set(blocks) - old
+    assert added, log.lines
+    new_paths = {chunk.cameras[i].photo.path for i in new}
+    for label in added:
+        assert {c.photo.path for c in blocks[label].cameras if c.enabled} & new_paths
+    assert merged.label == merged_label("survey")
+
+def _run(tmp_path, name):
+    import json
+    import shutil
+    from run_workflow import run
+
+    cfg = tmp_path / "config.json"
+    cfg.write_text(json.dumps({
+        "project": {"chunk_label": "survey", "project_path": str(tmp_path / "out" / "project.psx"), "incremental": True},
+        "input": {"photo_dirs": [str(tmp_path / "photos")], "photo_globs": ["*.jpg"]},
+        "processing": {"stage": "aerial_products"},
+        "export": {},
+    }))
+    logs = os.path.join(os.path.dirname(HERE), "logs", name)
+    try:
+        run(str(cfg), name)
+        with open(sorted(p for p in os.scandir(logs) if p.name.endswith(".log"))[-1].path, encoding="utf-8") as f:
+            return f.read()
+    finally:
+        shutil.rmtree(logs, ignore_errors=True)
+
+def test_photo_changed_in_place_reprocesses_everything(tmp_path):
+    Metashape.configure()
+    photos = tmp_path / "photos"
+    photos.mkdir()
+    for i in range(20):
+        (photos / f"IMG_{i:04d}.jpg").write_bytes(b"\xff\xd8" + bytes(i))
+    _run(tmp_path, "test_incremental_inplace")
+
+    # New photos only: the incremental path
+    for i in range(20, 25):
+        (photos / f"IMG_{i:04d}.jpg").write_bytes(b"\xff\xd8" + bytes(i))
+    text = _run(tmp_path, "test_incremental_inplace")
+    assert "Incremental: 5 new photos" in text
+
+    # Same name, new content: not a new camera, so everything is processed again
+    (photos / "IMG_0003.jpg").write_bytes(b"\xff\xd8 edited in place")
+    text = _run(tmp_path, "test_incremental_inplace")
+    assert "earlier photos or their masks changed" in text
+    assert "no new photos, skipping" not in text
@@ -0,0 +1,172 @@
+"""
+ProgressMonitor on the fake Metashape module (scripts/fake_metashape): log
+rate limiting, ETA, the stall alarm and the hard exit of headless runs.
+
+    python -m pytest tests
+"""
+from __future__ import annotations
+import json
+import os
+import sys
+import time
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.join(os.path.dirname(HERE), "scripts")
+sys.path.insert(0, SCRIPTS_DIR)
+sys.path.insert(0, os.path.join(SCRIPTS_DIR, "fake_metashape"))
+
+import Metashape  # noqa: E402  (the fake)
+from ms_pipeline.progress import ProgressMonitor, StalledError  # noqa: E402
+
+class _Log:
+    def __init__(self):
+        self.records = []
+
+    def info(self, msg, **fields):
+        self.records.append(("info", msg))
+
+    def warn(self, msg, **fields):
+        self.records.append(("warn", msg))
+
+    def error(self, msg, **fields):
+        self.records.append(("error", msg))
+
+    def messages(self, level):
+        return [m for lv, m in self.records if lv == level]
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def _chunk(cameras=8):
+    Metashape.configure(latency={"buildDepthMaps": 0.02})
+    chunk = Metashape.Document().addChunk()
+    chunk.addPhotos([f"/photos/IMG_{i:04d}.JPG" for i in range(cameras)])
+    chunk.alignCameras()
+    return chunk
+
+def _monitor(tmp_path, **kwargs):
+    log, clock = _Log(), _Clock()
+    kwargs.setdefault("stall_minutes", 1.0)
+    mon = ProgressMonitor(log, status_path=str(tmp_path / "status.json"), clock=clock, watchdog=False, **kwargs)
+    return mon, log, clock
+
+def _status(tmp_path):
+    with open(tmp_path / "status.json", "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def test_progress_is_logged_every_log_step(tmp_path):
+    mon, log, _ = _monitor(tmp_path, log_interval=3600, log_step=50)
+    chunk = _chunk()
+    # The fake reports 0, 25, 50, 75 and 100 %
+    chunk.buildDepthMaps(progress=mon.callback("buildDepthMaps"))
+    mon.finish()
+    assert [m.split(",")[0] for m in log.messages("info")] == ["buildDepthMaps: 50.0%", "buildDepthMaps: 100.0%"]
+    assert _status(tmp_path)["state"] == "done"
+
+def test_progress_is_logged_every_log_interval(tmp_path):
+    mon, log, clock = _monitor(tmp_path, log_interval=60, log_step=0)
+    progress = mon.callback("buildDepthMaps")
+    for p in (10, 20, 30):
+        clock.now += 20
+        progress(p)
+    clock.now += 20
+    progress(40)
+    assert log.messages("info") == ["buildDepthMaps: 30.0%, ETA 2m20s"]
+
+def test_eta_blends_history_with_observed_rate(tmp_path):
+    # History: 2 s/Mpix * 100 Mpix = 200 s for the whole op
+    mon, log, clock = _monitor(tmp_path, log_interval=0, status_interval=0, history={"buildDepthMaps": 2.0})
+    progress = mon.callback("buildDepthMaps", megapixels=100)
+    clock.now = 10
+    progress(0.5)
+    progress(10)
+    progress(50)
+    assert log.messages("info") == [
+        "buildDepthMaps: 0.5%, ETA 3m10s",   # history only
+        "buildDepthMaps: 10.0%, ETA 2m30s",  # 0.4 * 90 s observed + 0.6 * 190 s history
+        "buildDepthMaps: 50.0%, ETA 10s",    # observed rate only past 25%
+    ]
+    assert _status(tmp_path)["eta_s"] == 10.0
+
+def test_stall_alarm_and_resume(tmp_path):
+    mon, log, clock = _monitor(tmp_path, log_interval=3600, log_step=0)
+    progress = mon.callback("buildDepthMaps")
+    progress(20)
+    clock.now = 59
+    mon.check()
+    assert not log.messages("warn")
+    clock.now = 90
+    mon.check()
+    mon.check()
+    assert log.messages("warn") == ["buildDepthMaps: no progress for 1.5 min (at 20.0%)"]
+    assert _status(tmp_path)["state"] == "stalled"
+    progress(30)
+    assert log.messages("info") == ["buildDepthMaps: progress resumed at 30.0%"]
+
+def test_stall_abort_cancels_the_fake_call(tmp_path):
+    mon, log, clock = _monitor(tmp_path, stall_action="abort")
+    monitor_progress = mon.callback("buildDepthMaps")
+
+    def progress(p):
+        monitor_progress(p)
+        if p >= 50:
+            # The call hangs: no progress for longer than the stall timeout
+            clock.now += 61
+            mon.check()
+
+    chunk = _chunk()
+    with pytest.raises(StalledError, match="no progress for 1 min, aborting"):
+        chunk.buildDepthMaps(progress=progress)
+    assert log.messages("warn") == ["buildDepthMaps: no progress for 1.0 min (at 50.0%)"]
+    assert not log.messages("error")
+
+def test_hard_exit_after_two_stall_periods(tmp_path, monkeypatch):
+    codes = []
+
+    def fake_exit(code):
+        codes.append(code)
+        raise SystemExit(code)
+
+    monkeypatch.setattr(os, "_exit", fake_exit)
+    mon, log, clock = _monitor(tmp_path, stall_action="abort", hard_exit=True)
+    mon.callback("buildDepthMaps")(40)
+    clock.now = 61
+    mon.check()
+    assert codes == []
+    clock.now = 121
+    with pytest.raises(SystemExit):
+        mon.check()
+    assert codes == [75]
+    assert log.messages("error") == ["buildDepthMaps: still no progress after 2.0 min, exiting"]
+    assert _status(tmp_path)["state"] == "stalled"
+
+def test_no_hard_exit_without_headless(tmp_path, monkeypatch):
+    monkeypatch.setattr(os, "_exit", lambda code: pytest.fail(f"os._exit({code})"))
+    mon, log, clock = _monitor(tmp_path, stall_action="abort")
+    progress = mon.callback("buildDepthMaps")
+    progress(40)
+    clock.now = 121
+    mon.check()
+    assert len(log.messages("error")) == 1
+    with pytest.raises(StalledError):
+        progress(41)
+
+def test_watchdog_thread_raises_the_alarm(tmp_path):
+    # Real clock: the watchdog polls every second at most
+    log = _Log()
+    mon = ProgressMonitor(log, stall_minutes=0.01)
+    try:
+        mon.callback("buildDepthMaps")(10)
+        for _ in range(30):
+            if log.messages("warn"):
+                break
+            time.sleep(0.1)
+    finally:
+        mon.close()
+    assert log.messages("warn")[0].startswith("buildDepthMaps: no progress for")
@@ -0,0 +1,32 @@
+"""
+QC metrics on the fake Metashape module (scripts/fake_metashape).
+
+    python -m pytest tests
+"""
+from __future__ import annotations
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.join(os.path.dirname(HERE), "scripts")
+sys.path.insert(0, SCRIPTS_DIR)
+sys.path.insert(0, os.path.join(SCRIPTS_DIR, "fake_metashape"))
+
+import Metashape  # noqa: E402  (the fake)
+from ms_pipeline.qc import evaluate_gates, qc_metrics  # noqa: E402
+
+def test_aligned_fraction_ignores_disabled_cameras():
+    Metashape.configure()
+    chunk = Metashape.Document().addChunk()
+    chunk.addPhotos([f"/photos/IMG_{i:04d}.JPG" for i in range(10)])
+    chunk.alignCameras()
+    for cam in chunk.cameras[:4]:
+        cam.enabled = False
+    chunk.cameras[4].transform = None
+
+    cams = qc_metrics(Metashape, chunk, {})["cameras"]
+    assert (cams["enabled"], cams["aligned"]) == (6, 5)
+    assert cams["aligned_fraction"] == round(5 / 6.0, 4)
+    gate = [g for g in evaluate_gates(qc_metrics(Metashape, chunk, {}), {"min_aligned_fraction": 0.95})
+            if g["gate"] == "min_aligned_fraction"]
+    assert gate[0]["passed"] is False
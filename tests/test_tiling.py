@@ -0,0 +1,103 @@
+"""
+Block partitioning of camera positions (split_blocks): grid and k-d tree
+cells, overlap and cameras per block.
+
+    python -m pytest tests
+"""
+from __future__ import annotations
+import os
+import sys
+
+import numpy as np
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPTS_DIR = os.path.join(os.path.dirname(HERE), "scripts")
+sys.path.insert(0, SCRIPTS_DIR)
+
+from ms_pipeline.tiling import grid_blocks, kdtree_blocks, make_blocks, points_in  # noqa: E402
+
+def _lattice(nx, ny, spacing=20.0):
+    return np.array([(i * spacing, j * spacing) for j in range(ny) for i in range(nx)], dtype=np.float64)
+
+def _uneven(seed=0):
+    # Sparse survey area with a dense core (e.g. an extra flight over a site)
+    rng = np.random.default_rng(seed)
+    return np.vstack([rng.uniform(0, 1000, (200, 2)), rng.uniform(400, 500, (400, 2))])
+
+def _area(b):
+    return (b[2] - b[0]) * (b[3] - b[1])
+
+def _inside(xy, b):
+    return (xy[:, 0] > b[0]) & (xy[:, 0] < b[2]) & (xy[:, 1] > b[1]) & (xy[:, 1] < b[3])
+
+def _check_tiles(xy, blocks, overlap):
+    # Core tiles cover every camera and do not overlap each other
+    covered = np.zeros(len(xy), dtype=bool)
+    for b in blocks:
+        covered |= points_in(xy, b.bounds)
+    assert covered.all()
+    for a in blocks:
+        for b in blocks:
+            if a.index < b.index:
+                w = min(a.bounds[2], b.bounds[2]) - max(a.bounds[0], b.bounds[0])
+                h = min(a.bounds[3], b.bounds[3]) - max(a.bounds[1], b.bounds[1])
+                assert w <= 1e-9 or h <= 1e-9
+    assert [b.index for b in blocks] == list(range(len(blocks)))
+    for b in blocks:
+        dx = (b.bounds[2] - b.bounds[0]) * overlap
+        dy = (b.bounds[3] - b.bounds[1]) * overlap
+        assert b.padded == pytest.approx((b.bounds[0] - dx, b.bounds[1] - dy, b.bounds[2] + dx, b.bounds[3] + dy))
+        # Every camera of the core tile is used, plus the ones around it
+        core = np.flatnonzero(points_in(xy, b.bounds))
+        assert set(core) <= set(b.cameras.tolist())
+
+def test_grid_cells_hold_about_target_cameras():
+    xy = _lattice(20, 10)
+    blocks = grid_blocks(xy, target=50, overlap=0.1)
+    _check_tiles(xy, blocks, 0.1)
+    assert len(blocks) >= len(xy) // 50
+    assert max(int(_inside(xy, b.bounds).sum()) for b in blocks) <= 50
+    # Same-size cells over the camera extent
+    assert len({round(_area(b.bounds), 6) for b in blocks}) == 1
+
+def test_grid_drops_empty_cells():
+    # Two clusters at opposite corners: the cells between them hold no camera
+    xy = np.vstack([_lattice(5, 5), _lattice(5, 5) + 1000.0])
+    blocks = grid_blocks(xy, target=10)
+    assert len(blocks) == 2
+    assert all(points_in(xy, b.bounds).any() for b in blocks)
+    _check_tiles(xy, blocks, 0.1)
+
+def test_kdtree_cells_hold_at_most_target_cameras():
+    xy = _uneven()
+    blocks = kdtree_blocks(xy, target=60, overlap=0.15)
+    _check_tiles(xy, blocks, 0.15)
+    counts = [int(_inside(xy, b.bounds).sum()) for b in blocks]
+    assert max(counts) <= 60
+    # Adapts to density: the dense core gets smaller cells than the sparse area
+    areas = sorted(_area(b.bounds) for b in blocks)
+    assert areas[-1] > 10 * areas[0]
+
+def test_kdtree_splits_a_camera_line():
+    xy = np.column_stack([np.arange(100, dtype=np.float64) * 5.0, np.zeros(100)])
+    blocks = kdtree_blocks(xy, target=25)
+    assert len(blocks) == 4
+    _check_tiles(xy, blocks, 0.1)
+
+def test_overlap_shares_cameras_between_neighbours():
+    xy = _lattice(20, 1)
+    tight = kdtree_blocks(xy, target=10, overlap=0.0, camera_margin=0.0)
+    wide = kdtree_blocks(xy, target=10, overlap=0.2, camera_margin=0.1)
+    assert [len(b.cameras) for b in tight] == [10, 10]
+    # 30% of a 190 m wide tile reaches 3 lattice columns into the neighbour
+    assert [len(b.cameras) for b in wide] == [13, 13]
+    assert set(wide[0].cameras.tolist()) & set(wide[1].cameras.tolist()) == set(range(7, 13))
+
+def test_make_blocks():
+    xy = _lattice(10, 10)
+    assert [b.bounds for b in make_blocks(xy, "grid", 25)] == [b.bounds for b in grid_blocks(xy, 25)]
+    assert [b.bounds for b in make_blocks(xy, "kdtree", 25)] == [b.bounds for b in kdtree_blocks(xy, 25)]
+    assert make_blocks(np.zeros((0, 2)), "grid", 25) == []
+    with pytest.raises(ValueError, match="Unknown split_blocks.method"):
+        make_blocks(xy, "hex", 25)